@@ -31,15 +31,39 @@
 
 
 def ReadRecord (inFilename, outFilename):
-
-    dt = 0.0
-    npts = 0
     
     # Open the input file and catch the error if it can't be read
     inFileID = open(inFilename, 'r')
     
     # Open output file for writing
     outFileID = open(outFilename, 'w')
+    
+    dt, npts = EchoRecord(inFileID, outFileID)
+
+    inFileID.close()
+    outFileID.close()
+
+    return dt, npts
+
+# Same parsing as ReadRecord, but returns the data values as an array instead
+# of writing them to a file
+def ReadRecordValues (inFilename):
+    import io
+    import numpy as np
+    
+    outBuffer = io.StringIO()
+    with open(inFilename, 'r') as inFileID:
+        dt, npts = EchoRecord(inFileID, outBuffer)
+    
+    values = np.array(outBuffer.getvalue().split(), dtype=float)
+    
+    return dt, npts, values
+
+# Echo the data lines of an open PEER record to an open output stream
+def EchoRecord (inFileID, outFileID):
+
+    dt = 0.0
+    npts = 0
 	
     # Flag indicating dt is found and that ground motion
     # values should be read -- ASSUMES dt is on last line
@@ -97,9 +121,4 @@ def ReadRecord (inFilename, outFilename):
 
                             count += 1
 
-                        
-
-    inFileID.close()
-    outFileID.close()
-
     return dt, npts
@@ -18,9 +18,23 @@
 class Building:
         
     # import attributes as building characteristics from pd.Series
+    # per-level columns of the batch design tables are put back together as
+    # arrays and load case dicts (see loads.level_values)
     def __init__(self, design):
+        from loads import (level_values, load_case_values, load_case_prefix,
+                           load_case_names, gravity_level_names,
+                           lateral_level_names)
+        
         for key, value in design.items():
             setattr(self, key, value)
+        
+        for name in gravity_level_names + lateral_level_names:
+            if (name not in design.index) and (name+'_0' in design.index):
+                setattr(self, name, level_values(design, name))
+        for cases_name, prefix in load_case_prefix.items():
+            if ((cases_name not in design.index) and 
+                (prefix+load_case_names[0]+'_0' in design.index)):
+                setattr(self, cases_name, load_case_values(design, cases_name))
             
     def floating_nodes(self):
         import opensees.openseespy as ops
@@ -2833,7 +2847,8 @@ class Building:
 
     def run_ground_motion(self, gm_name, scale_factor, dt_transient, T_end=60.0,
                           gm_dir='../resource/ground_motions/PEERNGARecords_Unscaled/',
-                          data_dir='./outputs/'):
+                          data_dir='./outputs/', debug=False,
+                          dt_ladder=(), restart_window=1.0):
         
         # Recorders
         import opensees.openseespy as ops
@@ -2883,39 +2898,40 @@ class Building:
                          '-dof', 1, 3, 'reaction')
             '''
             
-            # first story, leftmost bay, left brace
-            brace_ghosts = self.elem_tags['brace_ghosts']
-            bottom_left_ghost = min(brace_ghosts)
-            bottom_right_ghost = bottom_left_ghost + 98
-            ops.recorder('Element','-ele', bottom_left_ghost,
-                         '-file',data_dir+'left_ghost_deformation.csv', '-time',
-                         'deformations')
-            ops.recorder('Element','-ele', bottom_right_ghost,
-                         '-file',data_dir+'right_ghost_deformation.csv', '-time',
-                         'deformations')
-            
-            # first story, leftmost bay, left brace
-            braces = self.elem_tags['brace']
-            bottom_left_brace = min(braces)
-            # corresponding right brace 
-            bottom_right_brace = bottom_left_brace + 10
-            
-            selected_brace = get_shape(self.brace[0],'brace')
-            d_brace = selected_brace.iloc[0]['b']
-            
-            ops.recorder('Element','-ele', bottom_left_brace,
-                         '-file',data_dir+'brace_left_str.csv', '-time',
-                         'section','fiber', 0.0, -d_brace/2, 'stressStrain')
-            
-            ops.recorder('Element','-ele', bottom_right_brace,
-                         '-file',data_dir+'brace_right_str.csv', '-time',
-                         'section','fiber', 0.0, -d_brace/2, 'stressStrain')
-            
-            ops.recorder('Element','-ele', bottom_left_brace, '-time',
-                         '-file',data_dir+'brace_left_force.csv', 'basicForce')
-            
-            ops.recorder('Element','-ele', bottom_right_brace, '-time',
-                         '-file',data_dir+'brace_right_force.csv', 'basicForce')
+            if debug:
+                # first story, leftmost bay, left brace
+                brace_ghosts = self.elem_tags['brace_ghosts']
+                bottom_left_ghost = min(brace_ghosts)
+                bottom_right_ghost = bottom_left_ghost + 98
+                ops.recorder('Element','-ele', bottom_left_ghost,
+                             '-file',data_dir+'left_ghost_deformation.csv', '-time',
+                             'deformations')
+                ops.recorder('Element','-ele', bottom_right_ghost,
+                             '-file',data_dir+'right_ghost_deformation.csv', '-time',
+                             'deformations')
+            
+                # first story, leftmost bay, left brace
+                braces = self.elem_tags['brace']
+                bottom_left_brace = min(braces)
+                # corresponding right brace 
+                bottom_right_brace = bottom_left_brace + 10
+            
+                selected_brace = get_shape(self.brace[0],'brace')
+                d_brace = selected_brace.iloc[0]['b']
+            
+                ops.recorder('Element','-ele', bottom_left_brace,
+                             '-file',data_dir+'brace_left_str.csv', '-time',
+                             'section','fiber', 0.0, -d_brace/2, 'stressStrain')
+            
+                ops.recorder('Element','-ele', bottom_right_brace,
+                             '-file',data_dir+'brace_right_str.csv', '-time',
+                             'section','fiber', 0.0, -d_brace/2, 'stressStrain')
+            
+                ops.recorder('Element','-ele', bottom_left_brace, '-time',
+                             '-file',data_dir+'brace_left_force.csv', 'basicForce')
+            
+                ops.recorder('Element','-ele', bottom_right_brace, '-time',
+                             '-file',data_dir+'brace_right_force.csv', 'basicForce')
             
         else:
             floor_nodes = self.node_tags['floor']
@@ -2943,72 +2959,75 @@ class Building:
         # open(data_dir+'model.out', 'w').close()
         # ops.printModel('-file', data_dir+'model.out')
         
-        # lateral frame story displacement
-        ops.recorder('Node', '-file', data_dir+'outer_col_disp.csv','-time',
-                     '-node', *outer_col_nds, '-dof', 1, 'disp')
-        ops.recorder('Node', '-file', data_dir+'inner_col_disp.csv','-time',
-                     '-node', *inner_col_nds, '-dof', 1, 'disp')
-        
-        # vertical frame story displacement
-        ops.recorder('Node', '-file', data_dir+'outer_col_vert.csv','-time',
-                     '-node', *outer_col_nds, '-dof', 3, 'disp')
-        ops.recorder('Node', '-file', data_dir+'inner_col_vert.csv','-time',
-                     '-node', *inner_col_nds, '-dof', 3, 'disp')
-        
-        # lateral frame story velocity
-        ops.recorder('Node', '-file', data_dir+'outer_col_vel.csv','-time',
-                     '-node', *outer_col_nds, '-dof', 1, 'vel')
-        ops.recorder('Node', '-file', data_dir+'inner_col_vel.csv','-time',
-                     '-node', *inner_col_nds, '-dof', 1, 'vel')
-        
-        
-        # isolator node displacement of outer column
-        ops.recorder('Node', '-file', data_dir+'isolator_displacement.csv', 
-                     '-time', '-node', isol_node, '-dof', 1, 3, 5, 'disp')
-        
-        # isolator response of beneath outer column
-        ops.recorder('Element', '-file', data_dir+'isolator_forces.csv',
-                     '-time', '-ele', isol_elem, 'localForce')
-        
-        base_nodes = self.node_tags['base']
-        
-        if isol_system == 'LRB':
-            ops.recorder('Node', '-file', data_dir+'lrb_disp.csv', 
-                         '-time', '-node', *isol_nodes_all, '-dof', 1, 'disp')
-        elif isol_system == 'TFP':
-            ops.recorder('Node', '-file', data_dir+'tfp_disp.csv', 
-                         '-time', '-node', *isol_nodes_all, '-dof', 1, 'disp')
-            ops.recorder('Node', '-file', data_dir+'tfp_base_vert.csv', 
+        # full time histories are only written for debugging
+        # (see plot_structure); otherwise EDPs are tracked in-process
+        if debug:
+            # lateral frame story displacement
+            ops.recorder('Node', '-file', data_dir+'outer_col_disp.csv','-time',
+                         '-node', *outer_col_nds, '-dof', 1, 'disp')
+            ops.recorder('Node', '-file', data_dir+'inner_col_disp.csv','-time',
+                         '-node', *inner_col_nds, '-dof', 1, 'disp')
+        
+            # vertical frame story displacement
+            ops.recorder('Node', '-file', data_dir+'outer_col_vert.csv','-time',
+                         '-node', *outer_col_nds, '-dof', 3, 'disp')
+            ops.recorder('Node', '-file', data_dir+'inner_col_vert.csv','-time',
+                         '-node', *inner_col_nds, '-dof', 3, 'disp')
+        
+            # lateral frame story velocity
+            ops.recorder('Node', '-file', data_dir+'outer_col_vel.csv','-time',
+                         '-node', *outer_col_nds, '-dof', 1, 'vel')
+            ops.recorder('Node', '-file', data_dir+'inner_col_vel.csv','-time',
+                         '-node', *inner_col_nds, '-dof', 1, 'vel')
+        
+        
+            # isolator node displacement of outer column
+            ops.recorder('Node', '-file', data_dir+'isolator_displacement.csv', 
+                         '-time', '-node', isol_node, '-dof', 1, 3, 5, 'disp')
+        
+            # isolator response of beneath outer column
+            ops.recorder('Element', '-file', data_dir+'isolator_forces.csv',
+                         '-time', '-ele', isol_elem, 'localForce')
+        
+            base_nodes = self.node_tags['base']
+        
+            if isol_system == 'LRB':
+                ops.recorder('Node', '-file', data_dir+'lrb_disp.csv', 
+                             '-time', '-node', *isol_nodes_all, '-dof', 1, 'disp')
+            elif isol_system == 'TFP':
+                ops.recorder('Node', '-file', data_dir+'tfp_disp.csv', 
+                             '-time', '-node', *isol_nodes_all, '-dof', 1, 'disp')
+                ops.recorder('Node', '-file', data_dir+'tfp_base_vert.csv', 
+                             '-time', '-node', 
+                             *base_nodes, '-dof', 3, 'reaction')
+        
+            ops.recorder('Node', '-file', data_dir+'base_rxn.csv', 
                          '-time', '-node', 
-                         *base_nodes, '-dof', 3, 'reaction')
+                         *base_nodes, '-dof', 1, 'reaction')
         
-        ops.recorder('Node', '-file', data_dir+'base_rxn.csv', 
-                     '-time', '-node', 
-                     *base_nodes, '-dof', 1, 'reaction')
+            ops.recorder('Node', '-file', data_dir+'diaph_rxn.csv', 
+                         '-time', '-node', 
+                         *isol_nodes_all, '-dof', 1, 'reaction')
         
-        ops.recorder('Node', '-file', data_dir+'diaph_rxn.csv', 
-                     '-time', '-node', 
-                     *isol_nodes_all, '-dof', 1, 'reaction')
+            story_1_nodes = [x+10 for x in isol_nodes_all]
         
-        story_1_nodes = [x+10 for x in isol_nodes_all]
+            ops.recorder('Node', '-file', data_dir+'story_1_rxn.csv', 
+                         '-time', '-node', 
+                         *story_1_nodes, '-dof', 1, 'reaction')
         
-        ops.recorder('Node', '-file', data_dir+'story_1_rxn.csv', 
-                     '-time', '-node', 
-                     *story_1_nodes, '-dof', 1, 'reaction')
+            # gusset plate?
+            # beam force?
+            # column force?
         
-        # gusset plate?
-        # beam force?
-        # column force?
+            ops.recorder('Element', '-file', data_dir+'impact_forces.csv', 
+                         '-time', '-ele', *walls, 'basicForce')
+            ops.recorder('Element', '-file', data_dir+'impact_disp.csv', 
+                         '-time', '-ele', *walls, 'basicDeformation')
         
-        ops.recorder('Element', '-file', data_dir+'impact_forces.csv', 
-                     '-time', '-ele', *walls, 'basicForce')
-        ops.recorder('Element', '-file', data_dir+'impact_disp.csv', 
-                     '-time', '-ele', *walls, 'basicDeformation')
-        
-        # diaphragm?
-        diaph_elems = self.elem_tags['diaphragm']
-        ops.recorder('Element', '-file', data_dir+'diaphragm_forces.csv', 
-                     '-time', '-ele', diaph_elems[0], 'basicForce')
+            # diaphragm?
+            diaph_elems = self.elem_tags['diaphragm']
+            ops.recorder('Element', '-file', data_dir+'diaphragm_forces.csv', 
+                         '-time', '-ele', diaph_elems[0], 'basicForce')
         
         # leaning column?
         
@@ -3084,12 +3103,9 @@ class Building:
         # the following commands are unique to the Uniform Earthquake excitation
 
         # Uniform EXCITATION: acceleration input
-        inFile = gm_dir + gm_name + '.AT2'
-        outFile = gm_dir + gm_name + '.g3'
-
-         # call procedure to convert the ground-motion file
-        from ReadRecord import ReadRecord
-        dt, nPts = ReadRecord(inFile, outFile)
+        # read from the packed record archive (falls back to the .AT2 file)
+        from gms import load_record
+        dt, gm_values = load_record(gm_name, gm_dir)
         g = 386.4
         GMfatt = g*scale_factor
 
@@ -3097,18 +3113,64 @@ class Building:
         eq_pattern_tag = 400
         # time series information
         ops.timeSeries('Path', eq_series_tag, '-dt', dt, 
-                       '-filePath', outFile, '-factor', GMfatt)     
+                       '-values', *gm_values.tolist(), '-factor', GMfatt)     
         # create uniform excitation
         ops.pattern('UniformExcitation', eq_pattern_tag, 
                     GMDirection, '-accel', eq_series_tag)          
 
-        # set recorder for absolute acceleration (requires time series defined)
-        ops.recorder('Node', '-file', data_dir+'outer_col_acc.csv',
-                     '-timeSeries', eq_series_tag, '-time',
-                     '-node', *outer_col_nds, '-dof', 1, 'accel')
-        ops.recorder('Node', '-file', data_dir+'inner_col_acc.csv',
-                     '-timeSeries', eq_series_tag, '-time',
-                     '-node', *inner_col_nds, '-dof', 1, 'accel')
+        # full time histories are only written for debugging
+        if debug:
+            # set recorder for absolute acceleration (requires time series defined)
+            ops.recorder('Node', '-file', data_dir+'outer_col_acc.csv',
+                         '-timeSeries', eq_series_tag, '-time',
+                         '-node', *outer_col_nds, '-dof', 1, 'accel')
+            ops.recorder('Node', '-file', data_dir+'inner_col_acc.csv',
+                         '-timeSeries', eq_series_tag, '-time',
+                         '-node', *inner_col_nds, '-dof', 1, 'accel')
+        
+        # running peaks of the EDPs, collected by run_nlth after the run
+        from edp import EDPTracker
+        if superstructure_system == 'MF':
+            ok_thresh = 0.20
+        else:
+            ok_thresh = 0.10
+        tracker = EDPTracker(outer_col_nds, inner_col_nds, isol_node, walls,
+                             h_story, dt, gm_values, GMfatt, ok_thresh)
+        self.edp_tracker = tracker
+        
+        # phase times and counters go to the run profile (see profiling.py)
+        profile = getattr(self, 'profile', None)
+        if profile is None:
+            from profiling import RunProfile
+            profile = RunProfile()
+            self.profile = profile
+        
+        # time in analyze is booked to the algorithm in use
+        current_algorithm = [algorithmTypeDynamic]
+        def switch_algorithm(name):
+            if name != current_algorithm[0]:
+                profile.count('algorithm_switches')
+            current_algorithm[0] = name
+            ops.algorithm(name)
+        
+        # step one at a time so that the tracker sees every committed state
+        # stops at the first failed step, same as ops.analyze(n, dt)
+        def analyze(n, dt_step):
+            import time
+            if dt_step < dt_transient:
+                profile.count('dt_cuts')
+            t_steps = time.time()
+            ok = 0
+            for i in range(n):
+                profile.count('steps')
+                ok = ops.analyze(1, dt_step)
+                if ok != 0:
+                    profile.count('failed_steps')
+                    break
+                tracker.update()
+            profile.add_time('algorithm_'+current_algorithm[0], 
+                             time.time() - t_steps)
+            return(ok)
         
         import numpy as np
         n_steps = int(np.floor(T_end/dt_transient))
@@ -3119,18 +3181,40 @@ class Building:
         t0 = time.time()
         
         # Convergence loop, careful with Broyden/BFGS with energy
-        ok = ops.analyze(n_steps, dt_transient)   
+        with profile.phase('transient'):
+            ok = analyze(n_steps, dt_transient)   
         
         # drift limits triggering halt to analysis
         cbf_drift_limit = 0.10
         mf_drift_limit = 0.20
         
+        # warm restart: a failed step leaves the model at its last converged
+        # state, so only the failing window is redone with the smaller time
+        # steps of dt_ladder, instead of rebuilding and rerunning the record
+        def retry_window(base_algorithm):
+            ok = -1
+            profile.count('warm_restarts')
+            t_retry = time.time()
+            for dt_retry in dt_ladder:
+                t_window = min(restart_window, T_end - ops.getTime())
+                n_retry = max(int(np.ceil(t_window/dt_retry)), 1)
+                print('Retrying the next %.2f s with dt = %.4f ...' %
+                      (t_window, dt_retry))
+                switch_algorithm(base_algorithm)
+                ok = analyze(n_retry, dt_retry)
+                if ok == 0:
+                    print("That worked. Back to regular dt.")
+                    break
+            profile.add_time('warm_restart', time.time() - t_retry)
+            return(ok)
+        
         # if good collapse, halt. if non-convergent collapse, discard and retry
         if superstructure_system == 'MF':
             collapse_status = determine_collapse(outer_col_nds, h_story, mf_drift_limit)
         else:
             collapse_status = determine_collapse(outer_col_nds, h_story, cbf_drift_limit)
         
+        profile.set('collapse_status', collapse_status)
         if collapse_status == 'collapse':
             ok = 0
             print('Collapse occurred (MF drift 0.2 | CBF drift 0.1).')
@@ -3143,11 +3227,15 @@ class Building:
             print('Drift is beyond convergence. Ending...')
             print('Ground motion done. End time: %.4f s' % t_final)
             print('Analysis time elapsed %dm %ds.' % (minutes, seconds))
+            # close the recorders so their files are complete on return
+            ops.remove('recorders')
             ops.wipe()
             return(ok)
             
         # If analysis failed reasonably
+        t_fallback = time.time()
         if ok != 0:
+            profile.count('fallbacks')
             ops.analysis('Transient')
             curr_time = ops.getTime()
             print("Convergence issues at time: ", curr_time)
@@ -3157,7 +3245,7 @@ class Building:
                 ok = 0
                 while (curr_time < T_end) and (ok == 0):
                     curr_time     = ops.getTime()
-                    ok = ops.analyze(1, dt_transient)
+                    ok = analyze(1, dt_transient)
                         
                     if ok != 0:
                         collapse_status = determine_collapse(
@@ -3171,11 +3259,11 @@ class Building:
                             ok = -3
                             break
                         print("Trying Newton with line search ...")
-                        ops.algorithm('NewtonLineSearch')
-                        ok = ops.analyze(1, dt_transient)
+                        switch_algorithm('NewtonLineSearch')
+                        ok = analyze(1, dt_transient)
                         if ok == 0:
                             print("That worked. Back to Newton")
-                            ops.algorithm('Newton')
+                            switch_algorithm('Newton')
                     if ok != 0:
                         collapse_status = determine_collapse(
                             outer_col_nds, h_story, mf_drift_limit)
@@ -3189,11 +3277,11 @@ class Building:
                             break
                         print('Trying Broyden ... ')
                         algorithmTypeDynamic = 'Broyden'
-                        ops.algorithm(algorithmTypeDynamic)
-                        ok = ops.analyze(1, dt_transient)
+                        switch_algorithm(algorithmTypeDynamic)
+                        ok = analyze(1, dt_transient)
                         if ok == 0:
                             print("That worked. Back to Newton")
-                            ops.algorithm('Newton')
+                            switch_algorithm('Newton')
                     if ok != 0:
                         collapse_status = determine_collapse(
                             outer_col_nds, h_story, mf_drift_limit)
@@ -3207,16 +3295,28 @@ class Building:
                             break
                         print('Trying BFGS ... ')
                         algorithmTypeDynamic = 'BFGS'
-                        ops.algorithm(algorithmTypeDynamic)
-                        ok = ops.analyze(1, dt_transient)
+                        switch_algorithm(algorithmTypeDynamic)
+                        ok = analyze(1, dt_transient)
                         if ok == 0:
                             print("That worked. Back to Newton")
-                            ops.algorithm('Newton')
+                            switch_algorithm('Newton')
+                    if ok != 0 and len(dt_ladder) > 0:
+                        collapse_status = determine_collapse(
+                            outer_col_nds, h_story, mf_drift_limit)
+                        if collapse_status == 'collapse':
+                            print('Collapse triggered.')
+                            ok = 0
+                            break
+                        elif collapse_status == 'non-convergence':
+                            print('Drift is beyond convergence. Ending...')
+                            ok = -3
+                            break
+                        ok = retry_window('Newton')
             else:
                 ok = 0
                 while (curr_time < T_end) and (ok == 0):
                     curr_time     = ops.getTime()
-                    ok = ops.analyze(1, dt_transient)
+                    ok = analyze(1, dt_transient)
                     
                     if ok != 0:
                         collapse_status = determine_collapse(
@@ -3231,11 +3331,11 @@ class Building:
                             break
                         
                         print("Trying Newton with line search ...")
-                        ops.algorithm('NewtonLineSearch')
-                        ok = ops.analyze(1, dt_transient)
+                        switch_algorithm('NewtonLineSearch')
+                        ok = analyze(1, dt_transient)
                         if ok == 0:
                             print("That worked. Back to KrylovNewton")
-                            ops.algorithm('KrylovNewton')
+                            switch_algorithm('KrylovNewton')
                     if ok != 0:
                         collapse_status = determine_collapse(
                             outer_col_nds, h_story, cbf_drift_limit)
@@ -3248,11 +3348,11 @@ class Building:
                             ok = -3
                             break
                         print('Trying Broyden ... ')
-                        ops.algorithm('Broyden')
-                        ok = ops.analyze(1, dt_transient)
+                        switch_algorithm('Broyden')
+                        ok = analyze(1, dt_transient)
                         if ok == 0:
                             print("That worked. Back to KrylovNewton")
-                            ops.algorithm('KrylovNewton')
+                            switch_algorithm('KrylovNewton')
                     if ok != 0:
                         collapse_status = determine_collapse(
                             outer_col_nds, h_story, cbf_drift_limit)
@@ -3265,11 +3365,11 @@ class Building:
                             ok = -3
                             break
                         print('Trying BFGS ... ')
-                        ops.algorithm('BFGS')
-                        ok = ops.analyze(1, dt_transient)
+                        switch_algorithm('BFGS')
+                        ok = analyze(1, dt_transient)
                         if ok == 0:
                             print("That worked. Back to KrylovNewton")
-                            ops.algorithm('KrylovNewton')
+                            switch_algorithm('KrylovNewton')
                     if ok != 0:
                         collapse_status = determine_collapse(
                             outer_col_nds, h_story, cbf_drift_limit)
@@ -3283,8 +3383,8 @@ class Building:
                             break
                         curr_time     = ops.getTime()
                         print("Trying KrylovNewton with 1/5 dt for 10 steps ...")
-                        ops.algorithm('KrylovNewton')
-                        ok = ops.analyze(10, dt_transient/5.0)
+                        switch_algorithm('KrylovNewton')
+                        ok = analyze(10, dt_transient/5.0)
                         if ok == 0:
                             print("That worked. Back to regular dt.")
                     if ok != 0:
@@ -3300,8 +3400,8 @@ class Building:
                             break
                         curr_time     = ops.getTime()
                         print("Trying KrylovNewton with 1/10 dt for 10 steps ...")
-                        ops.algorithm('KrylovNewton')
-                        ok = ops.analyze(10, dt_transient/10.0)
+                        switch_algorithm('KrylovNewton')
+                        ok = analyze(10, dt_transient/10.0)
                         if ok == 0:
                             print("That worked. Back to regular dt.")
                     if ok != 0:
@@ -3317,10 +3417,22 @@ class Building:
                             break
                         curr_time     = ops.getTime()
                         print("Trying KrylovNewton with 1/100 dt for 10 steps ...")
-                        ops.algorithm('KrylovNewton')
-                        ok = ops.analyze(10, dt_transient/100.0)
+                        switch_algorithm('KrylovNewton')
+                        ok = analyze(10, dt_transient/100.0)
                         if ok == 0:
                             print("That worked. Back to regular dt.")
+                    if ok != 0 and len(dt_ladder) > 0:
+                        collapse_status = determine_collapse(
+                            outer_col_nds, h_story, cbf_drift_limit)
+                        if collapse_status == 'collapse':
+                            print('Collapse triggered.')
+                            ok = 0
+                            break
+                        elif collapse_status == 'non-convergence':
+                            print('Drift is beyond convergence. Ending...')
+                            ok = -3
+                            break
+                        ok = retry_window('KrylovNewton')
                     if ok != 0:
                         print('CBF convergence loop exhausted. Ending run...')
             '''
@@ -3444,12 +3556,17 @@ class Building:
             #         if ok != 0:
             #             print('CBF convergence loop exhausted. Ending run...')
                 
+        profile.add_time('fallback', time.time() - t_fallback)
+        profile.set('collapse_status', collapse_status)
+        
         t_final = ops.getTime()
         tp = time.time() - t0
         minutes = tp//60
         seconds = tp - 60*minutes
         print('Ground motion done. End time: %.4f s' % t_final)
         print('Analysis time elapsed %dm %ds.' % (minutes, seconds))
+        # close the recorders so their files are complete on return
+        ops.remove('recorders')
         ops.wipe()
         
         return(ok)
@@ -3457,20 +3574,63 @@ class Building:
 #              Steel dimensions and parameters
 ###############################################################################
 
+# process-wide AISC shape catalog: the beam, column and brace tables are parsed
+# once per process, indexed by AISC_Manual_Label, and kept presorted by
+# property for the selection routines of design.py
+class ShapeCatalog:
+    
+    shape_files = {'beam': 'beamShapes.csv',
+                   'column': 'colShapes.csv',
+                   'brace': 'braceShapes.csv'}
+    
+    def __init__(self, csv_dir='../resource/'):
+        import pandas as pd
+        
+        self.tables = {}
+        self.label_row = {}
+        for member, shape_file in self.shape_files.items():
+            shape_db = pd.read_csv(csv_dir+shape_file, index_col=None, header=0)
+            self.tables[member] = shape_db
+            self.label_row[member] = {label: row for row, label in
+                                      enumerate(shape_db['AISC_Manual_Label'])}
+        
+        self._sorted = {}
+        self._sorted_values = {}
+    
+    # one-row DataFrame of the shape (empty if the label is unknown)
+    def get(self, member, shape_name):
+        row = self.label_row[member].get(shape_name)
+        if row is None:
+            return(self.tables[member].iloc[[]].copy())
+        return(self.tables[member].iloc[[row]].copy())
+    
+    # full table sorted by prop, same order as sort_values(by=[prop])
+    # shared by all callers: copy the rows you filter before adding columns
+    def sorted_by(self, member, prop):
+        key = (member, prop)
+        if key not in self._sorted:
+            self._sorted[key] = self.tables[member].sort_values(by=[prop])
+        return(self._sorted[key])
+    
+    # prop of sorted_by(member, prop) as an array, for np.searchsorted
+    def sorted_values(self, member, prop):
+        key = (member, prop)
+        if key not in self._sorted_values:
+            self._sorted_values[key] = self.sorted_by(member, prop)[prop].to_numpy()
+        return(self._sorted_values[key])
+
+_shape_catalogs = {}
+
+def get_shape_catalog(csv_dir='../resource/'):
+    import os
+    
+    catalog_key = os.path.abspath(csv_dir)
+    if catalog_key not in _shape_catalogs:
+        _shape_catalogs[catalog_key] = ShapeCatalog(csv_dir)
+    return _shape_catalogs[catalog_key]
+
 def get_shape(shape_name, member, csv_dir='../resource/'):
-    import pandas as pd
-    
-    if member == 'beam':
-        shape_db = pd.read_csv(csv_dir+'beamShapes.csv',
-                               index_col=None, header=0)
-    elif member == 'column':
-        shape_db = pd.read_csv(csv_dir+'colShapes.csv',
-                               index_col=None, header=0)
-    elif member == 'brace':
-        shape_db = pd.read_csv(csv_dir+'braceShapes.csv',
-                               index_col=None, header=0)  
-    shape = shape_db.loc[shape_db['AISC_Manual_Label'] == shape_name]
-    return(shape)
+    return(get_shape_catalog(csv_dir).get(member, shape_name))
 
     
 # get shape properties
@@ -24,7 +24,7 @@ class Database:
     
     def __init__(self, n_points=400, seed=985, n_buffer=15,
                  struct_sys_list=['MF', 'CBF'], isol_sys_list=['TFP','LRB'],
-                 isol_wts=[1,3]):
+                 isol_wts=[1,3], lazy=False):
         
         from scipy.stats import qmc
         import numpy as np
@@ -75,14 +75,62 @@ class Database:
         # roughly need 7x points to fill desired 
         self.n_generated = n_points*n_buffer
         
+        self.param_names = param_names
+        self.l_bounds = l_bounds
+        self.u_bounds = u_bounds
+        self.struct_sys_list = struct_sys_list
+        self.isol_sys_list = isol_sys_list
+        self.isol_wts = isol_wts
+        
         dim_params = len(self.param_ranges)
-        sampler = qmc.LatinHypercube(d=dim_params, seed=seed)
-        sample = sampler.random(n=self.n_generated)
+        self.sampler = qmc.LatinHypercube(d=dim_params, seed=seed)
+        self.n_sampled = 0
+        
+        # set seed
+        import random
+        random.seed(seed)
+        
+        # with lazy=True, nothing is sampled here. generate_designs then samples
+        # and designs in batches until n_points designs are retained
+        if lazy:
+            self.raw_input = None
+            self.tfp_designs = None
+            self.lrb_designs = None
+        else:
+            self.raw_input = self.sample_inputs(self.n_generated)
+        
+    # draw the next n points of the LHS and the system selections
+    # struct_sys_list restricts the superstructures drawn
+    # strata={param: [(lower, upper), ...]} confines parameters to the union of
+    # their listed bins
+    def sample_inputs(self, n, struct_sys_list=None, strata=None):
+        
+        from scipy.stats import qmc
+        import numpy as np
+        import pandas as pd
+        import random
         
-        params = qmc.scale(sample, l_bounds, u_bounds)
+        if struct_sys_list is None:
+            struct_sys_list = self.struct_sys_list
+        
+        param_names = self.param_names
+        sample = self.sampler.random(n=n)
+        
+        params = qmc.scale(sample, self.l_bounds, self.u_bounds)
         param_selection = pd.DataFrame(params)
         param_selection.columns = param_names
         
+        # a confined parameter keeps its own LHS column, spread evenly over
+        # its bins
+        if strata is not None:
+            for stratum_param, bins in strata.items():
+                j_param = param_names.index(stratum_param)
+                lower, upper = np.asarray(bins, dtype=float).T
+                u_bins = sample[:, j_param]*len(bins)
+                i_bin = np.minimum(np.floor(u_bins).astype(int), len(bins)-1)
+                param_selection[stratum_param] = (lower[i_bin] + (u_bins - i_bin)*
+                                                  (upper[i_bin] - lower[i_bin]))
+        
         ######################################################################
         # system selection params
         ######################################################################
@@ -95,31 +143,31 @@ class Database:
         # generate random integers within the bounds and place into array
         config_names = list(config_dict.keys())       
         num_categories = len(config_dict)
-        config_selection = np.empty([self.n_generated, num_categories])
-        
-        # set seed
-        import random
-        random.seed(seed)
+        config_selection = np.empty([n, num_categories])
         
         for index, (key, bounds) in enumerate(config_dict.items()):
             config_selection[:,index] = np.random.randint(bounds[0], 
                                                                high=bounds[1]+1, 
-                                                               size=self.n_generated)
+                                                               size=n)
         config_selection = pd.DataFrame(config_selection)
         
         # upweigh LRBs to ensure fair split
         # isol_sys_list = ['TFP', 'LRB']
         # isol_wts = [1, 3]
         
-        structs = random.choices(struct_sys_list, k=self.n_generated)
-        isols = random.choices(isol_sys_list, k=self.n_generated, weights=isol_wts)
+        structs = random.choices(struct_sys_list, k=n)
+        isols = random.choices(self.isol_sys_list, k=n, weights=self.isol_wts)
         system_selection = pd.DataFrame(np.array([structs, isols]).T)
         system_names = ['superstructure_system', 'isolator_system']
         
-        self.raw_input = pd.concat([system_selection,
-                                   config_selection,
-                                   param_selection], axis=1)
-        self.raw_input.columns = system_names + config_names + param_names
+        raw_input = pd.concat([system_selection,
+                               config_selection,
+                               param_selection], axis=1)
+        raw_input.columns = system_names + config_names + param_names
+        
+        # rows of successive draws are numbered on from the previous ones
+        raw_input.index = pd.RangeIndex(self.n_sampled, self.n_sampled + n)
+        self.n_sampled += n
         
         # temp add in for constants
         # from numpy import ceil, floor
@@ -127,15 +175,17 @@ class Database:
         # find the number of bay (try to keep around 3 to 8)
         target_Lbay = 30.0
         target_hstory = 14.0
-        self.raw_input['num_bays'] = self.raw_input.apply(
+        raw_input['num_bays'] = raw_input.apply(
             lambda row: round(row['L_bldg']/target_Lbay), axis=1)
-        self.raw_input['num_stories'] = self.raw_input.apply(
+        raw_input['num_stories'] = raw_input.apply(
             lambda row: round(row['h_bldg']/target_hstory), axis=1)
-        self.raw_input['L_bay'] = (self.raw_input['L_bldg'] / 
-                                   self.raw_input['num_bays'])
-        self.raw_input['h_story'] = (self.raw_input['h_bldg'] / 
-                                     self.raw_input['num_stories'])
-        self.raw_input['S_s'] = 2.2815
+        raw_input['L_bay'] = (raw_input['L_bldg'] / 
+                              raw_input['num_bays'])
+        raw_input['h_story'] = (raw_input['h_bldg'] / 
+                                raw_input['num_stories'])
+        raw_input['S_s'] = 2.2815
+        
+        return(raw_input)
         
 ###############################################################################
 # Designing isolation systems
@@ -339,6 +389,9 @@ class Database:
             lambda x: x.sample(n=int(self.n_points/n_systems), random_state=985), include_groups=False)
         self.generated_designs = all_des
         
+        self.report_retained()
+        
+    def report_retained(self):
         print('======================================')
         print('Final database: %d structures.' % len(self.retained_designs))
         print('%d moment frames | %d braced frames' % 
@@ -353,6 +406,215 @@ class Database:
                    self.retained_designs['isolator_system'] == 'TFP'])))
         print('======================================')
         
+###############################################################################
+# Staged design generation
+###############################################################################
+
+    # sample -> bearing design -> frame design, one batch at a time. the batch
+    # bearing design is cheap and screens out most of the discards, so frame
+    # design (the costly stage) is only run on as many bearing-feasible rows
+    # as are still needed. need is a dict {superstructure: designs wanted},
+    # updated by the caller as designs are retained. yields the frame designs
+    # that passed in each batch (possibly empty)
+    def design_stream(self, need, batch_size, filter_designs=True):
+        import pandas as pd
+        
+        reserve = {sys_name: [] for sys_name in need}
+        
+        while True:
+            # only draw the systems that are still lacking
+            lacking = [sys_name for sys_name in need if need[sys_name] > 0]
+            if len(lacking) == 0:
+                return
+            
+            batch = self.sample_inputs(batch_size, struct_sys_list=lacking)
+            self.raw_input = pd.concat([self.raw_input, batch], axis=0)
+            
+            tfp_designs, lrb_designs = design_bearing_util(
+                batch, filter_designs=filter_designs)
+            isolated = [df for df in [tfp_designs, lrb_designs] if df is not None]
+            isolated = pd.concat([batch.iloc[:0]] + isolated, axis=0)
+            
+            if tfp_designs is not None:
+                self.tfp_designs = pd.concat([self.tfp_designs, tfp_designs], 
+                                             axis=0)
+            if lrb_designs is not None:
+                self.lrb_designs = pd.concat([self.lrb_designs, lrb_designs], 
+                                             axis=0)
+            
+            # keep the feasible rows not needed now for the next batches
+            to_design = []
+            for sys_name in lacking:
+                sys_rows = isolated[isolated['superstructure_system'] == sys_name]
+                pool = pd.concat(reserve[sys_name] + [sys_rows], axis=0)
+                to_design.append(pool.iloc[:need[sys_name]])
+                reserve[sys_name] = [pool.iloc[need[sys_name]:]]
+            
+            df_in = pd.concat(to_design, axis=0).copy()
+            if df_in.shape[0] == 0:
+                yield(pd.DataFrame())
+                continue
+            
+            mf_designs, cbf_designs = design_structure_util(
+                df_in, filter_designs=filter_designs)
+            
+            yield(pd.concat([mf_designs, cbf_designs], axis=0))
+            
+    # lazy alternative to design_bearings + design_structure: designs are
+    # generated until n_points are retained, split evenly between systems.
+    # this samples about n_points/yield points (about 5x n_points with the
+    # default ranges), against n_buffer*n_points for the eager path.
+    # with stratify=True, marginal strata of each parameter that came up short
+    # are then topped up (top_up_strata). the top-up draws stop at the eager
+    # budget of n_buffer*n_points sampled points in total, and each of its
+    # batches also runs the bearing and frame design of its feasible rows
+    def generate_designs(self, batch_size=None, max_batches=50, 
+                         filter_designs=True, stratify=False, n_strata=10):
+        import pandas as pd
+        
+        if batch_size is None:
+            batch_size = self.n_points
+        
+        n_systems = len(self.struct_sys_list)
+        n_per_system = int(self.n_points/n_systems)
+        need = {sys_name: n_per_system for sys_name in self.struct_sys_list}
+        
+        retained = self.fill_designs(need, batch_size, max_batches,
+                                     filter_designs=filter_designs)
+        
+        if stratify:
+            retained = self.top_up_strata(retained, batch_size, max_batches, 
+                                          n_strata, filter_designs=filter_designs)
+        
+        self.generated_designs = pd.concat(retained, axis=0)
+        self.mf_designs = self.generated_designs[
+            self.generated_designs['superstructure_system'] == 'MF']
+        self.cbf_designs = self.generated_designs[
+            self.generated_designs['superstructure_system'] == 'CBF']
+        self.retained_designs = self.generated_designs
+        
+        print('Sampled %d points for %d retained designs.' % 
+              (self.n_sampled, len(self.retained_designs)))
+        self.report_retained()
+        
+    # consume the design stream until need is met. returns list of designs
+    def fill_designs(self, need, batch_size, max_batches, filter_designs=True):
+        retained = []
+        stream = self.design_stream(need, batch_size,
+                                    filter_designs=filter_designs)
+        for i_batch, batch_designs in enumerate(stream):
+            for sys_name in need:
+                if batch_designs.shape[0] == 0:
+                    break
+                sys_designs = batch_designs[
+                    batch_designs['superstructure_system'] == sys_name]
+                sys_designs = sys_designs.iloc[:need[sys_name]]
+                need[sys_name] -= sys_designs.shape[0]
+                retained.append(sys_designs)
+                
+            if i_batch + 1 >= max_batches:
+                print('Stopped after %d batches, still lacking:' % max_batches,
+                      need)
+                break
+        
+        return(retained)
+    
+    # for every parameter, bring each of n_strata equal bins up to its share
+    # of the designs of each system. each round draws one batch per system
+    # from an LHS confined to the union of the bins short of designs, then
+    # swaps a drawn design in for a retained one of the same isolator system
+    # when that lowers the total shortfall over all parameters. stops when no
+    # bin is short, or at n_buffer*n_points sampled points
+    def top_up_strata(self, retained, batch_size, max_batches, n_strata,
+                      filter_designs=True):
+        import pandas as pd
+        import numpy as np
+        
+        designs = pd.concat(retained, axis=0)
+        edges = [np.linspace(self.l_bounds[j_param], self.u_bounds[j_param],
+                             n_strata+1) for j_param in range(len(self.param_names))]
+        
+        def bin_matrix(df):
+            return(np.column_stack([
+                np.clip(np.digitize(df[param], edges[j_param]) - 1, 0, n_strata-1)
+                for j_param, param in enumerate(self.param_names)]))
+        
+        def bin_counts(bins):
+            return(np.array([np.bincount(bins[:, j_param], minlength=n_strata)
+                             for j_param in range(bins.shape[1])]))
+        
+        for i_round in range(max_batches):
+            n_left = self.n_generated - self.n_sampled
+            if n_left <= 0:
+                print('Stratified top-up stopped at the sampling budget.')
+                break
+            
+            short_any = False
+            for sys_name in self.struct_sys_list:
+                sys_designs = designs[designs['superstructure_system'] == sys_name]
+                target = int(len(sys_designs)/n_strata)
+                counts = bin_counts(bin_matrix(sys_designs))
+                short = counts < target
+                if not short.any():
+                    continue
+                short_any = True
+                
+                strata = {param: [(edges[j_param][i_bin], edges[j_param][i_bin+1])
+                                  for i_bin in np.where(short[j_param])[0]]
+                          for j_param, param in enumerate(self.param_names)
+                          if short[j_param].any()}
+                
+                n_draw = min(batch_size, self.n_generated - self.n_sampled)
+                if n_draw <= 0:
+                    break
+                batch = self.sample_inputs(n_draw, struct_sys_list=[sys_name],
+                                           strata=strata)
+                self.raw_input = pd.concat([self.raw_input, batch], axis=0)
+                tfp_designs, lrb_designs = design_bearing_util(
+                    batch, filter_designs=filter_designs)
+                isolated = [df for df in [tfp_designs, lrb_designs] if df is not None]
+                if len(isolated) == 0:
+                    continue
+                mf_designs, cbf_designs = design_structure_util(
+                    pd.concat(isolated, axis=0).copy(), 
+                    filter_designs=filter_designs)
+                drawn = pd.concat([mf_designs, cbf_designs], axis=0)
+                
+                # swap in drawn designs, one at a time, against the retained
+                # design of the same isolator whose removal costs least
+                for i_drawn in range(len(drawn)):
+                    candidate = drawn.iloc[[i_drawn]]
+                    c_bins = bin_matrix(candidate)[0]
+                    n_params = len(c_bins)
+                    gain = (counts[np.arange(n_params), c_bins] < target).sum()
+                    if gain == 0:
+                        continue
+                    
+                    same_isol = (sys_designs['isolator_system'] == 
+                                 candidate['isolator_system'].iloc[0]).to_numpy()
+                    if not same_isol.any():
+                        continue
+                    added = counts.copy()
+                    added[np.arange(n_params), c_bins] += 1
+                    d_bins = bin_matrix(sys_designs)
+                    loss = (added[np.arange(n_params), d_bins] <= target).sum(axis=1)
+                    loss = np.where(same_isol, loss, n_params+1)
+                    i_drop = int(np.argmin(loss))
+                    if gain <= loss[i_drop]:
+                        continue
+                    
+                    drop_idx = sys_designs.index[i_drop]
+                    sys_designs = pd.concat([sys_designs.drop(index=drop_idx),
+                                             candidate], axis=0)
+                    designs = pd.concat([designs.drop(index=drop_idx), candidate],
+                                        axis=0)
+                    counts = bin_counts(bin_matrix(sys_designs))
+            
+            if not short_any:
+                break
+                    
+        return([designs])
+        
     def scale_gms(self, repeat=False, seed=985):
         
         
@@ -368,26 +630,38 @@ class Database:
         random.seed(seed)
         
         # scale and select ground motion
-        from gms import scale_ground_motion
+        from gms import scale_ground_motions
         import time
         t0 = time.time()
-        all_des[['gm_selected',
-                 'scale_factor',
-                 'sa_avg']] = all_des.apply(lambda row: scale_ground_motion(row),
-                                            axis='columns', result_type='expand')
+        gm_names, sfs, sa_avgs = scale_ground_motions(all_des['S_1'],
+                                                      all_des['T_m'],
+                                                      all_des['T_fbe'])
+        all_des['gm_selected'] = gm_names
+        all_des['scale_factor'] = sfs
+        all_des['sa_avg'] = sa_avgs
         tp = time.time() - t0
         print("Scaled ground motions for %d structures in %.2f s" %
               (all_des.shape[0], tp))
         
         self.retained_designs = all_des
         
+    # n_workers > 1 runs the analyses in a local process pool, one OpenSees
+    # instance and one output folder per worker
+    # ledger_path points to a run ledger; finished runs are committed as they
+    # complete and skipped when the analysis is restarted
+    # output_path is scratch and is cleared on every call; checkpoints and
+    # the log of failed runs go under data_path+'checkpoints/', and the run
+    # profiles under data_path+'profiles/'
+    # predictor orders the parallel runs (see runner.fit_runtime_predictor)
     def analyze_db(self, output_str, save_interval=10,
                    data_path='../data/',
                    gm_path='../resource/ground_motions/PEERNGARecords_Unscaled/',
-                   output_path='./outputs/'):
+                   output_path='./outputs/', n_workers=1, ledger_path=None,
+                   predictor=None):
         
         from experiment import run_nlth
         import pandas as pd
+        import time
         
         all_designs = self.retained_designs
         all_designs = all_designs.reset_index()
@@ -400,11 +674,50 @@ class Database:
             shutil.rmtree(output_path)
         os.makedirs(output_path)
         
-        for index, design in all_designs.iterrows():
+        checkpoint_path = (data_path+'checkpoints/'+
+                           os.path.splitext(output_str)[0]+'/')
+        os.makedirs(checkpoint_path, exist_ok=True)
+        profile_path = (data_path+'profiles/'+
+                        os.path.splitext(output_str)[0]+'/')
+        
+        ledger = None
+        pending_designs = all_designs
+        if ledger_path is not None:
+            from ledger import RunLedger
+            ledger = RunLedger(ledger_path)
+            pending_designs = ledger_pending(all_designs, ledger)
+        
+        if n_workers > 1:
+            from experiment import run_nlth_parallel
+            print('========= Running %d analyses on %d workers ==========' %
+                  (len(pending_designs), n_workers))
+            db_results = run_nlth_parallel(pending_designs, n_workers,
+                                           gm_path=gm_path,
+                                           output_path=output_path,
+                                           save_interval=save_interval,
+                                           ledger=ledger,
+                                           predictor=predictor,
+                                           checkpoint_path=checkpoint_path,
+                                           profile_path=profile_path)
+            if ledger is not None:
+                db_results = ledger_results(all_designs, ledger)
+                ledger.close()
+            if (db_results is None) or (len(db_results) == 0):
+                raise RuntimeError('No analysis finished, see the failed runs in '+
+                                   checkpoint_path)
+            db_results.to_csv(data_path+output_str, index=False)
+            self.ops_analysis = db_results
+            return
+        
+        for index, design in pending_designs.iterrows():
             i_run = all_designs.index.get_loc(index)
             print('========= Run %d of %d ==========' % 
                   (i_run+1, len(all_designs)))
-            bldg_result = run_nlth(design=design, gm_path=gm_path, output_path=output_path)
+            t0 = time.time()
+            bldg_result = run_nlth(design=design, gm_path=gm_path, output_path=output_path,
+                                   profile_log=profile_path+'run_profile.jsonl')
+            if ledger is not None:
+                ledger.commit(design, bldg_result, wall_time=time.time()-t0)
             
             # if initial run, start the dataframe with headers
             if db_results is None:
@@ -414,8 +727,16 @@ class Database:
                                        sort=False)
                 
             if (len(db_results)%save_interval == 0):
-                db_results.to_csv(output_path+'temp_save.csv', index=False)
+                db_results.to_csv(checkpoint_path+'temp_save.csv', index=False)
+        
+        # previously finished runs come back from the ledger, in design order
+        if ledger is not None:
+            db_results = ledger_results(all_designs, ledger)
+            ledger.close()
         
+        if db_results is None:
+            raise RuntimeError('No analysis to save: no pending design and no '+
+                               'finished run in the ledger')
         db_results.to_csv(data_path+output_str, index=False)
         self.ops_analysis = db_results
         
@@ -498,20 +819,14 @@ class Database:
                             axis=1)
         
         import design as ds
-        from loads import define_lateral_forces, define_gravity_loads
+        from loads import assign_lateral_forces, assign_gravity_loads
         from gms import scale_ground_motion
         
         work_df['T_m'] = work_df['T_fbe']*work_df['T_ratio']
         work_df['moat_ampli'] = work_df['gap_ratio']
         
         # design
-        work_df[['W', 
-               'W_s', 
-               'w_fl', 
-               'P_lc',
-               'all_w_cases',
-               'all_Plc_cases']] = work_df.apply(lambda row: define_gravity_loads(row),
-                                                axis='columns', result_type='expand')
+        work_df = assign_gravity_loads(work_df)
                      
         try:
             all_tfp_designs = work_df.apply(lambda row: ds.design_TFP(row),
@@ -538,14 +853,7 @@ class Database:
                             axis=1)
         
         # get lateral force and design structures
-        work_df[['wx', 
-               'hx', 
-               'h_col', 
-               'hsx', 
-               'Fx', 
-               'Vs',
-               'T_fbe']] = work_df.apply(lambda row: define_lateral_forces(row),
-                                    axis='columns', result_type='expand')
+        work_df = assign_lateral_forces(work_df)
         work_df['Vb'] = work_df['k_e'] * work_df['W'] * work_df['D_m'] / work_df['num_frames']
         all_mf_designs = work_df.apply(lambda row: ds.design_MF(row),
                                          axis='columns', 
@@ -713,20 +1021,14 @@ class Database:
                             axis=1)
         
         import design as ds
-        from loads import define_lateral_forces, define_gravity_loads
+        from loads import assign_lateral_forces, assign_gravity_loads
         from gms import scale_ground_motion
         
         work_df['T_m'] = work_df['T_fbe']*work_df['T_ratio']
         work_df['moat_ampli'] = work_df['gap_ratio']
         
         # design
-        work_df[['W', 
-               'W_s', 
-               'w_fl', 
-               'P_lc',
-               'all_w_cases',
-               'all_Plc_cases']] = work_df.apply(lambda row: define_gravity_loads(row),
-                                                axis='columns', result_type='expand')
+        work_df = assign_gravity_loads(work_df)
                      
         try:
             all_tfp_designs = work_df.apply(lambda row: ds.design_TFP_legacy(row),
@@ -753,14 +1055,7 @@ class Database:
                             axis=1)
         
         # get lateral force and design structures
-        work_df[['wx', 
-               'hx', 
-               'h_col', 
-               'hsx', 
-               'Fx', 
-               'Vs',
-               'T_fbe']] = work_df.apply(lambda row: define_lateral_forces(row),
-                                    axis='columns', result_type='expand')
+        work_df = assign_lateral_forces(work_df)
                                           
         all_mf_designs = work_df.apply(lambda row: ds.design_MF(row),
                                          axis='columns', 
@@ -809,24 +1104,40 @@ class Database:
     
     def analyze_ida(self, output_str, save_interval=10,
                    data_path='../data/validation/',
-                   gm_path='../resource/ground_motions/PEERNGARecords_Unscaled/'):
+                   gm_path='../resource/ground_motions/PEERNGARecords_Unscaled/',
+                   ledger_path=None):
         
         from experiment import run_nlth
         import pandas as pd
+        import time
+        import os
+        
+        profile_log = (data_path+'profiles/'+
+                       os.path.splitext(output_str)[0]+'.jsonl')
         
         all_designs = self.ida_df
         all_designs = all_designs.reset_index()
         
+        ledger = None
+        pending_designs = all_designs
+        if ledger_path is not None:
+            from ledger import RunLedger
+            ledger = RunLedger(ledger_path)
+            pending_designs = ledger_pending(all_designs, ledger)
+        
         db_results = None
         print('========= Validation IDAs ==========')
         
-        for index, design in all_designs.iterrows():
+        for index, design in pending_designs.iterrows():
             i_run = all_designs.index.get_loc(index)
             print('========= Run %d of %d ==========' % 
                   (i_run+1, len(all_designs)))
             
             print('IDA level: %.1f' % design.ida_level)
-            bldg_result = run_nlth(design, gm_path)
+            t0 = time.time()
+            bldg_result = run_nlth(design, gm_path, profile_log=profile_log)
+            if ledger is not None:
+                ledger.commit(design, bldg_result, wall_time=time.time()-t0)
             
             # if initial run, start the dataframe with headers
             if db_results is None:
@@ -838,6 +1149,10 @@ class Database:
             if (len(db_results)%save_interval == 0):
                 db_results.to_csv(data_path+'ida_temp_save.csv', index=False)
         
+        if ledger is not None:
+            db_results = ledger_results(all_designs, ledger)
+            ledger.close()
+        
         db_results.to_csv(data_path+output_str, index=False)
         
         # TODO: store ida depending on target
@@ -845,169 +1160,40 @@ class Database:
         
     # this runs Pelicun in the deterministic style. collect_IDA flag used if running
     # validation IDAs
+    # n_workers > 1 spreads the designs over a process pool (loss.run_loss_set)
+    # finished designs are checkpointed as they complete; designs whose loss
+    # run fails are logged and left as NaN rows of loss_data
+    # engine='analytic' uses the closed-form damage states (loss.assess_loss)
     def run_pelicun(self, df, collect_IDA=False,
-                    cmp_dir='../resource/loss/', max_loss_df=None):
+                    cmp_dir='../resource/loss/', max_loss_df=None, n_workers=1,
+                    engine='pelicun'):
         # run info
-        import pandas as pd
-
-        # and import pelicun classes and methods
-        from pelicun.assessment import Assessment
-        from loss import Loss_Analysis
-
-        # get database
-        # initialize, no printing outputs, offset fixed with current components
-        PAL = Assessment({
-            "PrintLog": False, 
-            "Seed": 985,
-            "Verbose": False,
-            "DemandOffset": {"PFA": 0, "PFV": 0}
-        })
-
-        # generate structural components and join with NSCs
-        P58_metadata = PAL.get_default_metadata('loss_repair_DB_FEMA_P58_2nd')
-        
-        additional_frag_db = pd.read_csv(cmp_dir+'custom_component_fragilities.csv',
-                                          header=[0,1], index_col=0)
-        
-        # lab, health, ed, res, office, retail, warehouse, hotel
-        fl_usage = [0., 0., 0., 0., 1.0, 0., 0., 0.]
+        from loss import run_loss_set, stack_loss_samples, loss_data_table
         
         df = df.reset_index(drop=True)
         
-        # estimate loss for set
-        all_losses = []
-        loss_cmp_group = []
-        col_list = []
-        irr_list = []
-        if collect_IDA:
-            IDA_list = []
-            
         # if max loss df is provided, we now use the median loss of the total 
         # damage scenario as the replacement consequences
         if max_loss_df is not None:
-            max_costs = max_loss_df['cost_50%']
-            max_time = max_loss_df['time_l_50%']
+            max_costs = [max_loss_df['cost_50%'].loc[run_idx] for run_idx in df.index]
+            max_time = [max_loss_df['time_l_50%'].loc[run_idx] for run_idx in df.index]
         else:
-            max_costs = None*df.shape[0]
-            max_time = None*df.shape[0]
-            
-        for run_idx in df.index:
-            print('========================================')
-            print('Estimating loss for run index', run_idx+1)
-            
-            run_data = df.loc[run_idx]
-            
-            floors = run_data.num_stories
-            
-            bldg_usage = [fl_usage]*floors
-
-            loss = Loss_Analysis(run_data)
-            loss.nqe_sheets()
-            loss.normative_quantity_estimation(bldg_usage, P58_metadata)
-
-            loss.process_EDP()
-            
-            run_max_cost = max_costs.loc[run_idx]
-            run_max_time = max_time.loc[run_idx]
-            
-            [cmp, dmg, loss, loss_cmp, agg, 
-             collapse_rate, irr_rate] = loss.estimate_damage(
-                 custom_fragility_db=additional_frag_db, mode='generate',
-                 cmp_replacement_cost=run_max_cost, cmp_replacement_time=run_max_time)
-            
-            loss_summary = agg.describe([0.1, 0.5, 0.9])
-            cost = loss_summary['repair_cost']['50%']
-            time_l = loss_summary[('repair_time', 'parallel')]['50%']
-            time_u = loss_summary[('repair_time', 'sequential')]['50%']
-            
-            print('Median repair cost: ', 
-                  f'${cost:,.2f}')
-            print('Median lower bound repair time: ', 
-                  f'{time_l:,.2f}', 'worker-days')
-            print('Median upper bound repair time: ', 
-                  f'{time_u:,.2f}', 'worker-days')
-            print('Collapse frequency: ', 
-                  f'{collapse_rate:.2%}')
-            print('Irreparable RID frequency: ', 
-                  f'{irr_rate:.2%}')
-            print('Replacement frequency: ', 
-                  f'{collapse_rate+irr_rate:.2%}')
-            
-            all_losses.append(loss_summary)
-            loss_cmp_group.append(loss_cmp)
-            col_list.append(collapse_rate)
-            irr_list.append(irr_rate)
-            
-            if collect_IDA:
-                IDA_list.append(run_data['ida_level'])
-                 
-        
-        # concat list of df into one df
-        loss_df = pd.concat(all_losses)
-        group_df = pd.concat(loss_cmp_group)
-        
-        loss_header = ['cost_mean', 'cost_std', 'cost_min',
-                       'cost_10%', 'cost_50%', 'cost_90%', 'cost_max',
-                       'time_l_mean', 'time_l_std', 'time_l_min',
-                       'time_l_10%', 'time_l_50%', 'time_l_90%', 'time_l_max',
-                       'time_u_mean', 'time_u_std', 'time_u_min',
-                       'time_u_10%', 'time_u_50%', 'time_u_90%', 'time_u_max']
-        
-        
-        
-        all_rows = []
+            max_costs = None
+            max_time = None
         
-        for row_idx in range(len(loss_df)):
-            if row_idx % 8 == 0:
-                # get the block with current run, drop the 'Count'
-                run_df = loss_df[row_idx:row_idx+8]
-                run_df = run_df.transpose()
-                run_df = run_df.drop(columns=['count'])
-                new_row = pd.concat([run_df.iloc[0], 
-                                     run_df.iloc[1], 
-                                     run_df.iloc[2]])
-                
-                all_rows.append(new_row)
-                
-        loss_df_data = pd.concat(all_rows, axis=1).T
-        loss_df_data.columns = loss_header
+        # estimate loss for set
+        all_runs = run_loss_set(df, mode='generate', max_costs=max_costs,
+                                max_times=max_time, n_workers=n_workers,
+                                cmp_dir=cmp_dir, engine=engine)
         
-        loss_df_data['collapse_freq'] = col_list
-        loss_df_data['irreparable_freq'] = irr_list
-        loss_df_data['replacement_freq'] = [x + y for x, y
-                                            in zip(col_list, irr_list)]
+        # per-realization losses, kept for other statistics (loss.loss_quantiles)
+        self.loss_samples = stack_loss_samples(all_runs)
         
         if collect_IDA:
-            loss_df_data['ida_level'] = IDA_list
-            
-        # clean loss_by_group results=
-        group_header = ['B_mean', 'B_std', 'B_min',
-                       'B_25%', 'B_50%', 'B_75%', 'B_max',
-                       'C_mean', 'C_std', 'C_min',
-                       'C_25%', 'C_50%', 'C_75%', 'C_max',
-                       'D_mean', 'D_std', 'D_min',
-                       'D_25%', 'D_50%', 'D_75%', 'D_max',
-                       'E_mean', 'E_std', 'E_min',
-                       'E_25%', 'E_50%', 'E_75%', 'E_max']
-        
-        all_rows = []
-        
-        for row_idx in range(len(group_df)):
-            if row_idx % 8 == 0:
-                # get the block with current run, drop the 'Count'
-                run_df = group_df[row_idx:row_idx+8]
-                run_df = run_df.transpose()
-                run_df = run_df.drop(columns=['count'])
-                new_row = pd.concat([run_df.iloc[0], 
-                                     run_df.iloc[1], run_df.iloc[2], 
-                                     run_df.iloc[3]])
-                
-                all_rows.append(new_row)
-                
-        group_df_data = pd.concat(all_rows, axis=1).T
-        group_df_data.columns = group_header
-        
-        self.loss_data = pd.concat([loss_df_data, group_df_data], axis=1)
+            self.loss_data = loss_data_table(self.loss_samples,
+                                             ida_levels=df['ida_level'].tolist())
+        else:
+            self.loss_data = loss_data_table(self.loss_samples)
         
     # This runs Pelicun by fitting a lognormal distribution through the MCE EDPs
     def validate_pelicun(self, df, cmp_dir='../resource/loss/'):
@@ -1162,166 +1348,74 @@ class Database:
         self.loss_data = pd.concat([loss_df_data, group_df_data], axis=1)
         
     def calc_cmp_max(self, df,
-                    cmp_dir='../resource/loss/'):
+                    cmp_dir='../resource/loss/', n_workers=1, engine='pelicun'):
         # run info
-        import pandas as pd
-
-        # and import pelicun classes and methods
-        from pelicun.assessment import Assessment
-        from loss import Loss_Analysis
-
-        # get database
-        # initialize, no printing outputs, offset fixed with current components
-        PAL = Assessment({
-            "PrintLog": False, 
-            "Seed": 985,
-            "Verbose": False,
-            "DemandOffset": {"PFA": 0, "PFV": 0}
-        })
-
-        # generate structural components and join with NSCs
-        P58_metadata = PAL.get_default_metadata('loss_repair_DB_FEMA_P58_2nd')
-        
-        additional_frag_db = pd.read_csv(cmp_dir+'custom_component_fragilities.csv',
-                                          header=[0,1], index_col=0)
-        
-        # lab, health, ed, res, office, retail, warehouse, hotel
-        fl_usage = [0., 0., 0., 0., 1.0, 0., 0., 0.]
+        from loss import run_loss_set, stack_loss_samples, loss_data_table
         
         df = df.reset_index(drop=True)
         
         # estimate loss for set
-        all_losses = []
-        loss_cmp_group = []
-        col_list = []
-        irr_list = []
+        all_runs = run_loss_set(df, mode='maximize', n_workers=n_workers,
+                                cmp_dir=cmp_dir, engine=engine)
         
-        for run_idx in df.index:
-            print('========================================')
-            print('Estimating maximum loss for run index', run_idx+1)
-            
-            run_data = df.loc[run_idx]
-            
-            floors = run_data.num_stories
-            
-            bldg_usage = [fl_usage]*floors
+        self.max_loss_samples = stack_loss_samples(all_runs)
+        self.max_loss = loss_data_table(self.max_loss_samples)
+    
+#%% run ledger tools
 
-            loss = Loss_Analysis(run_data)
-            loss.nqe_sheets()
-            loss.normative_quantity_estimation(bldg_usage, P58_metadata)
+# designs whose runs are not yet in the ledger
+def ledger_pending(all_designs, ledger):
+    from ledger import run_key
+    
+    done_keys = ledger.completed_keys()
+    is_done = all_designs.apply(lambda row: run_key(row) in done_keys,
+                                axis='columns')
+    if is_done.any():
+        print('Ledger %s: %d of %d runs already complete, skipping.' %
+              (ledger.path, is_done.sum(), len(all_designs)))
+    return(all_designs[~is_done])
 
-            loss.process_EDP()
-            
-            [cmp, dmg, loss, loss_cmp, agg, 
-             collapse_rate, irr_rate] = loss.estimate_damage(
-                 custom_fragility_db=additional_frag_db, mode='maximize')
-            
-            loss_summary = agg.describe([0.1, 0.5, 0.9])
-            cost = loss_summary['repair_cost']['50%']
-            time_l = loss_summary[('repair_time', 'parallel')]['50%']
-            time_u = loss_summary[('repair_time', 'sequential')]['50%']
-            
-            print('Median repair cost: ', 
-                  f'${cost:,.2f}')
-            print('Median lower bound repair time: ', 
-                  f'{time_l:,.2f}', 'worker-days')
-            print('Median upper bound repair time: ', 
-                  f'{time_u:,.2f}', 'worker-days')
-            print('Collapse frequency: ', 
-                  f'{collapse_rate:.2%}')
-            print('Irreparable RID frequency: ', 
-                  f'{irr_rate:.2%}')
-            print('Replacement frequency: ', 
-                  f'{collapse_rate+irr_rate:.2%}')
-            
-            all_losses.append(loss_summary)
-            loss_cmp_group.append(loss_cmp)
-            col_list.append(collapse_rate)
-            irr_list.append(irr_rate)
-                 
-        
-        # concat list of df into one df
-        loss_df = pd.concat(all_losses)
-        group_df = pd.concat(loss_cmp_group)
-        
-        loss_header = ['cost_mean', 'cost_std', 'cost_min',
-                       'cost_10%', 'cost_50%', 'cost_90%', 'cost_max',
-                       'time_l_mean', 'time_l_std', 'time_l_min',
-                       'time_l_10%', 'time_l_50%', 'time_l_90%', 'time_l_max',
-                       'time_u_mean', 'time_u_std', 'time_u_min',
-                       'time_u_10%', 'time_u_50%', 'time_u_90%', 'time_u_max']
-        
-        
-        
-        all_rows = []
-        
-        for row_idx in range(len(loss_df)):
-            if row_idx % 8 == 0:
-                # get the block with current run, drop the 'Count'
-                run_df = loss_df[row_idx:row_idx+8]
-                run_df = run_df.transpose()
-                run_df = run_df.drop(columns=['count'])
-                new_row = pd.concat([run_df.iloc[0], 
-                                     run_df.iloc[1], 
-                                     run_df.iloc[2]])
-                
-                all_rows.append(new_row)
-                
-        loss_df_data = pd.concat(all_rows, axis=1).T
-        loss_df_data.columns = loss_header
-        
-        loss_df_data['collapse_freq'] = col_list
-        loss_df_data['irreparable_freq'] = irr_list
-        loss_df_data['replacement_freq'] = [x + y for x, y
-                                            in zip(col_list, irr_list)]
-        
-        
-        # clean loss_by_group results=
-        group_header = ['B_mean', 'B_std', 'B_min',
-                       'B_25%', 'B_50%', 'B_75%', 'B_max',
-                       'C_mean', 'C_std', 'C_min',
-                       'C_25%', 'C_50%', 'C_75%', 'C_max',
-                       'D_mean', 'D_std', 'D_min',
-                       'D_25%', 'D_50%', 'D_75%', 'D_max',
-                       'E_mean', 'E_std', 'E_min',
-                       'E_25%', 'E_50%', 'E_75%', 'E_max']
-        
-        all_rows = []
-        
-        for row_idx in range(len(group_df)):
-            if row_idx % 8 == 0:
-                # get the block with current run, drop the 'Count'
-                run_df = group_df[row_idx:row_idx+8]
-                run_df = run_df.transpose()
-                run_df = run_df.drop(columns=['count'])
-                new_row = pd.concat([run_df.iloc[0], 
-                                     run_df.iloc[1], run_df.iloc[2], 
-                                     run_df.iloc[3]])
-                
-                all_rows.append(new_row)
-                
-        group_df_data = pd.concat(all_rows, axis=1).T
-        group_df_data.columns = group_header
-        
-        self.max_loss = pd.concat([loss_df_data, group_df_data], axis=1)
+# ledger results for all designs, in the order of all_designs
+def ledger_results(all_designs, ledger):
+    import pandas as pd
     
+    all_results = [ledger.get(design) for idx, design in all_designs.iterrows()]
+    all_results = [result for result in all_results if result is not None]
+    if len(all_results) == 0:
+        return(None)
+    return(pd.DataFrame(all_results))
+
 #%% design tools
 
-def design_bearing_util(raw_input, filter_designs=True, mu_1_force=None):
+# keep the designs that look sensible
+# limits from design example CE 223
+def lrb_design_mask(all_lrb_designs):
+    return((all_lrb_designs['d_bearing'] >= 3*all_lrb_designs['d_lead']) &
+           (all_lrb_designs['d_bearing'] <= 6*all_lrb_designs['d_lead']) &
+           (all_lrb_designs['d_lead'] <= all_lrb_designs['t_r']) &
+           (all_lrb_designs['t_r'] > 4.0) &
+           (all_lrb_designs['t_r'] < 35.0) &
+           (all_lrb_designs['buckling_fail'] == 0) &
+           (all_lrb_designs['zeta_loop'] <= 0.25))
+
+def tfp_design_mask(all_tfp_designs):
+    return((all_tfp_designs['R_1'] >= 10.0) &
+           (all_tfp_designs['R_1'] <= 50.0) &
+           (all_tfp_designs['R_2'] <= 180.0) &
+           (all_tfp_designs['zeta_loop'] <= 0.25))
+
+# bearings are designed for all rows at once (design_TFP_batch and
+# design_LRB_batch). LRBs that fail are retried with the displacement check
+# bypassed, then with fewer bearings. by default a fallback tier only runs if
+# no LRB passed so far; retry_failed_rows=True retries the failed rows always
+def design_bearing_util(raw_input, filter_designs=True, mu_1_force=None,
+                        retry_failed_rows=False):
     import time
     import pandas as pd
     
-    df_raw = raw_input
-    
-    # get loading conditions
-    from loads import define_gravity_loads
-    df_raw[['W', 
-           'W_s', 
-           'w_fl', 
-           'P_lc',
-           'all_w_cases',
-           'all_Plc_cases']] = df_raw.apply(lambda row: define_gravity_loads(row),
-                                            axis='columns', result_type='expand')
+    # get loading conditions (all rows at once)
+    from loads import assign_gravity_loads
+    df_raw = assign_gravity_loads(raw_input)
     
     # separate df into isolator systems
     import design as ds
@@ -1331,20 +1425,12 @@ def design_bearing_util(raw_input, filter_designs=True, mu_1_force=None):
     # attempt to design all TFPs
     if df_tfp.shape[0] > 0:
         t0 = time.time()
-        all_tfp_designs = df_tfp.apply(lambda row: ds.design_TFP(row, mu_1=mu_1_force),
-                                       axis='columns', result_type='expand')
-        
-        all_tfp_designs.columns = ['mu_1', 'mu_2', 'R_1', 'R_2', 
-                                   'T_e', 'k_e', 'Q', 'zeta_loop', 'D_m']
+        all_tfp_designs = ds.design_TFP_batch(df_tfp, mu_1=mu_1_force)
         
         if filter_designs == False:
             tfp_designs = all_tfp_designs
         else:
-            # keep the designs that look sensible
-            tfp_designs = all_tfp_designs.loc[(all_tfp_designs['R_1'] >= 10.0) &
-                                              (all_tfp_designs['R_1'] <= 50.0) &
-                                              (all_tfp_designs['R_2'] <= 180.0) &
-                                              (all_tfp_designs['zeta_loop'] <= 0.25)]
+            tfp_designs = all_tfp_designs.loc[tfp_design_mask(all_tfp_designs)]
         
         tp = time.time() - t0
         
@@ -1363,81 +1449,38 @@ def design_bearing_util(raw_input, filter_designs=True, mu_1_force=None):
     # attempt to design all LRBs
     if df_lrb.shape[0] > 0:
         t0 = time.time()
-        all_lrb_designs = df_lrb.apply(lambda row: ds.design_LRB(row),
-                                       axis='columns', result_type='expand')
-        
-        
-        all_lrb_designs.columns = ['d_bearing', 'd_lead', 't_r', 't', 'n_layers',
-                                   'N_lb', 'S_pad', 'S_2',
-                                   'T_e', 'k_e', 'Q', 'zeta_loop', 'D_m', 'buckling_fail']
         
-        if filter_designs == False:
-            lrb_designs = all_lrb_designs
-        else:
-            # keep the designs that look sensible
-            # limits from design example CE 223
-            lrb_designs = all_lrb_designs.loc[(all_lrb_designs['d_bearing'] >=
-                                               3*all_lrb_designs['d_lead']) &
-                                              (all_lrb_designs['d_bearing'] <=
-                                               6*all_lrb_designs['d_lead']) &
-                                              (all_lrb_designs['d_lead'] <= 
-                                                all_lrb_designs['t_r']) &
-                                              (all_lrb_designs['t_r'] > 4.0) &
-                                              (all_lrb_designs['t_r'] < 35.0) &
-                                              (all_lrb_designs['buckling_fail'] == 0) &
-                                              (all_lrb_designs['zeta_loop'] <= 0.25)]
-            
-            lrb_designs = lrb_designs.drop(columns=['buckling_fail'])
-            
-        # check to see if bearing design succeeded
+        # fallback tiers; only rows that have not passed yet are redesigned
         # hacky solution: just skip the displacement check
-        if lrb_designs.shape[0] < 1:
-            all_lrb_designs = df_lrb.apply(lambda row: ds.design_LRB(row, bypass_disp_check=True),
-                                            axis='columns', result_type='expand')
-            
-            
-            all_lrb_designs.columns = ['d_bearing', 'd_lead', 't_r', 't', 'n_layers',
-                                        'N_lb', 'S_pad', 'S_2',
-                                        'T_e', 'k_e', 'Q', 'zeta_loop', 'D_m', 'buckling_fail']
-            
-            # keep the designs that look sensible
-            lrb_designs = all_lrb_designs.loc[(all_lrb_designs['d_bearing'] >=
-                                                3*all_lrb_designs['d_lead']) &
-                                              (all_lrb_designs['d_bearing'] <=
-                                                6*all_lrb_designs['d_lead']) &
-                                              (all_lrb_designs['d_lead'] <= 
-                                                all_lrb_designs['t_r']) &
-                                              (all_lrb_designs['t_r'] > 4.0) &
-                                              (all_lrb_designs['t_r'] < 35.0) &
-                                              (all_lrb_designs['buckling_fail'] == 0) &
-                                              (all_lrb_designs['zeta_loop'] <= 0.25)]
-            
-            lrb_designs = lrb_designs.drop(columns=['buckling_fail'])
-            
-        
         # if failed (particularly for inverse design), reduce bearings
         # TODO: implement or remove this
-        if lrb_designs.shape[0] < 1:
-            all_lrb_designs = df_lrb.apply(lambda row: ds.design_LRB(row, reduce_bearings=True),
-                                            axis='columns', result_type='expand')
-            
-            
-            all_lrb_designs.columns = ['d_bearing', 'd_lead', 't_r', 't', 'n_layers',
-                                        'N_lb', 'S_pad', 'S_2',
-                                        'T_e', 'k_e', 'Q', 'zeta_loop', 'D_m', 'buckling_fail']
+        lrb_tiers = [{},
+                     {'bypass_disp_check': True},
+                     {'reduce_bearings': True}]
+        
+        all_lrb_designs = None
+        passed = pd.Series(False, index=df_lrb.index)
+        for i_tier, tier_kwargs in enumerate(lrb_tiers):
+            if passed.all() or (passed.any() and not retry_failed_rows):
+                break
+                
+            retry = ~passed
+            tier_designs = ds.design_LRB_batch(df_lrb[retry], **tier_kwargs)
             
-            # keep the designs that look sensible
-            lrb_designs = all_lrb_designs.loc[(all_lrb_designs['d_bearing'] >=
-                                                3*all_lrb_designs['d_lead']) &
-                                              (all_lrb_designs['d_bearing'] <=
-                                                6*all_lrb_designs['d_lead']) &
-                                              (all_lrb_designs['d_lead'] <= 
-                                                all_lrb_designs['t_r']) &
-                                              (all_lrb_designs['t_r'] > 4.0) &
-                                              (all_lrb_designs['t_r'] < 35.0) &
-                                              (all_lrb_designs['buckling_fail'] == 0) &
-                                              (all_lrb_designs['zeta_loop'] <= 0.25)]
+            if all_lrb_designs is None:
+                all_lrb_designs = tier_designs
+            else:
+                all_lrb_designs.loc[retry] = tier_designs
             
+            # with no filtering, every first-tier design is kept
+            if (filter_designs == False) and (i_tier == 0):
+                tier_passed = pd.Series(True, index=tier_designs.index)
+            else:
+                tier_passed = lrb_design_mask(tier_designs)
+            passed.loc[tier_passed.index] = tier_passed
+        
+        lrb_designs = all_lrb_designs.loc[passed]
+        if filter_designs == True:
             lrb_designs = lrb_designs.drop(columns=['buckling_fail'])
             
         tp = time.time() - t0
@@ -1453,22 +1496,26 @@ def design_bearing_util(raw_input, filter_designs=True, mu_1_force=None):
         
     return(tfp_designs, lrb_designs)
 
-def design_structure_util(df_in, filter_designs=True, db_string='../resource/'):
+# member selections are memoized by design.DesignCache (see there). pass
+# cache_path to also keep them on disk, shared across runs and seeds
+def design_structure_util(df_in, filter_designs=True, db_string='../resource/',
+                          use_cache=True, cache_path=None):
     import pandas as pd
     import time
     
-    from loads import define_lateral_forces
+    from loads import assign_lateral_forces
     import design as ds
     
+    if use_cache:
+        design_cache = ds.get_design_cache(cache_path)
+        design_MF = lambda row: design_cache.design('MF', row, db_string=db_string)
+        design_CBF = lambda row: design_cache.design('CBF', row, db_string=db_string)
+    else:
+        design_MF = lambda row: ds.design_MF(row, db_string=db_string)
+        design_CBF = lambda row: ds.design_CBF(row, db_string=db_string)
+    
     # assumes that there is at least one design
-    df_in[['wx', 
-           'hx', 
-           'h_col', 
-           'hsx', 
-           'Fx', 
-           'Vs',
-           'T_fbe']] = df_in.apply(lambda row: define_lateral_forces(row),
-                                axis='columns', result_type='expand')
+    df_in = assign_lateral_forces(df_in)
     
     # separate by superstructure systems
     smrf_df = df_in[df_in['superstructure_system'] == 'MF']
@@ -1478,7 +1525,7 @@ def design_structure_util(df_in, filter_designs=True, db_string='../resource/'):
     if smrf_df.shape[0] > 0:
         t0 = time.time()
         
-        all_mf_designs = smrf_df.apply(lambda row: ds.design_MF(row, db_string=db_string),
+        all_mf_designs = smrf_df.apply(design_MF,
                                        axis='columns', 
                                        result_type='expand')
         
@@ -1507,7 +1554,7 @@ def design_structure_util(df_in, filter_designs=True, db_string='../resource/'):
     # attempt to design all CBFs
     if cbf_df.shape[0] > 0:
         t0 = time.time()
-        all_cbf_designs = cbf_df.apply(lambda row: ds.design_CBF(row, db_string=db_string),
+        all_cbf_designs = cbf_df.apply(design_CBF,
                                         axis='columns', 
                                         result_type='expand')
         all_cbf_designs.columns = ['brace', 'beam', 'column']
@@ -1528,6 +1575,9 @@ def design_structure_util(df_in, filter_designs=True, db_string='../resource/'):
               (cbf_df.shape[0], tp))
     else:
         cbf_designs = None
+    
+    if use_cache:
+        design_cache.save()
         
     return mf_designs, cbf_designs
     
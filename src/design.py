@@ -83,7 +83,8 @@ def iterate_bearing_height(tr_guess, D_m, k_M, Q_L, rho_k, N_lb, S_des=15.0):
     t_pad_req = b_s / (2*S_des)
     # t_pad_req = (b_s - a)/(2*S_pad_trial)
     
-    from math import floor
+    # numpy floor so that the batch designer can pass arrays
+    from numpy import floor
     n_layers = floor(tr_guess/t_pad_req)
     n_shims = n_layers - 1
     
@@ -385,7 +386,8 @@ def design_LRB_legacy(param_df):
     # P_crit = pi/t_r * ((E_c * I/3)*G_ss*A)**(0.5)
     
     # this includes diaphragm, which is accurate representation of load above LRB
-    w_floor = param_df['w_fl'] # k/ft
+    from loads import level_values
+    w_floor = level_values(param_df, 'w_fl') # k/ft
     L_bay = param_df['L_bay'] # ft
     P_estimate = sum(w_floor)*L_bay
     pressure_estimate = P_estimate/(pi*b_s**2)
@@ -672,7 +674,8 @@ def design_LRB(param_df, reduce_bearings=False, bypass_disp_check=False):
     # P_crit = pi/t_r * ((E_c * I/3)*G_ss*A)**(0.5)
     
     # this includes diaphragm, which is accurate representation of load above LRB
-    w_floor = param_df['w_fl'] # k/ft
+    from loads import level_values
+    w_floor = level_values(param_df, 'w_fl') # k/ft
     L_bay = param_df['L_bay'] # ft
     P_estimate = sum(w_floor)*L_bay
     pressure_estimate = P_estimate/(pi*b_s**2)
@@ -1057,6 +1060,385 @@ def design_TFP_legacy(param_df):
     return(mu_1, mu_2, R_1, R_2, T_e, k_e, zeta_loop, D_m)
 
 
+############################################################################
+#              Batch bearing design (all rows at once)
+############################################################################
+
+# bounded minimization of fun(x, *args) for N independent problems at once,
+# args are length-N arrays. this is the bounded Brent method of
+# scipy.optimize.minimize_scalar(method='bounded') stepped for all rows
+# together, so each row converges to the same local minimum as the scalar call
+def minimize_bounded_batch(fun, args, lower, upper, xatol=1e-5, maxfun=500):
+    import numpy as np
+    
+    args = [np.asarray(arg, dtype=float) for arg in args]
+    n_rows = len(args[0])
+    
+    sqrt_eps = np.sqrt(2.2e-16)
+    golden_mean = 0.5*(3.0 - np.sqrt(5.0))
+    
+    with np.errstate(all='ignore'):
+        a = np.full(n_rows, float(lower))
+        b = np.full(n_rows, float(upper))
+        fulc = a + golden_mean*(b - a)
+        nfc = fulc.copy()
+        xf = fulc.copy()
+        rat = np.zeros(n_rows)
+        e = np.zeros(n_rows)
+        fx = np.asarray(fun(xf, *args), dtype=float)
+        num = 1
+        
+        ffulc = fx.copy()
+        fnfc = fx.copy()
+        xm = 0.5*(a + b)
+        tol1 = sqrt_eps*np.abs(xf) + xatol/3.0
+        tol2 = 2.0*tol1
+        
+        active = np.abs(xf - xm) > (tol2 - 0.5*(b - a))
+        while active.any():
+            # check for parabolic fit
+            r = (xf - nfc)*(fx - ffulc)
+            q = (xf - fulc)*(fx - fnfc)
+            p = (xf - fulc)*q - (xf - nfc)*r
+            q = 2.0*(q - r)
+            p = np.where(q > 0.0, -p, p)
+            q = np.abs(q)
+            
+            # check for acceptability of parabola
+            parabolic = ((np.abs(e) > tol1) &
+                         (np.abs(p) < np.abs(0.5*q*e)) &
+                         (p > q*(a - xf)) & (p < q*(b - xf)))
+            rat_parabolic = p/q
+            x = xf + rat_parabolic
+            si = np.sign(xm - xf) + ((xm - xf) == 0)
+            rat_parabolic = np.where(((x - a) < tol2) | ((b - x) < tol2),
+                                     tol1*si, rat_parabolic)
+            
+            # otherwise do a golden-section step
+            e_golden = np.where(xf >= xm, a - xf, b - xf)
+            e_new = np.where(parabolic, rat, e_golden)
+            rat_new = np.where(parabolic, rat_parabolic, golden_mean*e_golden)
+            
+            si = np.sign(rat_new) + (rat_new == 0)
+            x = xf + si*np.maximum(np.abs(rat_new), tol1)
+            fu = np.asarray(fun(x, *args), dtype=float)
+            num += 1
+            
+            better = fu <= fx
+            a_new = np.where(better, np.where(x >= xf, xf, a),
+                             np.where(x < xf, x, a))
+            b_new = np.where(better, np.where(x >= xf, b, xf),
+                             np.where(x < xf, b, x))
+            
+            worse_1 = ~better & ((fu <= fnfc) | (nfc == xf))
+            worse_2 = (~better & ~worse_1 &
+                       ((fu <= ffulc) | (fulc == xf) | (fulc == nfc)))
+            fulc_new = np.where(better | worse_1, nfc, np.where(worse_2, x, fulc))
+            ffulc_new = np.where(better | worse_1, fnfc, np.where(worse_2, fu, ffulc))
+            nfc_new = np.where(better, xf, np.where(worse_1, x, nfc))
+            fnfc_new = np.where(better, fx, np.where(worse_1, fu, fnfc))
+            xf_new = np.where(better, x, xf)
+            fx_new = np.where(better, fu, fx)
+            
+            # converged rows are left as they are
+            a = np.where(active, a_new, a)
+            b = np.where(active, b_new, b)
+            e = np.where(active, e_new, e)
+            rat = np.where(active, rat_new, rat)
+            fulc = np.where(active, fulc_new, fulc)
+            ffulc = np.where(active, ffulc_new, ffulc)
+            nfc = np.where(active, nfc_new, nfc)
+            fnfc = np.where(active, fnfc_new, fnfc)
+            xf = np.where(active, xf_new, xf)
+            fx = np.where(active, fx_new, fx)
+            
+            xm = 0.5*(a + b)
+            tol1 = sqrt_eps*np.abs(xf) + xatol/3.0
+            tol2 = 2.0*tol1
+            
+            active = (active & (np.abs(xf - xm) > (tol2 - 0.5*(b - a))) &
+                      (num < maxfun))
+    
+    return(xf)
+
+# array version of design_TFP: one row of param_df per bearing design
+# mu_1 is drawn per row in the same order as the row-wise design_TFP
+def design_TFP_batch(param_df, mu_1=None):
+    import random
+    import numpy as np
+    import pandas as pd
+    
+    T_m = param_df['T_m'].to_numpy(dtype=float)
+    S_1 = param_df['S_1'].to_numpy(dtype=float)
+    zeta_m = param_df['zeta_e'].to_numpy(dtype=float)
+    rho_k = param_df['k_ratio'].to_numpy(dtype=float)
+    n_rows = len(param_df)
+    
+    if mu_1 is None:
+        mu_1 = np.array([random.uniform(0.02, 0.05) for i in range(n_rows)])
+    else:
+        mu_1 = np.full(n_rows, mu_1, dtype=float)
+    
+    # converge design on damping
+    Q = minimize_bounded_batch(iterate_on_Q_tfp, (mu_1, S_1, T_m, zeta_m, rho_k),
+                               0.01, 0.20)
+    
+    g  = 386.4
+    pi = 3.14159
+    
+    # from ASCE Ch. 17, get damping multiplier
+    zetaRef = [0.02, 0.05, 0.10, 0.20, 0.30, 0.40, 0.50]
+    BmRef   = [0.8, 1.0, 1.2, 1.5, 1.7, 1.9, 2.0]
+    
+    with np.errstate(all='ignore'):
+        # from T_m, zeta_M, S_1
+        B_m = np.interp(zeta_m, zetaRef, BmRef)
+        D_m = g*S_1*T_m/(4*pi**2*B_m)
+        
+        k_M = (2*pi/T_m)**2 * (1/g)
+        
+        # specify sliders
+        h_1 = 1.0
+        h_2 = 4.0
+        
+        u_y = 0.01
+        
+        k_0 = mu_1/u_y
+        
+        # from Q and D_m
+        k_2 = (k_M*D_m - Q)/D_m
+        R_2 = 1/(2*k_2) + h_2
+        
+        # from rho_k
+        u_a = Q/(k_2*(rho_k-1))
+        k_a = rho_k*k_2
+        mu_2 = u_a*k_a
+        R_1 = u_a/(2*(mu_2-mu_1)) + h_1
+        
+        # effective design values
+        a = 1/(2*R_1)
+        b = 1/(2*R_2)
+        k_e = (mu_2 + b*(D_m - u_a))/D_m
+        W_e = 4*(mu_2 - b*u_a)*D_m - 4*(a-b)*u_a**2 - 4*(k_0 -a)*u_y**2
+        zeta_loop  = W_e/(2*pi*k_e*D_m**2)
+        T_e = 2*pi*(1/(g*k_e))**0.5
+    
+    return(pd.DataFrame({'mu_1': mu_1, 'mu_2': mu_2, 'R_1': R_1, 'R_2': R_2,
+                         'T_e': T_e, 'k_e': k_e, 'Q': Q,
+                         'zeta_loop': zeta_loop, 'D_m': D_m},
+                        index=param_df.index))
+
+# array version of design_LRB: one row of param_df per bearing design
+# rows that design_LRB would abandon get the same placeholder values and
+# buckling_fail = 1
+def design_LRB_batch(param_df, reduce_bearings=False, bypass_disp_check=False):
+    import numpy as np
+    import pandas as pd
+    from scipy.special import kv, i1, iv, i0
+    from loads import padded_levels
+    
+    # read in parameters
+    T_m = param_df['T_m'].to_numpy(dtype=float)
+    S_1 = param_df['S_1'].to_numpy(dtype=float)
+    zeta_m = param_df['zeta_e'].to_numpy(dtype=float)
+    rho_k = param_df['k_ratio'].to_numpy(dtype=float)
+    n_bays = param_df['num_bays'].to_numpy(dtype=int)
+    W_tot = param_df['W'].to_numpy(dtype=float)
+    moat_ampli = param_df['moat_ampli'].to_numpy(dtype=float)
+    n_rows = len(param_df)
+    
+    # number of LRBs (see get_layout)
+    N_lb = 4*n_bays
+    
+    # if reduce_bearing is triggered to increase bearing size, remove corners
+    if reduce_bearings:
+        N_lb = N_lb - 8
+        print('Warning: designing for 8 less bearings.')
+    
+    if bypass_disp_check:
+        S_pad_trial = 10.0
+        print('Warning: bypassing displacement vs. d_bearing check.')
+    else:
+        S_pad_trial = 20.0
+    
+    # converge design on Q
+    Q = minimize_bounded_batch(iterate_on_Q, (S_1, T_m, zeta_m, rho_k, W_tot),
+                               0.01, 0.15)
+    Q_L = Q * W_tot
+    
+    g  = 386.4
+    pi = 3.14159
+    
+    # from ASCE Ch. 17, get damping multiplier
+    zetaRef = [0.02, 0.05, 0.10, 0.20, 0.30, 0.40, 0.50]
+    BmRef   = [0.8, 1.0, 1.2, 1.5, 1.7, 1.9, 2.0]
+    
+    with np.errstate(all='ignore'):
+        B_m      = np.interp(zeta_m, zetaRef, BmRef)
+        
+        # design displacement
+        D_m = g*S_1*T_m/(4*pi**2*B_m)
+        k_M = (2*pi/T_m)**2 * (W_tot/g)
+        
+        # from Q, zeta, and T_m
+        k_2 = (k_M*D_m - Q_L)/D_m
+        
+        # yielding force
+        k_1 = rho_k * k_2
+        D_y = Q_L/(k_1 - k_2)
+        
+        # required area of lead per bearing
+        f_y_Pb = 1.5 # ksi, shear yield strength
+        A_Pb = (Q_L/f_y_Pb) / N_lb # in^2
+        d_Pb = (4*A_Pb/pi)**(0.5)
+    
+    # converge on t_r necessary to achieve rho_k
+    t_r = minimize_bounded_batch(iterate_bearing_height,
+                                 (D_m, k_M, Q_L, rho_k, N_lb,
+                                  np.full(n_rows, S_pad_trial)),
+                                 0.01, 1e3)
+    t_shim = 0.13
+    
+    with np.errstate(all='ignore'):
+        # 60 psi rubber
+        G_r = 0.060 # ksi, shear modulus
+        A_r = k_2 * t_r / (G_r * N_lb)
+        d_r = (4*(A_r + A_Pb)/pi)**(0.5)
+        
+        # final values
+        k_e = (Q_L + k_2*D_m)/D_m
+        T_e = 2*pi*(W_tot/(g*k_e))**0.5
+        W_e = 4*Q_L*(D_m - D_y)
+        zeta_loop = W_e/(2*pi*k_e*D_m**2)
+        lam_strain = (moat_ampli*D_m)/t_r
+        
+        #################################################
+        # buckling checks
+        #################################################
+        
+        # assume small strain G is 75% larger
+        G_ss = 1.75*G_r
+        # incompressibility
+        K_inc = 290 # ksi
+        
+        # shape factor (circular)
+        a = d_Pb/2
+        b_s = (d_r - 0.5)/2
+        
+        t_pad_req = b_s/(2*S_pad_trial)
+        n_layers = np.floor(t_r/t_pad_req)
+        
+        # if too many layers, try a lower S_pad
+        too_many_layers = n_layers > 60
+        t_pad_req = np.where(too_many_layers, b_s/(2*0.75*S_pad_trial), t_pad_req)
+        n_layers = np.where(too_many_layers, np.floor(t_r/t_pad_req), n_layers)
+        
+        n_shims = n_layers - 1
+        t = t_r/n_layers
+        
+        I = pi/4 * (b_s**4 - a**4)
+        A = pi*(b_s**2 - a**2)
+        h = t_r + n_shims*t_shim # 3.5mm shims
+        S_pad = b_s/(2*t)
+        eta = a/b_s
+        th = (48*G_ss/K_inc)**(0.5)*S_pad/(1 - eta)
+        
+        # compressive behavior, full solution from Kelly & Konstantinidis
+        C1p = ((1/((12*G_ss/K_inc)**0.5*(1 + eta)*S_pad)) * 
+               (kv(0, th) - kv(0, eta*th)) / 
+               (i0(th)*kv(0, eta*th) - i0(eta*th)*kv(0, th)))
+        
+        C2p = ((1/((12*G_ss/K_inc)**0.5*(1 + eta)*S_pad)) * 
+               (i0(th) - i0(eta*th)) / 
+               (i0(th)*kv(0, eta*th) - i0(eta*th)*kv(0, th)))
+        
+        E_c = (K_inc*(1 + C1p*(iv(1, th) - eta*iv(1,eta*th)) +
+                      C2p*(kv(1, th) - eta*kv(1, eta*th))))
+        
+        # rough vertical capacity of bearing (no buckling yet)
+        E_Pb = 2000 # ksi
+        P_vert = E_c * A_r + E_Pb * A_Pb
+        
+        # bending behavior, from Kelly & Konstantinidis
+        EI_eff_inc = 2*G_ss*S_pad**2*I*(1 + eta)**2/(1 + eta**2)
+        
+        B1p = (4/(th*(1 - eta**4)) * 
+                (-kv(1, eta*th) + eta*kv(1,th)) / 
+                (i1(eta*th)*kv(1, th) - i1(th)*kv(1,eta*th)))
+        
+        B2p = (4/(th*(1 - eta**4)) * 
+                (i1(eta*th) - eta*i1(th)) / 
+                (i1(eta*th)*kv(1, th) - i1(th)*kv(1,eta*th)))
+        
+        EI_comp_ratio = (K_inc/(2*G_ss*S_pad**2) * 
+                          (1 + eta**2)/((1 + eta)**2) * 
+                          (1 - B1p*(iv(2, th) - eta**2*iv(2, eta*th)) +
+                          B2p*(kv(2, th) - eta**2*kv(2, eta*th))))
+        
+        EI_eff_comp = EI_eff_inc * EI_comp_ratio
+        
+        # global buckling check
+        P_S = G_ss*A*h/t_r
+        P_E = pi**2*EI_eff_comp*h/t_r/(h**2)
+        P_crit = (-P_S + (P_S**2 + 4*P_S*P_E)**0.5)/2
+        
+        # this includes diaphragm, which is accurate representation of load above LRB
+        # summed level by level, same as sum() of each row's w_fl
+        L_bay = param_df['L_bay'].to_numpy(dtype=float) # ft
+        w_floor = padded_levels(param_df, 'w_fl') # k/ft
+        w_total = np.zeros(len(w_floor))
+        for level in range(w_floor.shape[1]):
+            w_total = w_total + np.nan_to_num(w_floor[:,level])
+        P_estimate = w_total*L_bay
+        pressure_estimate = P_estimate/(pi*b_s**2)
+        
+        # normalize stiffness by weight
+        k_e_norm = k_e/W_tot
+        
+        S_2 = 2*b_s/t_r
+        p_crit_circ = G_ss*pi*S_pad*S_2/(2*2**0.5)
+        
+        # buckling load, compression load, critical pressure (S2 solution)
+        flag = ((P_estimate/P_crit > 1.0) |
+                (P_estimate/P_vert > 1.0) |
+                (pressure_estimate/p_crit_circ > 1)).astype(int)
+        
+        # abandoned designs, in the order design_LRB checks them
+        # edge cases where k_M*D_m < Q_L
+        fail_k_2 = k_2 < 0
+        fail_layers = ~(n_layers >= 1)
+        if bypass_disp_check:
+            fail_disp = np.zeros(n_rows, dtype=bool)
+        else:
+            fail_disp = moat_ampli*D_m/d_r > 1.0
+        fail_strain = lam_strain > 3.0
+        fail_count = N_lb > (n_bays+1)**2
+    
+    all_designs = pd.DataFrame({'d_bearing': d_r, 'd_lead': d_Pb, 't_r': t_r,
+                                't': t, 'n_layers': n_layers, 'N_lb': N_lb,
+                                'S_pad': S_pad, 'S_2': S_2, 'T_e': T_e,
+                                'k_e': k_e_norm, 'Q': Q, 'zeta_loop': zeta_loop,
+                                'D_m': D_m, 'buckling_fail': flag},
+                               index=param_df.index)
+    
+    placeholder = {'d_bearing': 1.0, 'd_lead': 1.0, 't_r': 1.0, 't': 1.0,
+                   'n_layers': 1, 'N_lb': 1, 'S_pad': 1.0, 'S_2': 1.0,
+                   'buckling_fail': 1}
+    failed = fail_layers | fail_disp | fail_strain | fail_count
+    for col, value in placeholder.items():
+        all_designs.loc[failed | fail_k_2, col] = value
+    
+    # abandoned designs report unnormalized k_e, and the k_2 < 0 case stops
+    # before T_e and zeta_loop are computed
+    all_designs.loc[failed, 'k_e'] = k_e[failed]
+    all_designs.loc[fail_k_2, 'T_e'] = T_m[fail_k_2]
+    all_designs.loc[fail_k_2, 'k_e'] = k_M[fail_k_2]
+    all_designs.loc[fail_k_2, 'zeta_loop'] = zeta_m[fail_k_2]
+    
+    all_designs['n_layers'] = all_designs['n_layers'].astype(int)
+    
+    return(all_designs)
+
 def get_properties(shape):
     # if (len(shape) == 0):
     #     raise IndexError('No shape fits the requirements.')
@@ -1157,10 +1539,17 @@ def compressive_strength(Ag, ry, Lc_r, Ry=1.0):
     phi_Pn = phi * Ag * F_cr
     return(phi_Pn)
 
-def select_member(member_list, req_var, req_val):
+# sorted_values: member_list[req_var], if member_list is sorted by it
+# (ShapeCatalog.sorted_values); the qualified rows are then found by bisection
+def select_member(member_list, req_var, req_val, sorted_values=None):
     # req_var is string 'Ix' or 'Zx'
     # req_val is value
-    qualified_list = member_list[member_list[req_var] > req_val]
+    if sorted_values is None:
+        qualified_list = member_list[member_list[req_var] > req_val]
+    else:
+        from numpy import searchsorted
+        first = searchsorted(sorted_values, req_val, side='right')
+        qualified_list = member_list.iloc[first:]
     
     from numpy import nan
     if len(qualified_list) < 1:
@@ -1214,7 +1603,9 @@ def axial_check(current_member, member_list, L_bay, Pu, M_max=0.0):
         
     # if fail the interaction equation, design based on that
     if combined_forces_coef > 1.0:
-        # calculate coef for all available beams
+        # calculate coef for all available beams (member_list may be the
+        # shared catalog table, so work on a copy)
+        passed_axial_members = passed_axial_members.copy()
         Lc_beam = L_bay
         passed_axial_members['Lc_r'] = Lc_beam/passed_axial_members['ry']
         passed_axial_members['phi_Pn'] = passed_axial_members.apply(lambda row: 
@@ -1293,13 +1684,16 @@ def ph_shear_check(current_member, member_list, line_load, L_bay):
 
     return(selected_member, shear_list)
 
-def select_beam(fl, Ib, Zb, sorted_beams, w_load, q_load, M_load, L_bay):
+# beam_Ix: sorted_beams['Ix'] as a presorted array (ShapeCatalog.sorted_values)
+def select_beam(fl, Ib, Zb, sorted_beams, w_load, q_load, M_load, L_bay,
+                beam_Ix=None):
     
     I_beam_req = Ib[fl]
     Z_beam_req = Zb[fl]
     
     selected_beam, passed_Ix_beams = select_member(sorted_beams, 
-                                                   'Ix', I_beam_req)
+                                                   'Ix', I_beam_req,
+                                                   sorted_values=beam_Ix)
 
     selected_beam, passed_Zx_beams = zx_check(selected_beam, 
                                               passed_Ix_beams, Z_beam_req)
@@ -1327,8 +1721,9 @@ def select_beam(fl, Ib, Zb, sorted_beams, w_load, q_load, M_load, L_bay):
     return(selected_beam, passed_checks_beams)
     
 # SCWB design
+# col_Ix: col_list['Ix'] as a presorted array (ShapeCatalog.sorted_values)
 def select_column(fl, wLoad, M_load, L_bay, h_col, all_beams, col_list, 
-                  Ic, Ib, db_string='../resource/'):
+                  Ic, Ib, db_string='../resource/', col_Ix=None):
 
     import numpy as np
     from building import get_shape
@@ -1359,7 +1754,11 @@ def select_column(fl, wLoad, M_load, L_bay, h_col, all_beams, col_list,
         Pr[i] = V_grav[i] + Pr[i + 1]
     
     # initial guess: use columns that has similar Ix to beam
-    qualified_Ix = col_list[col_list['Ix'] > I_beam_req]
+    if col_Ix is None:
+        qualified_Ix = col_list[col_list['Ix'] > I_beam_req]
+    else:
+        qualified_Ix = col_list.iloc[np.searchsorted(col_Ix, I_beam_req, 
+                                                     side='right'):]
     if len(qualified_Ix) < 1:
         return (np.nan, np.nan)
     # select the first few that qualifies Ix
@@ -1475,16 +1874,18 @@ def scwb_check(all_columns, all_beams, w_load, L_bay, db_string='../resource/'):
     
 def design_MF(input_df, db_string='../resource/'):
     
+    from loads import level_values, load_case_values
+    
     # ensure everything is in inches, kip/in
     ft = 12.0
     R_y = input_df['RI']
     n_bays = input_df['num_bays']
     L_bay = input_df['L_bay']*ft 
-    hsx = input_df['hsx']
-    Fx = input_df['Fx']
-    h_col = input_df['h_col']
+    hsx = level_values(input_df, 'hsx')
+    Fx = level_values(input_df, 'Fx')
+    h_col = level_values(input_df, 'h_col')
     
-    load_cases = input_df['all_w_cases']
+    load_cases = load_case_values(input_df, 'all_w_cases')
     case_1 = load_cases['1.2D+0.5L+1.0E'][1:]/12
     case_2 = load_cases['0.9D-1.0E'][1:]/12
     
@@ -1503,13 +1904,12 @@ def design_MF(input_df, db_string='../resource/'):
     
     # import shapes 
     
-    beam_shapes      = pd.read_csv(db_string+'beamShapes.csv',
-        index_col=None, header=0)
-    sorted_beams     = beam_shapes.sort_values(by=['Ix'])
-    
-    col_shapes       = pd.read_csv(db_string+'colShapes.csv',
-        index_col=None, header=0)
-    sorted_cols      = col_shapes.sort_values(by=['Ix'])
+    from building import get_shape_catalog
+    shape_catalog    = get_shape_catalog(db_string)
+    sorted_beams     = shape_catalog.sorted_by('beam', 'Ix')
+    sorted_cols      = shape_catalog.sorted_by('column', 'Ix')
+    beam_Ix          = shape_catalog.sorted_values('beam', 'Ix')
+    col_Ix           = shape_catalog.sorted_values('column', 'Ix')
     
     # select beams
     all_beams = []
@@ -1519,7 +1919,7 @@ def design_MF(input_df, db_string='../resource/'):
         selected_beam, qualified_beams = select_beam(fl, Ib, Zb, 
                                                      sorted_beams, 
                                                      w_load, q, Mu,
-                                                     L_bay)
+                                                     L_bay, beam_Ix=beam_Ix)
         
         if selected_beam is not np.nan:
             all_beams.append(selected_beam.iloc[0]['AISC_Manual_Label'])
@@ -1540,7 +1940,8 @@ def design_MF(input_df, db_string='../resource/'):
                                                                all_beams, 
                                                                sorted_cols, 
                                                                Ic, Ib,
-                                                               db_string=db_string)
+                                                               db_string=db_string,
+                                                               col_Ix=col_Ix)
             if selected_column is not np.nan:
                 all_columns.append(selected_column.iloc[0]['AISC_Manual_Label'])
             else:
@@ -1672,19 +2073,18 @@ def select_compression_member(mem_list, Lc, C_design):
     if mem_list is np.nan:
         return np.nan, np.nan
     
-    mem_list['Lc_r'] = Lc/mem_list['ry']
-    
-    mem_list['phi_Pn'] = mem_list.apply(lambda row: 
-                                            compressive_strength(
-                                                row['A'],
-                                                row['ry'],
-                                                row['Lc_r']),
-                                            axis='columns')
+    # mem_list may be the shared catalog table, so only the qualified rows
+    # are copied and given the new columns
+    Lc_r = Lc/mem_list['ry'].to_numpy()
+    phi_Pn = np.array([compressive_strength(A, ry, slender) for A, ry, slender in
+                       zip(mem_list['A'].to_numpy(), mem_list['ry'].to_numpy(), Lc_r)])
     
     # choose compact designs that can withstand C_max
     # compact requirement from AISC 341-16, Sec F2.5
-    qualified_list = mem_list[(mem_list['Lc_r'] < 200.0) & 
-                              (mem_list['phi_Pn'] >= C_design)]
+    qualifies = (Lc_r < 200.0) & (phi_Pn >= C_design)
+    qualified_list = mem_list[qualifies].copy()
+    qualified_list['Lc_r'] = Lc_r[qualifies]
+    qualified_list['phi_Pn'] = phi_Pn[qualifies]
     
     if len(qualified_list) < 1:
         return(np.nan, np.nan)
@@ -1929,18 +2329,20 @@ def capacity_CBF_column(selected_brace, current_floor,
 
 def design_CBF(input_df, db_string='../resource/'):
     
+    from loads import level_values, load_case_values
+    
     # ensure everything is in inches, kip/in
     ft = 12.0
     R_y = input_df['RI']
     n_bays = input_df['num_bays']
     L_bay = input_df['L_bay']*ft 
-    hsx = input_df['hsx']
-    Fx = input_df['Fx']
+    hsx = level_values(input_df, 'hsx')
+    Fx = level_values(input_df, 'Fx')
     # h_col = input_df['h_col']
     h_story = input_df['h_story']*ft
     
     # cases specific to earthquake design
-    load_cases = input_df['all_w_cases']
+    load_cases = load_case_values(input_df, 'all_w_cases')
     case_1 = load_cases['1.2D+0.5L+1.0E'][1:]/12
     case_2 = load_cases['0.9D-1.0E'][1:]/12
     
@@ -1963,17 +2365,11 @@ def design_CBF(input_df, db_string='../resource/'):
     
     # import shapes 
     
-    brace_shapes      = pd.read_csv(db_string+'braceShapes.csv',
-        index_col=None, header=0)
-    sorted_braces     = brace_shapes.sort_values(by=['A'])
-
-    beam_shapes      = pd.read_csv(db_string+'beamShapes.csv',
-        index_col=None, header=0)
-    sorted_beams     = beam_shapes.sort_values(by=['A'])
-    
-    col_shapes       = pd.read_csv(db_string+'colShapes.csv',
-        index_col=None, header=0)
-    sorted_cols      = col_shapes.sort_values(by=['A'])
+    from building import get_shape_catalog
+    shape_catalog     = get_shape_catalog(db_string)
+    sorted_braces     = shape_catalog.sorted_by('brace', 'A')
+    sorted_beams      = shape_catalog.sorted_by('beam', 'A')
+    sorted_cols       = shape_catalog.sorted_by('column', 'A')
 
     # Braces
     # select compact braces that has required compression capacity
@@ -2040,3 +2436,168 @@ def design_CBF(input_df, db_string='../resource/'):
             
     return(all_braces, all_beams, all_columns)
     
+
+############################################################################
+#              Superstructure design cache
+############################################################################
+
+# design_MF and design_CBF depend only on the frame geometry, RI, the story
+# forces and the distributed load cases. Sampled designs with the same story
+# and bay counts often round to near-identical demands, and the same designs
+# are redesigned for every IDA/DoE call, so member selections are memoized.
+# inputs are rounded to sig_figs significant figures before hashing, and a
+# hit returns the members of the first design with that key. the selections
+# are not insensitive to any useful rounding (check_design_quantization, 1330
+# designs of seeds 3, 5 and 7): rounding the inputs changes the members of
+# 0.1% of designs at 5 figures, 1% at 4 and 10% at 3. even at 2 figures no
+# two LHS samples share a key, since the key holds some 30 continuous
+# values. so the hits come from repeated designs (IDA levels, DoE reruns,
+# reruns of a seed), and sig_figs=4 only absorbs float noise in those
+# (e.g. designs read back from CSV) at about 1% of designs changed.
+# recent designs are held in an in-memory LRU; with cache_path, all designs
+# are also kept in a pickle on disk, merged with the file on every save
+
+class DesignCache:
+    
+    def __init__(self, cache_path=None, max_size=4096, sig_figs=4):
+        from collections import OrderedDict
+        import os
+        
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.sig_figs = sig_figs
+        self.memory = OrderedDict()
+        self.disk = {}
+        self.n_unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        
+        if (cache_path is not None) and os.path.isfile(cache_path):
+            self.disk = self.read_disk()
+    
+    def read_disk(self):
+        import pickle
+        with open(self.cache_path, 'rb') as f:
+            return(pickle.load(f))
+    
+    def quantize(self, x):
+        import numpy as np
+        values = np.atleast_1d(np.asarray(x, dtype=float)).ravel()
+        return(tuple(float('%.*g' % (self.sig_figs, v)) for v in values))
+    
+    # canonical hash of the design inputs
+    def key(self, system, input_df, db_string):
+        import hashlib
+        import os
+        
+        from loads import level_values, load_case_values
+        
+        w_cases = load_case_values(input_df, 'all_w_cases')
+        parts = [system, os.path.abspath(db_string),
+                 int(input_df['num_bays']),
+                 self.quantize(input_df['L_bay']),
+                 self.quantize(input_df['RI']),
+                 self.quantize(level_values(input_df, 'hsx')),
+                 self.quantize(level_values(input_df, 'Fx'))]
+        
+        if system == 'MF':
+            parts.append(self.quantize(level_values(input_df, 'h_col')))
+        else:
+            parts.append(self.quantize(input_df['h_story']))
+        
+        for case in sorted(w_cases.keys()):
+            parts.append((case, self.quantize(w_cases[case])))
+            
+        return(hashlib.sha1(repr(parts).encode()).hexdigest())
+    
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return(self.memory[key])
+        if key in self.disk:
+            self.hits += 1
+            self.put_memory(key, self.disk[key])
+            return(self.disk[key])
+        self.misses += 1
+        return(None)
+    
+    def put_memory(self, key, design):
+        self.memory[key] = design
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+    
+    def put(self, key, design):
+        self.put_memory(key, design)
+        if self.cache_path is not None:
+            self.disk[key] = design
+            self.n_unsaved += 1
+    
+    # merge with what other processes may have written, then replace the file
+    def save(self):
+        import os
+        import pickle
+        
+        if (self.cache_path is None) or (self.n_unsaved == 0):
+            return
+        
+        if os.path.isfile(self.cache_path):
+            on_disk = self.read_disk()
+            on_disk.update(self.disk)
+            self.disk = on_disk
+        
+        tmp_path = '%s.%d.tmp' % (self.cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.disk, f)
+        os.replace(tmp_path, self.cache_path)
+        self.n_unsaved = 0
+    
+    # design results hold lists, so copies are handed out
+    def design(self, system, input_df, db_string='../resource/'):
+        key = self.key(system, input_df, db_string)
+        design = self.get(key)
+        if design is None:
+            if system == 'MF':
+                design = design_MF(input_df, db_string=db_string)
+            else:
+                design = design_CBF(input_df, db_string=db_string)
+            self.put(key, design)
+        return(tuple(list(member) if isinstance(member, list) else member
+                     for member in design))
+
+# designs of df_in (with lateral forces assigned) whose members change when
+# the inputs of the cache key are rounded to sig_figs, and the number of
+# distinct keys among them
+def check_design_quantization(df_in, sig_figs=4, db_string='../resource/'):
+    from loads import load_case_values, load_case_prefix
+    
+    cache = DesignCache(sig_figs=sig_figs)
+    n_changed = 0
+    keys = set()
+    for index, row in df_in.iterrows():
+        system = row['superstructure_system']
+        prefixes = ['hsx_', 'Fx_', 'h_col_'] + [
+            load_case_prefix['all_w_cases']+case+'_' 
+            for case in load_case_values(row, 'all_w_cases')]
+        key_cols = [col for col in row.index if (col in ['L_bay', 'RI', 'h_story']) or 
+                    any(col.startswith(prefix) for prefix in prefixes)]
+        rounded = row.copy()
+        rounded[key_cols] = [cache.quantize(value)[0] for value in row[key_cols]]
+        
+        design_fn = design_MF if system == 'MF' else design_CBF
+        if (repr(design_fn(row, db_string=db_string)) != 
+            repr(design_fn(rounded, db_string=db_string))):
+            n_changed += 1
+        keys.add(cache.key(system, row, db_string))
+    return(n_changed, len(keys))
+
+_design_caches = {}
+
+def get_design_cache(cache_path=None):
+    import os
+    
+    cache_key = None if cache_path is None else os.path.abspath(cache_path)
+    if cache_key not in _design_caches:
+        _design_caches[cache_key] = DesignCache(cache_path)
+    return _design_caches[cache_key]
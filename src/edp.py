@@ -0,0 +1,129 @@
+############################################################################
+#               EDP tracker
+
+# Date created: October 2026
+
+# Description:  Running peaks of the engineering demand parameters of a
+#               ground motion run, updated after every committed analysis
+#               step. Replaces writing the recorder time histories to disk
+#               and reading them back to take maxima.
+
+# Open issues:  (1) the tracker follows the outer and inner column lines only,
+#               same as the recorders that prepare_results used to read
+
+############################################################################
+
+g = 386.4
+impact_thresh = 100   # kips
+
+class EDPTracker:
+
+    def __init__(self, outer_col_nds, inner_col_nds, isol_node, impact_elems,
+                 h_story, gm_dt, gm_values, gm_factor, ok_thresh):
+        import numpy as np
+
+        self.outer_col_nds = list(outer_col_nds)
+        self.inner_col_nds = list(inner_col_nds)
+        self.isol_node = isol_node
+        self.impact_elems = list(impact_elems)
+        self.h_col = h_story*12.0
+        self.ok_thresh = ok_thresh
+
+        # ground acceleration, same as the Path series used for the excitation
+        # (linear between points, zero after the record ends)
+        self.gm_time = gm_dt*np.arange(len(gm_values))
+        self.gm_values = np.asarray(gm_values, dtype=float)
+        self.gm_factor = gm_factor
+
+        n_levels = len(self.outer_col_nds)
+        self.n_steps = 0
+        self.peak_drift = np.zeros(n_levels-1)
+        self.peak_vel = np.zeros(n_levels)
+        self.peak_acc = np.zeros(n_levels)
+        self.last_drift = np.zeros(n_levels-1)
+        self.max_isol_disp = 0.0
+        self.max_impact_force = 0.0
+
+        # state where the worst drift is closest to ok_thresh, used if the run
+        # fails (see prepare_results)
+        self.ok_gap = np.inf
+        self.ok_drift = self.peak_drift.copy()
+        self.ok_vel = self.peak_vel.copy()
+        self.ok_acc = self.peak_acc.copy()
+
+    def ground_accel(self, t):
+        import numpy as np
+        return(self.gm_factor*np.interp(t, self.gm_time, self.gm_values,
+                                        left=0.0, right=0.0))
+
+    # read the current committed state from the domain
+    def update(self):
+        import opensees.openseespy as ops
+        import numpy as np
+
+        outer_disp = np.array([ops.nodeDisp(nd, 1) for nd in self.outer_col_nds])
+        inner_disp = np.array([ops.nodeDisp(nd, 1) for nd in self.inner_col_nds])
+        drift = np.maximum(np.abs(np.diff(outer_disp)),
+                           np.abs(np.diff(inner_disp)))/self.h_col
+
+        vel = np.maximum(
+            np.abs([ops.nodeVel(nd, 1) for nd in self.outer_col_nds]),
+            np.abs([ops.nodeVel(nd, 1) for nd in self.inner_col_nds]))
+
+        # absolute acceleration
+        ag = self.ground_accel(ops.getTime())
+        acc = np.maximum(
+            np.abs(np.array([ops.nodeAccel(nd, 1) for nd in self.outer_col_nds]) + ag),
+            np.abs(np.array([ops.nodeAccel(nd, 1) for nd in self.inner_col_nds]) + ag))/g
+
+        np.maximum(self.peak_drift, drift, out=self.peak_drift)
+        np.maximum(self.peak_vel, vel, out=self.peak_vel)
+        np.maximum(self.peak_acc, acc, out=self.peak_acc)
+        self.last_drift = drift
+
+        gap = abs(drift.max() - self.ok_thresh)
+        if gap < self.ok_gap:
+            self.ok_gap = gap
+            self.ok_drift = drift
+            self.ok_vel = vel
+            self.ok_acc = acc
+
+        self.max_isol_disp = max(self.max_isol_disp,
+                                 abs(ops.nodeDisp(self.isol_node, 1)))
+
+        for elem in self.impact_elems:
+            force = ops.eleResponse(elem, 'basicForce')
+            if len(force) > 0:
+                self.max_impact_force = max(self.max_impact_force,
+                                            np.abs(force).max())
+
+        self.n_steps += 1
+
+    # EDPs in the same form as reduce_recorders
+    def summary(self, run_status):
+
+        # if run was OK, we collect true max values
+        if run_status == 0:
+            PID = self.peak_drift.tolist()
+            PFV = self.peak_vel.tolist()
+            PFA = self.peak_acc.tolist()
+            RID = self.last_drift.tolist()
+
+        # if run failed, take the state corresponding to ok_thresh drift
+        else:
+            PID = self.ok_drift.tolist()
+            PFV = self.ok_vel.tolist()
+            PFA = self.ok_acc.tolist()
+            RID = PID
+
+        if self.max_impact_force > impact_thresh:
+            impact_bool = 1
+        else:
+            impact_bool = 0
+
+        return({'max_isol_disp': self.max_isol_disp,
+                'PID': PID,
+                'PFV': PFV,
+                'PFA': PFA,
+                'RID': RID,
+                'impacted': impact_bool})
@@ -9,12 +9,12 @@
 # Description:  Functions as control for Opensees experiments
 ############################################################################
 
-# prepare the pandas output of the run
-def prepare_results(output_path, design, T_1, Tfb, run_status):
+# reduce the recorder time histories of a run (written with debug=True) to the
+# EDPs. run_nlth gets the same values from the in-process EDPTracker instead
+def reduce_recorders(output_path, design, run_status):
     
     import pandas as pd
     import numpy as np
-    from gms import get_gm_ST, get_ST
     
     num_stories = design['num_stories']
     
@@ -52,6 +52,15 @@ def prepare_results(output_path, design, T_1, Tfb, run_status):
     isol_disp = pd.read_csv(output_path+'isolator_displacement.csv', sep=' ',
                             header=None, names=isol_dof_names)
     
+    # recorders are closed by run_ground_motion before it returns, so every
+    # history must end at the same step. a short file means a partial write
+    histories = [inner_col_disp, outer_col_disp, inner_col_vel, outer_col_vel,
+                 inner_col_acc, outer_col_acc, isol_disp]
+    n_rows = [len(history) for history in histories]
+    if min(n_rows) != max(n_rows):
+        raise RuntimeError('Incomplete recorder output in %s (%d to %d rows).' %
+                           (output_path, min(n_rows), max(n_rows)))
+    
     # maximum displacement in isol layer
     isol_max_horiz_disp = isol_disp['horizontal'].abs().max()
     
@@ -115,7 +124,26 @@ def prepare_results(output_path, design, T_1, Tfb, run_status):
         impact_bool = 1
     else:
         impact_bool = 0
-        
+    
+    return({'max_isol_disp': isol_max_horiz_disp,
+            'PID': PID,
+            'PFV': PFV,
+            'PFA': PFA,
+            'RID': RID,
+            'impacted': impact_bool})
+
+# prepare the pandas output of the run
+# edp is the dict of EDPs from EDPTracker.summary; without it, the EDPs are
+# reduced from the recorder files in output_path
+def prepare_results(output_path, design, T_1, Tfb, run_status, edp=None):
+    
+    import pandas as pd
+    import numpy as np
+    from gms import get_gm_ST, get_ST
+    
+    if edp is None:
+        edp = reduce_recorders(output_path, design, run_status)
+    
     Tms_interest = np.array([design['T_m'], 1.0, Tfb])
     
     # be careful not to double calculate damping effect
@@ -148,12 +176,12 @@ def prepare_results(output_path, design, T_1, Tfb, run_status):
                    'T_fb': Tfb,
                    'T_ratio' : design['T_m']/Tfb,
                    'gap_ratio' : gap_ratio,
-                   'max_isol_disp': isol_max_horiz_disp,
-                   'PID': PID,
-                   'PFV': PFV,
-                   'PFA': PFA,
-                   'RID': RID,
-                   'impacted': impact_bool,
+                   'max_isol_disp': edp['max_isol_disp'],
+                   'PID': edp['PID'],
+                   'PFV': edp['PFV'],
+                   'PFA': edp['PFA'],
+                   'RID': edp['RID'],
+                   'impacted': edp['impacted'],
                    'run_status': run_status
         }
     result_series = pd.Series(result_dict)
@@ -192,117 +220,220 @@ def collapse_fragility(run, mf_drift_mu_plus_std=0.1, cbf_drift_90=0.05):
 
 # run the experiment, GM name and scale factor must be baked into design
 
+# debug=True also writes the full recorder time histories to output_path
+# phase times and counters of the run are appended to profile_log (JSON lines,
+# see profiling.py); defaults to ./profiles/run_profile.jsonl. It is kept out of
+# output_path, which is scratch
 def run_nlth(design, 
              gm_path='../resource/ground_motions/PEERNGARecords_Unscaled/',
-             output_path='./outputs/'):
+             output_path='./outputs/', debug=False, profile_log=None):
     
     from building import Building
+    from profiling import RunProfile
+    from ledger import run_key
+    
+    profile = RunProfile(run_key=run_key(design),
+                         gm_selected=design['gm_selected'],
+                         scale_factor=design['scale_factor'],
+                         superstructure_system=design['superstructure_system'],
+                         isolator_system=design['isolator_system'],
+                         num_stories=design['num_stories'],
+                         num_bays=design['num_bays'])
     
     # generate the building, construct model
-    bldg = Building(design)
-    bldg.model_frame()
+    with profile.phase('model_build'):
+        bldg = Building(design)
+        bldg.model_frame()
+    bldg.profile = profile
     
     # apply gravity loads, perform eigenvalue analysis, add damping
-    bldg.apply_grav_load()
-    T_1 = bldg.run_eigen()
-    Tfb = bldg.provide_damping(80, method='SP',
-                               zeta=[0.05], modes=[1])
+    with profile.phase('gravity'):
+        bldg.apply_grav_load()
+    with profile.phase('eigen'):
+        T_1 = bldg.run_eigen()
+    with profile.phase('damping'):
+        Tfb = bldg.provide_damping(80, method='SP',
+                                   zeta=[0.05], modes=[1])
     
     # run ground motion
+    # a failing window is retried in place at the smaller dt of the ladder
+    # (warm restart) before the run is given up on
     if bldg.superstructure_system == 'MF':
         dt_default = 0.005
+        dt_ladder = [0.001, 0.0005]
     else:
         dt_default = 0.005
-    run_status = bldg.run_ground_motion(design['gm_selected'], 
-                                   design['scale_factor'], 
-                                   dt_default,
-                                   gm_dir=gm_path,
-                                   data_dir=output_path)
-    
-    # lower dt if convergence issues
+        dt_ladder = [0.001]
+    with profile.phase('ground_motion'):
+        run_status = bldg.run_ground_motion(design['gm_selected'], 
+                                       design['scale_factor'], 
+                                       dt_default,
+                                       gm_dir=gm_path,
+                                       data_dir=output_path,
+                                       debug=debug,
+                                       dt_ladder=dt_ladder)
+    
+    # CBF convergence mode is a different model, so it needs a rebuild
     if run_status != 0:
         if bldg.superstructure_system == 'MF':
-            print('Lowering time step...')
-            
-            bldg = Building(design)
-            bldg.model_frame()
-            
-            # apply gravity loads, perform eigenvalue analysis, add damping
-            bldg.apply_grav_load()
-            T_1 = bldg.run_eigen()
-            Tfb = bldg.provide_damping(80, method='SP',
-                                       zeta=[0.05], modes=[1])
-            
-            run_status = bldg.run_ground_motion(design['gm_selected'], 
-                                                design['scale_factor'], 
-                                                0.001,
-                                                gm_dir=gm_path,
-                                                data_dir=output_path)
+            print('MF did not converge ...')
         else:
-            # print('Cutting time did not work.')
             print('Lowering time step and convergence mode CBF...')
+            profile.count('rebuilds')
             
-            bldg = Building(design)
-            bldg.model_frame(convergence_mode=True)
+            with profile.phase('model_build'):
+                bldg = Building(design)
+                bldg.model_frame(convergence_mode=True)
+            bldg.profile = profile
             
             # apply gravity loads, perform eigenvalue analysis, add damping
-            bldg.apply_grav_load()
-            T_1 = bldg.run_eigen()
-            Tfb = bldg.provide_damping(80, method='SP',
-                                        zeta=[0.05], modes=[1])
-            
-            run_status = bldg.run_ground_motion(design['gm_selected'], 
-                                                design['scale_factor'], 
-                                                0.001,
-                                                gm_dir=gm_path,
-                                                data_dir=output_path)
-        
-    # CBF if still no converge, give up
-    if run_status != 0:
-        if bldg.superstructure_system == 'MF':
-            print('Lowering time step one last time...')
-            
-            bldg = Building(design)
-            bldg.model_frame()
-            
-            # apply gravity loads, perform eigenvalue analysis, add damping
-            bldg.apply_grav_load()
-            T_1 = bldg.run_eigen()
-            Tfb = bldg.provide_damping(80, method='SP',
-                                       zeta=[0.05], modes=[1])
-            
-            run_status = bldg.run_ground_motion(design['gm_selected'], 
-                                                design['scale_factor'], 
-                                                0.0005,
-                                                gm_dir=gm_path,
-                                                data_dir=output_path)
-        else:
-            print('CBF did not converge ...')
-            
-            # bldg = Building(design)
-            # bldg.model_frame(convergence_mode=True)
-            
-            # # apply gravity loads, perform eigenvalue analysis, add damping
-            # bldg.apply_grav_load()
-            # T_1 = bldg.run_eigen()
-            # Tfb = bldg.provide_damping(80, method='SP',
-            #                             zeta=[0.05], modes=[1])
-            
-            # run_status = bldg.run_ground_motion(design['gm_selected'], 
-            #                                     design['scale_factor'], 
-            #                                     0.0005,
-            #                                     gm_dir=gm_path,
-            #                                     data_dir=output_path)
+            with profile.phase('gravity'):
+                bldg.apply_grav_load()
+            with profile.phase('eigen'):
+                T_1 = bldg.run_eigen()
+            with profile.phase('damping'):
+                Tfb = bldg.provide_damping(80, method='SP',
+                                            zeta=[0.05], modes=[1])
+            
+            with profile.phase('ground_motion'):
+                run_status = bldg.run_ground_motion(design['gm_selected'], 
+                                                    design['scale_factor'], 
+                                                    0.001,
+                                                    gm_dir=gm_path,
+                                                    data_dir=output_path,
+                                                    debug=debug,
+                                                    dt_ladder=[0.0005])
+            
+            if run_status != 0:
+                print('CBF did not converge ...')
+                
     if run_status != 0:
         print('Recording run and moving on.')
-       
-    # add a little delay to prevent weird overwriting
-    import time
-    time.sleep(3)
     
-    results_series = prepare_results(output_path, design, T_1, Tfb, run_status)
+    with profile.phase('results'):
+        edp = bldg.edp_tracker.summary(run_status)
+        results_series = prepare_results(output_path, design, T_1, Tfb, run_status,
+                                         edp=edp)
+    
+    profile.set('run_status', run_status)
+    if profile_log is None:
+        profile_log = './profiles/run_profile.jsonl'
+    profile.log(profile_log)
     return(results_series)
     
+# parallel execution of many NLTHs
+# each pool worker is its own process, so it holds its own OpenSees interpreter
+# recorders of a worker go into a private directory under output_path, and
+# its run profiles into its own log under profile_path
+
+_worker_output_path = None
+_worker_profile_log = None
+
+def _init_nlth_worker(output_path, profile_path):
+    import os
+    global _worker_output_path, _worker_profile_log
+    _worker_output_path = output_path+'worker_'+str(os.getpid())+'/'
+    os.makedirs(_worker_output_path, exist_ok=True)
+    _worker_profile_log = profile_path+'worker_'+str(os.getpid())+'.jsonl'
+
+def _nlth_worker(design, gm_path):
+    import time
+    t0 = time.time()
+    bldg_result = run_nlth(design, gm_path=gm_path, output_path=_worker_output_path,
+                           profile_log=_worker_profile_log)
+    return(bldg_result, time.time() - t0)
+
+# if a ledger is given, every finished run is committed to it by the parent
+# runs are submitted longest-expected-first by predictor (a
+# runner.RuntimePredictor, see runner.fit_runtime_predictor; untrained if None)
+# completed runs are checkpointed in chunks, and the designs of failed runs
+# logged, under checkpoint_path. It is kept apart from output_path, which
+# analyze_db clears on every call. Each call tags its files with its start
+# time, so a rerun does not overwrite the checkpoints of an earlier one.
+# returns an empty frame if no run finished
+def run_nlth_parallel(all_designs, n_workers,
+                      gm_path='../resource/ground_motions/PEERNGARecords_Unscaled/',
+                      output_path='./outputs/', save_interval=10, ledger=None,
+                      predictor=None, checkpoint_path='./checkpoints/',
+                      profile_path='./profiles/'):
+
+    import os
+    import time
+    import numpy as np
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    n_runs = len(all_designs)
+    
+    os.makedirs(checkpoint_path, exist_ok=True)
+    run_tag = time.strftime('%Y%m%d_%H%M%S')
+    
+    if predictor is None:
+        from runner import RuntimePredictor
+        predictor = RuntimePredictor(gm_path=gm_path)
+    run_order = np.argsort(-predictor.predict(all_designs), kind='stable')
+
+    # results are kept by their row position so that the final frame keeps
+    # the order of all_designs regardless of finish order
+    results = {}
+    failed = {}
+    chunk = []
+    n_chunks = 0
+
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init_nlth_worker,
+                             initargs=(output_path, profile_path)) as pool:
+        futures = {pool.submit(_nlth_worker, all_designs.iloc[i_run], gm_path): i_run
+                   for i_run in run_order}
+
+        for future in as_completed(futures):
+            i_run = futures[future]
+            try:
+                bldg_result, wall_time = future.result()
+            except Exception as err:
+                print('Run %d failed with %s: %s' %
+                      (i_run+1, type(err).__name__, err))
+                failed[i_run] = type(err).__name__+': '+str(err)
+                continue
+
+            if ledger is not None:
+                ledger.commit(all_designs.iloc[i_run], bldg_result,
+                              wall_time=wall_time)
+
+            results[i_run] = bldg_result
+            chunk.append(bldg_result)
+            print('========= Finished run %d (%d of %d done) ==========' %
+                  (i_run+1, len(results), n_runs))
+
+            # checkpoint completed runs in chunks. chunks are written in order
+            # of completion, so they can be stitched in any order
+            if len(chunk) == save_interval:
+                pd.DataFrame(chunk).to_csv(
+                    checkpoint_path+'temp_save_'+run_tag+'_chunk_'+str(n_chunks)+'.csv',
+                    index=False)
+                n_chunks += 1
+                chunk = []
+
+    if len(chunk) > 0:
+        pd.DataFrame(chunk).to_csv(
+            checkpoint_path+'temp_save_'+run_tag+'_chunk_'+str(n_chunks)+'.csv',
+            index=False)
+
+    # designs of the failed runs, with their errors, so they can be rerun
+    if len(failed) > 0:
+        failed_designs = all_designs.iloc[sorted(failed)].copy()
+        failed_designs['error'] = [failed[i_run] for i_run in sorted(failed)]
+        failed_path = checkpoint_path+'failed_runs_'+run_tag+'.csv'
+        failed_designs.to_csv(failed_path, index=False)
+        print('%d of %d runs failed, designs written to %s' %
+              (len(failed), n_runs, failed_path))
+
+    if len(results) == 0:
+        return(pd.DataFrame())
+
+    db_results = pd.DataFrame([results[i_run] for i_run in sorted(results)])
+    return(db_results)
+
 # TODO: DoE has NOT been integrated for CBF
 def run_doe(prob_target, df_train, df_test, sample_bounds=None,
             batch_size=10, error_tol=0.15, maxIter=1000, conv_tol=1e-2,
@@ -381,7 +512,7 @@ def run_doe(prob_target, df_train, df_test, sample_bounds=None,
     rho_idx = 0
     
     import design as ds
-    from loads import define_lateral_forces, define_gravity_loads
+    from loads import assign_lateral_forces, assign_gravity_loads
     from gms import scale_ground_motion
     
     while doe_idx < maxIter:
@@ -515,13 +646,7 @@ def run_doe(prob_target, df_train, df_test, sample_bounds=None,
                 work_df['moat_ampli'] = work_df['gap_ratio']
                 
                 # design
-                work_df[['W', 
-                       'W_s', 
-                       'w_fl', 
-                       'P_lc',
-                       'all_w_cases',
-                       'all_Plc_cases']] = work_df.apply(lambda row: define_gravity_loads(row),
-                                                        axis='columns', result_type='expand')
+                work_df = assign_gravity_loads(work_df)
                              
                 try:
                     all_tfp_designs = work_df.apply(lambda row: ds.design_TFP_legacy(row),
@@ -546,14 +671,7 @@ def run_doe(prob_target, df_train, df_test, sample_bounds=None,
                                     axis=1)
                 
                 # get lateral force and design structures
-                work_df[['wx', 
-                       'hx', 
-                       'h_col', 
-                       'hsx', 
-                       'Fx', 
-                       'Vs',
-                       'T_fbe']] = work_df.apply(lambda row: define_lateral_forces(row),
-                                            axis='columns', result_type='expand')
+                work_df = assign_lateral_forces(work_df)
                                                   
                 all_mf_designs = work_df.apply(lambda row: ds.design_MF(row),
                                                  axis='columns', 
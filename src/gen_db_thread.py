@@ -1,15 +1,35 @@
 def generate_db(num, seed):
     from db import Database
-    main_obj = Database(n_points=num, seed=seed)
-    main_obj.design_bearings(filter_designs=True)
-    main_obj.design_structure(filter_designs=True)
-    main_obj.scale_gms()
+    import os
+    import pickle
+    
+    # the designed database (with its selected GMs) is kept before analysis,
+    # so that a restarted job resumes the exact same set of runs
+    prep_path = '../data/structural_db_seed_'+str(seed)+'_prepared.pickle'
+    if os.path.exists(prep_path):
+        with open(prep_path, 'rb') as f:
+            main_obj = pickle.load(f)
+    else:
+        main_obj = Database(n_points=num, seed=seed)
+        main_obj.design_bearings(filter_designs=True)
+        main_obj.design_structure(filter_designs=True)
+        main_obj.scale_gms()
+        with open(prep_path, 'wb') as f:
+            pickle.dump(main_obj, f)
+    
     output_dir = './outputs/seed_'+str(seed)+'_output/'
+    ledger_path = '../data/structural_db_seed_'+str(seed)+'_ledger.db'
     main_obj.analyze_db('structural_db_seed_'+str(seed)+'.csv', save_interval=5,
-                        output_path=output_dir)
-    import pickle
+                        output_path=output_dir, ledger_path=ledger_path)
+    
+    # the pickle is what taccdata/aggregate.py reads
     with open('../data/structural_db_seed_'+str(seed)+'.pickle', 'wb') as f:
         pickle.dump(main_obj, f)
+    
+    # Parquet copy of the tables (see store.py), read back with
+    # store.load_database; skipped if pyarrow is not usable
+    from store import save_database_if_available
+    save_database_if_available(main_obj, '../data/structural_db_seed_'+str(seed))
         
 import argparse
 
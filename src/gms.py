@@ -16,144 +16,302 @@
 
 
 
+# process-wide ground motion library: gm_db.csv and gm_spectra.csv are parsed
+# once per process and held as arrays
+class GroundMotionLibrary:
+    
+    def __init__(self, db_dir='../resource/ground_motions/gm_db.csv',
+                 spec_dir='../resource/ground_motions/gm_spectra.csv'):
+        
+        import pandas as pd
+        import numpy as np
+        
+        gm_info = pd.read_csv(db_dir)
+        unscaled_spectra = pd.read_csv(spec_dir)
+        
+        # only concerned about H1 spectra
+        # spectra is a (n_periods x n_records) matrix, one column per RSN
+        H1s = unscaled_spectra.filter(regex=("-1 pSa \(g\)$"))
+        self.periods = unscaled_spectra['Period (sec)'].to_numpy(dtype=float)
+        self.spectra = H1s.to_numpy(dtype=float)
+        self.rsn = H1s.columns.str.extract('(\d+)')[0].astype(int).to_numpy()
+        self.rsn_col = {rsn: col for col, rsn in enumerate(self.rsn)}
+        
+        # record info, kept in the order of gm_db.csv
+        # col maps every record to its column in the spectra matrix
+        gm_info = gm_info[gm_info[' Record Sequence Number'].isin(self.rsn_col)]
+        self.record_rsn = gm_info[' Record Sequence Number'].to_numpy()
+        self.record_col = np.array([self.rsn_col[rsn] for rsn in self.record_rsn])
+        self.earthquake_name = gm_info[' Earthquake Name'].to_numpy()
+        self.lowest_frequency = gm_info[' Lowest Useable Frequency (Hz)'].to_numpy(
+            dtype=float)
+        self.filename = gm_info[' Horizontal-1 Acc. Filename'].str.strip().to_numpy()
+        self.rsn_filename = dict(zip(self.record_rsn, self.filename))
+        
+        # records grouped by earthquake event (group index per record)
+        self.event_code, self.event_names = pd.factorize(self.earthquake_name)
+        self.event_members = [np.flatnonzero(self.event_code == event)
+                              for event in range(len(self.event_names))]
+        
+        # log spectra of each record, used for geometric means
+        self.log_spectra = np.log(self.spectra)
+        self.spectra_max = self.spectra.max(axis=0)
+    
+    def get_spectrum(self, rsn):
+        return self.spectra[:, self.rsn_col[int(rsn)]]
+    
+    # interpolated unscaled Sa of a record at T_query
+    def get_Sa(self, rsn, T_query):
+        from numpy import interp
+        return interp(T_query, self.periods, self.get_spectrum(rsn))
+
+_gm_libraries = {}
+
+def get_gm_library(db_dir='../resource/ground_motions/gm_db.csv',
+                   spec_dir='../resource/ground_motions/gm_spectra.csv'):
+    import os
+    
+    lib_key = (os.path.abspath(db_dir), os.path.abspath(spec_dir))
+    if lib_key not in _gm_libraries:
+        _gm_libraries[lib_key] = GroundMotionLibrary(db_dir, spec_dir)
+    return _gm_libraries[lib_key]
+
+# Binary record archive: every PEER .AT2 record in gm_dir is packed once into
+#   records.bin        flat float64 accelerations (g), all records back to back
+#   records_index.csv  gm_name, offset, npts, dt
+# Records are then memory-mapped and sliced without any text parsing.
+# Nothing is written to gm_dir after packing, so concurrent runs are safe.
+def pack_records(gm_dir='../resource/ground_motions/PEERNGARecords_Unscaled/',
+                 archive_name='records'):
+    import os
+    import numpy as np
+    import pandas as pd
+    from ReadRecord import ReadRecordValues
+    
+    gm_files = sorted(f for f in os.listdir(gm_dir) if f.endswith('.AT2'))
+    
+    index_rows = []
+    offset = 0
+    
+    # write to temporary names so a half-packed archive is never picked up
+    bin_tmp = gm_dir+archive_name+'.bin.tmp'
+    with open(bin_tmp, 'wb') as bin_file:
+        for gm_file in gm_files:
+            dt, npts, values = ReadRecordValues(gm_dir+gm_file)
+            values.astype('<f8').tofile(bin_file)
+            index_rows.append([gm_file.replace('.AT2', ''), offset,
+                               len(values), dt])
+            offset += len(values)
+    
+    index_df = pd.DataFrame(index_rows,
+                            columns=['gm_name', 'offset', 'npts', 'dt'])
+    index_df.to_csv(gm_dir+archive_name+'_index.csv.tmp', index=False)
+    
+    os.replace(bin_tmp, gm_dir+archive_name+'.bin')
+    os.replace(gm_dir+archive_name+'_index.csv.tmp',
+               gm_dir+archive_name+'_index.csv')
+    
+    print('Packed %d records (%d points) into %s' %
+          (len(index_df), offset, gm_dir+archive_name+'.bin'))
+    return(index_df)
+
+class RecordArchive:
+    
+    def __init__(self, gm_dir='../resource/ground_motions/PEERNGARecords_Unscaled/',
+                 archive_name='records'):
+        
+        import pandas as pd
+        import numpy as np
+        
+        index_df = pd.read_csv(gm_dir+archive_name+'_index.csv')
+        self.offset = dict(zip(index_df['gm_name'], index_df['offset']))
+        self.npts = dict(zip(index_df['gm_name'], index_df['npts']))
+        self.dt = dict(zip(index_df['gm_name'], index_df['dt']))
+        
+        # read-only map, pages are shared between processes by the OS
+        self.data = np.memmap(gm_dir+archive_name+'.bin', dtype='<f8', mode='r')
+    
+    def __contains__(self, gm_name):
+        return gm_name in self.offset
+    
+    # returns dt and a read-only view of the unscaled record (g)
+    def get_record(self, gm_name):
+        start = self.offset[gm_name]
+        return self.dt[gm_name], self.data[start:start+self.npts[gm_name]]
+
+_record_archives = {}
+
+# archive for gm_dir, or None if the records have not been packed
+def get_record_archive(gm_dir='../resource/ground_motions/PEERNGARecords_Unscaled/',
+                       archive_name='records'):
+    import os
+    
+    archive_key = os.path.abspath(gm_dir+archive_name)
+    if archive_key not in _record_archives:
+        if not (os.path.isfile(gm_dir+archive_name+'.bin') and 
+                os.path.isfile(gm_dir+archive_name+'_index.csv')):
+            return None
+        _record_archives[archive_key] = RecordArchive(gm_dir, archive_name)
+    return _record_archives[archive_key]
+
+# dt and unscaled accelerations (g) of a record, from the archive if packed,
+# otherwise parsed from the .AT2 file directly (no .g3 is written)
+def load_record(gm_name,
+                gm_dir='../resource/ground_motions/PEERNGARecords_Unscaled/'):
+    
+    archive = get_record_archive(gm_dir)
+    if (archive is not None) and (gm_name in archive):
+        return archive.get_record(gm_name)
+    
+    from ReadRecord import ReadRecordValues
+    dt, npts, values = ReadRecordValues(gm_dir+gm_name+'.AT2')
+    return dt, values
+
 def scale_ground_motion(input_df, return_list=False,
                         db_dir='../resource/ground_motions/gm_db.csv',
                         spec_dir='../resource/ground_motions/gm_spectra.csv'):
     
+    gm_names, sfs, target_averages = scale_ground_motions(
+        [input_df['S_1']], [input_df['T_m']], [input_df['T_fbe']],
+        return_list=return_list, db_dir=db_dir, spec_dir=spec_dir)
+    
+    return(gm_names[0], sfs[0], target_averages[0])
+
+# Batch scaling of ground motions for N designs. Target spectra, geometric-mean
+# scale factors and the lowest usable frequency filter are computed for all
+# designs and all records at once; only the random pick per event is looped.
+# Random draws are made in the same sequence as N calls of the single-design
+# version, so selections do not change.
+
+# enforce_90: also scale up records whose scaled spectrum drops below 90% of
+# the target in the period range. This check was never applied to selections
+# before, so it is off by default.
+def scale_ground_motions(S_1, T_m, T_fbe, return_list=False,
+                         db_dir='../resource/ground_motions/gm_db.csv',
+                         spec_dir='../resource/ground_motions/gm_spectra.csv',
+                         enforce_90=False):
+    
     import pandas as pd
     import numpy as np
+    from random import randrange
     
-    S_1 = input_df['S_1']
-    T_m = input_df['T_m']
-    
-    # default='warn', ignore SettingWithCopyWarning
-    pd.options.mode.chained_assignment = None  
+    S_1 = np.asarray(S_1, dtype=float)
+    T_m = np.asarray(T_m, dtype=float)
+    T_fb = np.asarray(T_fbe, dtype=float)
+    n_designs = len(S_1)
     
-    gm_info = pd.read_csv(db_dir)
-    unscaled_spectra = pd.read_csv(spec_dir)
+    gm_lib = get_gm_library(db_dir, spec_dir)
+    periods = gm_lib.periods
     
     # info from building class
     S_s = 2.2815
     
     # Scale both Ss and S1
-    # Create design spectrum
-    
+    # Create design spectrum, (N x n_periods)
     T_short = S_1/S_s
-    target_spectrum  = unscaled_spectra[['Period (sec)']]
-    target_spectrum['Target pSa (g)'] = np.where(
-        target_spectrum['Period (sec)'] < T_short, 
-        S_s, S_1/target_spectrum['Period (sec)'])
+    target_spectrum = np.where(periods[None,:] < T_short[:,None], 
+                               S_s, S_1[:,None]/periods[None,:])
     
     # calculate desired target spectrum average (0.2*Tm, 1.5*Tm)
-    T_fb = input_df['T_fbe']
-    t_lower = min(T_fb, 0.2*T_m)
+    t_lower = np.minimum(T_fb, 0.2*T_m)
     t_upper = 1.5*T_m
-
-    # geometric mean from Eads et al. (2015)
-    target_range = target_spectrum[
-        target_spectrum['Period (sec)'].between(t_lower,t_upper)]['Target pSa (g)']
-    target_average = target_range.prod()**(1/target_range.size)
+    in_range = ((periods[None,:] >= t_lower[:,None]) & 
+                (periods[None,:] <= t_upper[:,None]))
+    n_range = in_range.sum(axis=1)
+    
+    # geometric mean from Eads et al. (2015), taken in log space
+    log_target_sum = np.where(in_range, np.log(target_spectrum), 0.0).sum(axis=1)
+    target_average = np.exp(log_target_sum/n_range)
+    
+    # same average for the unscaled GM spectra, (N x n_records)
+    us_average = np.exp((in_range @ gm_lib.log_spectra)/n_range[:,None])
     
-    # get the spectrum average for the unscaled GM spectra
-    # only concerned about H1 spectra
-    H1s = unscaled_spectra.filter(regex=("-1 pSa \(g\)$"))
-    us_range = H1s[target_spectrum['Period (sec)'].between(t_lower, t_upper)]
-    us_max = H1s.max(axis=0)
-    us_average = us_range.prod()**(1/len(us_range.index))
-
     # determine scale factor to get unscaled to target
-    scale_factor = target_average/us_average
-    scale_factor = scale_factor.reset_index()
-    scale_factor.columns = ['full_RSN', 'sf_average_spectral']
-    scale_factor['us_max'] = us_max.values
-    scale_factor['scaled_max'] = scale_factor['us_max']*scale_factor['sf_average_spectral']
-    
-    # rename back to old convention and merge with previous dataframe
-    scale_factor[' Record Sequence Number'] = scale_factor['full_RSN'].str.extract('(\d+)')
-    scale_factor = scale_factor.astype({' Record Sequence Number': int})
-    gm_info = pd.merge(gm_info,
-        scale_factor, 
-        on=' Record Sequence Number').drop(columns=['full_RSN'])
-    
-    # section on scaling to match 90% range
-    # get scaled values and check that all Sa at least 90% of target in range
-    
-    # multiply unscaled by sf
-    scaled_range = us_range.mul(scale_factor.set_index(['full_RSN']).iloc[:,0], 
-                                axis='columns')
-    # divide sf by target and get smallest value
-    scale_factor['smallest_target_proportion'] = scaled_range.div(
-        target_range, axis=0).min().values
-    # find scaling needed to reach 90%
-    import numpy as np
-    scale_factor['addl_90_sf'] = np.maximum(1.0, 
-                                     0.9/scale_factor['smallest_target_proportion'])
-    
-    # scale the sf by addl scaling
-    scale_factor['sf_average_spectral'] = scale_factor[
-        'sf_average_spectral']*scale_factor['addl_90_sf']
-    
-    # grab only relevant columns
-    db_cols = [' Record Sequence Number',
-               'sf_average_spectral',
-               'scaled_max',
-               ' Earthquake Name',
-               ' Lowest Useable Frequency (Hz)',
-               ' Horizontal-1 Acc. Filename']
-    gm_concise = gm_info[db_cols]
-
+    sf_col = target_average[:,None]/us_average
+    
+    if enforce_90:
+        # smallest proportion of target reached in the range, per record
+        # chunked over designs to bound the (N x n_periods x n_records) array
+        smallest = np.empty_like(sf_col)
+        chunk = 256
+        for i in range(0, n_designs, chunk):
+            ratio = (gm_lib.spectra[None,:,:]/
+                     target_spectrum[i:i+chunk,:,None])
+            ratio = np.where(in_range[i:i+chunk,:,None], ratio, np.inf)
+            smallest[i:i+chunk] = ratio.min(axis=1)*sf_col[i:i+chunk]
+        sf_col = sf_col*np.maximum(1.0, 0.9/smallest)
+    
+    # per record (gm_db order)
+    sf_average_spectral = sf_col[:, gm_lib.record_col]
+    scaled_max = gm_lib.spectra_max[gm_lib.record_col][None,:]*sf_average_spectral
+    
     # Filter by lowest usable frequency
-    T_max = t_upper
-    freq_min = 1/T_max
-    gm_concise = gm_concise[gm_concise[' Lowest Useable Frequency (Hz)'] < freq_min]
-
-    # List unique earthquakes
-    uniq_EQs = pd.unique(gm_concise[' Earthquake Name'])
-    final_GM = None
-
-    import numpy as np
+    freq_min = 1/t_upper
+    usable = gm_lib.lowest_frequency[None,:] < freq_min[:,None]
+    
+    # order in which events appear among the usable records of each design
+    n_records = len(gm_lib.record_col)
+    members_sorted = np.concatenate(gm_lib.event_members)
+    group_starts = np.cumsum([0]+[len(m) for m in gm_lib.event_members[:-1]])
+    first_usable = np.where(usable[:, members_sorted], members_sorted[None,:],
+                            n_records)
+    first_usable = np.minimum.reduceat(first_usable, group_starts, axis=1)
     
-    # if running IDA mode, keep a numpy seed to ensure same validation
-    if return_list:
-        np.random.seed(985)
+    gm_names = []
+    sfs = []
     
-    # Select earthquakes that are least severely scaled
-    # This section ensures no more than 3 motions per event
-    for earthquake in uniq_EQs:
-        match_eqs = gm_concise[gm_concise[' Earthquake Name'] == earthquake]
-        match_eqs['scale_difference'] = abs(match_eqs['sf_average_spectral']-1.0)
+    for i in range(n_designs):
         
-        # take 3 random ones (shuffle then take)
-        match_eqs = match_eqs.reindex(np.random.permutation(match_eqs.index))
-        random_set = match_eqs.head(3)
+        # if running IDA mode, keep a numpy seed to ensure same validation
+        if return_list:
+            np.random.seed(985)
         
-        if final_GM is None:
-            final_GM = pd.DataFrame(random_set)
+        event_order = np.argsort(first_usable[i], kind='stable')
+        event_order = event_order[first_usable[i, event_order] < n_records]
         
-        final_GM = pd.concat([random_set,final_GM], sort=False)
-        final_GM[' Horizontal-1 Acc. Filename'] = final_GM[
-            ' Horizontal-1 Acc. Filename'].str.strip()
-
-    final_GM = final_GM.reset_index()
-    final_GM = final_GM.drop(columns=['index', 'scale_difference'])
-    final_GM.columns = ['RSN', 'sf_average_spectral', 'scaled_peak_Sa',
-                        'earthquake_name', 'lowest_frequency', 'filename']
-    
-    # filter excessively scaled GMs
-    final_GM = final_GM[final_GM['sf_average_spectral'] < 20.0]
-    final_GM = final_GM[final_GM['scaled_peak_Sa'] < 3*S_s]
-    if return_list:
-        gm_name = final_GM.apply(lambda sheet: sheet.filename.replace('.AT2', ''), axis=1)
-        sf = final_GM['sf_average_spectral']
-        return(gm_name, sf, target_average)
-    else:
-        # select random GM from the list
-        from random import randrange
-        ind = randrange(len(final_GM.index))
-        filename = str(final_GM['filename'].iloc[ind]) # ground motion name
-        gm_name = filename.replace('.AT2', '') # remove extension from file name
-        sf = float(final_GM['sf_average_spectral'].iloc[ind])  # scale factor used
-        return(gm_name, sf, target_average)
+        # Select earthquakes that are least severely scaled
+        # This section ensures no more than 3 motions per event
+        # (new events are stacked on top; the first event is listed twice, as
+        # in the original selection)
+        final_GM = []
+        for event in event_order:
+            match_eqs = gm_lib.event_members[event]
+            match_eqs = match_eqs[usable[i, match_eqs]]
+            
+            # take 3 random ones (shuffle then take)
+            random_set = match_eqs[np.random.permutation(len(match_eqs))][:3]
+            
+            if len(final_GM) == 0:
+                final_GM = [random_set]
+            final_GM.insert(0, random_set)
+        final_GM = np.concatenate(final_GM)
+        
+        # filter excessively scaled GMs
+        keep = ((sf_average_spectral[i, final_GM] < 20.0) &
+                (scaled_max[i, final_GM] < 3*S_s))
+        final_GM_idx = np.flatnonzero(keep)
+        final_GM = final_GM[keep]
+        
+        gm_name = np.array([filename.replace('.AT2', '') 
+                            for filename in gm_lib.filename[final_GM]],
+                           dtype=object)
+        gm_sf = sf_average_spectral[i, final_GM]
+        
+        if return_list:
+            gm_names.append(pd.Series(gm_name, index=final_GM_idx))
+            sfs.append(pd.Series(gm_sf, index=final_GM_idx,
+                                 name='sf_average_spectral'))
+        else:
+            # select random GM from the list
+            ind = randrange(len(final_GM))
+            gm_names.append(gm_name[ind])
+            sfs.append(float(gm_sf[ind]))
+    
+    if not return_list:
+        gm_names = np.array(gm_names, dtype=object)
+        sfs = np.array(sfs)
+    
+    return(gm_names, sfs, target_average)
 
 def show_selection(final_GM, target_spectrum, H1s):
 
@@ -206,8 +364,104 @@ def show_selection(final_GM, target_spectrum, H1s):
     plt.legend(fontsize=subt_font, loc='center right')
     fig.tight_layout()
 
-# this creates a damped spectrum based on real zeta e value and extracts value
-def get_gm_ST(input_df, T_query):
+# damping grid of the precomputed spectra
+damped_zetas = [0.02, 0.03, 0.05, 0.075, 0.10, 0.125, 0.15, 0.20, 0.25, 0.30, 0.35]
+
+# Precompute unscaled pseudo-acceleration spectra of every record in the
+# library at the PEER periods, for each damping ratio in zetas. Stored as one
+# .npz with Sa (n_records x n_periods x n_zeta), the record names, periods and
+# damping ratios.
+# The FFT spectrum is inaccurate for periods of a few record steps (about 15%
+# at Tn = 5*dt, 4% at 10*dt, under 1% from 20*dt), so periods below
+# short_period_steps*dt are computed with the time-domain recurrence instead.
+def build_damped_spectra(out_path='../resource/ground_motions/gm_spectra_damped.npz',
+                         gm_dir='../resource/ground_motions/PEERNGARecords_Unscaled/',
+                         db_dir='../resource/ground_motions/gm_db.csv',
+                         spec_dir='../resource/ground_motions/gm_spectra.csv',
+                         zetas=damped_zetas, short_period_steps=20):
+    
+    import numpy as np
+    import time
+    
+    gm_lib = get_gm_library(db_dir, spec_dir)
+    periods = gm_lib.periods
+    zetas = np.asarray(zetas, dtype=float)
+    gm_names = [filename.replace('.AT2', '') for filename in gm_lib.filename]
+    
+    Sa = np.empty((len(gm_names), len(periods), len(zetas)))
+    
+    t0 = time.time()
+    for i, gm_name in enumerate(gm_names):
+        dt, uddg = load_record(gm_name, gm_dir)
+        short = periods < short_period_steps*dt
+        Sa[i,~short], D = response_spectrum(uddg, dt, periods[~short], zetas)
+        if short.any():
+            Sa[i,short], D = response_spectrum(uddg, dt, periods[short], zetas,
+                                               method='time')
+    
+    np.savez(out_path, Sa=Sa, gm_names=np.array(gm_names), periods=periods,
+             zetas=zetas)
+    
+    print('Damped spectra for %d records computed in %.2f s' %
+          (len(gm_names), time.time() - t0))
+    
+class DampedSpectra:
+    
+    def __init__(self, spectra_path='../resource/ground_motions/gm_spectra_damped.npz'):
+        
+        import numpy as np
+        
+        with np.load(spectra_path) as spectra_file:
+            self.Sa = spectra_file['Sa']
+            self.periods = spectra_file['periods']
+            self.zetas = spectra_file['zetas']
+            gm_names = spectra_file['gm_names']
+        self.gm_idx = {str(gm_name): i for i, gm_name in enumerate(gm_names)}
+    
+    def __contains__(self, gm_name):
+        return gm_name in self.gm_idx
+    
+    # unscaled Sa of a record at T_query, linear in period and in damping
+    # (damping outside the grid is clamped to its ends)
+    def get_Sa(self, gm_name, T_query, zeta):
+        
+        import numpy as np
+        
+        spectra = self.Sa[self.gm_idx[gm_name]]
+        
+        zeta = np.clip(zeta, self.zetas[0], self.zetas[-1])
+        j = np.clip(np.searchsorted(self.zetas, zeta) - 1, 0, len(self.zetas)-2)
+        w = (zeta - self.zetas[j])/(self.zetas[j+1] - self.zetas[j])
+        
+        spectrum = (1-w)*spectra[:,j] + w*spectra[:,j+1]
+        return np.interp(T_query, self.periods, spectrum)
+
+_damped_spectra = {}
+
+# damped spectra at spectra_path, or None if they have not been built
+def get_damped_spectra(spectra_path='../resource/ground_motions/gm_spectra_damped.npz'):
+    import os
+    
+    spectra_key = os.path.abspath(spectra_path)
+    if spectra_key not in _damped_spectra:
+        if not os.path.isfile(spectra_path):
+            return None
+        _damped_spectra[spectra_key] = DampedSpectra(spectra_path)
+    return _damped_spectra[spectra_key]
+
+# this extracts Sa value from the spectrum damped at the real zeta_e value
+# looked up in the precomputed damped spectra, or computed from the record if
+# those are not available
+def get_gm_ST(input_df, T_query,
+              spectra_path='../resource/ground_motions/gm_spectra_damped.npz'):
+    
+    damped_spectra = get_damped_spectra(spectra_path)
+    gm_name = input_df['gm_selected']
+    if (damped_spectra is not None) and (gm_name in damped_spectra):
+        Sa_query_unscaled = damped_spectra.get_Sa(gm_name, T_query, 
+                                                  input_df['zeta_e'])
+        return(input_df['scale_factor']*Sa_query_unscaled)
+    
     Tn, gm_A, gm_D, uddg = generate_spectrum(input_df)
     from numpy import interp
     Sa_query = interp(T_query, Tn, gm_A)
@@ -219,31 +473,26 @@ def get_ST(input_df, T_query,
            spec_dir='../resource/ground_motions/gm_spectra.csv'):
 
     import re
-    import pandas as pd
-    import numpy as np
 
-    # load in sections of the sheet
-    unscaled_spectra = pd.read_csv(spec_dir)
+    gm_lib = get_gm_library(db_dir, spec_dir)
     
     GM_file = input_df['gm_selected']
     scale_factor = input_df['scale_factor']
 
     rsn = re.search('(\d+)', GM_file).group(1)
-    gm_unscaled_name = 'RSN-' + str(rsn) + ' Horizontal-1 pSa (g)'
-    gm_spectrum = unscaled_spectra[['Period (sec)', gm_unscaled_name]]
-    gm_spectrum.columns  = ['Period', 'Sa']
 
-    Sa_query_unscaled  = np.interp(T_query, gm_spectrum.Period, gm_spectrum.Sa)
+    Sa_query_unscaled = gm_lib.get_Sa(rsn, T_query)
     Sa_query = scale_factor*Sa_query_unscaled
     return(Sa_query)
 
 def plot_spectrum(input_df,
+                  db_dir='../resource/ground_motions/gm_db.csv',
                   spec_dir='../resource/ground_motions/gm_spectra.csv'):
     
     import pandas as pd
 
     # load in sections of the sheet
-    unscaled_spectra = pd.read_csv(spec_dir)
+    gm_lib = get_gm_library(db_dir, spec_dir)
     
     GM_name = input_df['gm_selected']
 
@@ -256,14 +505,11 @@ def plot_spectrum(input_df,
     # info from building class
     S_s = 2.2815
     
-    # default='warn', ignore SettingWithCopyWarning
-    pd.options.mode.chained_assignment = None  
-    
     # Scale both Ss and S1
     # Create design spectrum
     
     T_short = S_1/S_s
-    target_spectrum  = unscaled_spectra[['Period (sec)']]
+    target_spectrum  = pd.DataFrame({'Period (sec)': gm_lib.periods})
     target_spectrum['Target_Sa'] = np.where(
         target_spectrum['Period (sec)'] < T_short, 
         S_s, S_1/target_spectrum['Period (sec)'])
@@ -338,33 +584,116 @@ def generate_spectrum(input_df,
     gm_name = input_df['gm_selected']
     scale_factor = input_df['scale_factor']
     
-    # call procedure to convert the ground-motion file
-    from ReadRecord import ReadRecord
-    dt, nPts = ReadRecord(gm_path+gm_name+'.AT2', gm_path+gm_name+'.g3')
+    # unscaled record, from the packed archive if available
+    dt, unscaled_uddg = load_record(gm_name, gm_path)
    
     import pandas as pd
-    import numpy as np
     
-    # read g3 file and catch uneven columns
-    df_uddg = pd.read_csv(gm_path+gm_name+'.g3', 
-                          header=None, delim_whitespace=True)
-    array_uddg = df_uddg.values.flatten()
-    
-    # scaled here, drop NaNs
-    uddg = array_uddg[~np.isnan(array_uddg)]*scale_factor
+    # scaled here (copy, the archive is read-only)
+    uddg = unscaled_uddg*scale_factor
     
     # Tn vector to match PEER
     spec_df = pd.read_csv(spec_dir+'period_range.csv',
                            names=['Tn'], header=None)
     zeta = input_df['zeta_e']
     
-    # calculate damped frequency using frequency domain
-    spec_df[['A', 'D']] = spec_df.apply(lambda row: 
-                                        spectrum_frequency_domain(row, zeta, uddg, dt),
-                                        axis='columns', result_type='expand')
+    # calculate damped spectrum using frequency domain, all periods at once
+    A, D = response_spectrum(uddg, dt, spec_df['Tn'].to_numpy(), [zeta])
+    spec_df['A'] = A[:,0]
+    spec_df['D'] = D[:,0]
     
     return spec_df['Tn'], spec_df['A'], spec_df['D'], uddg
 
+# Response spectrum of record uddg (g) for every combination of periods Tn and
+# damping ratios zetas. Returns pseudo-acceleration A (g) and displacement D
+# (in), each (n_periods x n_zeta).
+#   method='frequency': FFT of the (zero-padded) record once, then the SDOF
+#       transfer functions of all (Tn, zeta) pairs as a 2-D array, inverted in
+#       chunks of chunk_size rows to bound memory
+#   method='time': piecewise-exact (Nigam-Jennings) recurrence, all pairs
+#       stepped together; slower, use for checking
+def response_spectrum(uddg, dt, Tn, zetas, method='frequency', chunk_size=64):
+    
+    import numpy as np
+    
+    g = 386.4
+    Tn = np.atleast_1d(np.asarray(Tn, dtype=float))
+    zetas = np.atleast_1d(np.asarray(zetas, dtype=float))
+    
+    # flattened (Tn, zeta) pairs, period-major
+    omega_n = np.repeat(2*np.pi/Tn, len(zetas))
+    zeta = np.tile(zetas, len(Tn))
+    
+    p = -np.asarray(uddg, dtype=float)*g
+    
+    if method == 'frequency':
+        from scipy.fft import rfft, irfft
+        
+        # pad ground motion to make it cyclical, with enough trailing zeros
+        # for the free vibration of the longest/least damped SDOF to decay to
+        # 5% before wrapping around
+        t_decay = np.log(20)/(max(zeta.min(), 0.01)*omega_n.min())
+        nw = next_power_of_2(len(p) + int(np.ceil(t_decay/dt)))
+        Pw = rfft(p, n=nw)
+        omega = 2*np.pi*np.arange(len(Pw))/(dt*nw)
+        
+        D = np.empty(len(omega_n))
+        for i in range(0, len(omega_n), chunk_size):
+            wn = omega_n[i:i+chunk_size,None]
+            z = zeta[i:i+chunk_size,None]
+            
+            # transfer function (unit mass)
+            H = 1/(wn**2 - omega[None,:]**2 + 2*z*1j*wn*omega[None,:])
+            ut = irfft(H*Pw[None,:], n=nw, axis=1)
+            D[i:i+chunk_size] = np.abs(ut).max(axis=1)
+            
+    elif method == 'time':
+        D = spectrum_nigam_jennings(p, dt, omega_n, zeta)
+    else:
+        raise ValueError('Unknown spectrum method: %s' % method)
+        
+    A = D*omega_n**2/g
+    
+    return(A.reshape(len(Tn), len(zetas)), D.reshape(len(Tn), len(zetas)))
+
+# peak displacement of unit-mass SDOFs (arrays omega_n, zeta) under force p,
+# exact for a piecewise linear p (Chopra, Sec. 5.2)
+def spectrum_nigam_jennings(p, dt, omega_n, zeta):
+    
+    import numpy as np
+    
+    wn = np.asarray(omega_n, dtype=float)
+    z = np.asarray(zeta, dtype=float)
+    k = wn**2
+    
+    sq = np.sqrt(1 - z**2)
+    wd = wn*sq
+    e = np.exp(-z*wn*dt)
+    s = np.sin(wd*dt)
+    c = np.cos(wd*dt)
+    
+    A = e*(z/sq*s + c)
+    B = e*(s/wd)
+    C = 1/k*(2*z/(wn*dt) + e*(((1 - 2*z**2)/(wd*dt) - z/sq)*s - 
+                              (1 + 2*z/(wn*dt))*c))
+    D = 1/k*(1 - 2*z/(wn*dt) + e*((2*z**2 - 1)/(wd*dt)*s + 2*z/(wn*dt)*c))
+    
+    A_v = -e*(wn/sq*s)
+    B_v = e*(c - z/sq*s)
+    C_v = 1/k*(-1/dt + e*((wn/sq + z/(dt*sq))*s + c/dt))
+    D_v = 1/(k*dt)*(1 - e*(z/sq*s + c))
+    
+    u = np.zeros(len(wn))
+    v = np.zeros(len(wn))
+    u_max = np.zeros(len(wn))
+    
+    for i in range(len(p)-1):
+        u, v = (A*u + B*v + C*p[i] + D*p[i+1],
+                A_v*u + B_v*v + C_v*p[i] + D_v*p[i+1])
+        np.maximum(u_max, np.abs(u), out=u_max)
+        
+    return(u_max)
+
 
 # make function to parallellize spectrum
 # uddg is in g
@@ -0,0 +1,183 @@
+############################################################################
+#               Run ledger
+
+# Date created: October 2026
+
+# Description:  Persistent store of finished NLTH runs. Every run_nlth result
+#               is committed as soon as it finishes, keyed on the design, the
+#               ground motion and its scale factor. Reruns skip keys that are
+#               already in the ledger, so a killed job resumes where it
+#               stopped instead of from row zero.
+
+# Open issues:  (1) SQLite locking is unreliable on some network file
+#               systems, and WAL needs all its users on one host; keep one
+#               ledger per job/task on HPC scratch (journal_mode='DELETE')
+#               and combine them with merge_ledgers
+
+############################################################################
+
+# columns that describe the ground motion or the bookkeeping of a run, rather
+# than the design itself
+gm_cols = ['index', 'gm_selected', 'scale_factor', 'sa_avg', 'ida_level']
+
+# columns that a finished run adds to its design (experiment.prepare_results,
+# Database.calculate_collapse); a result table keyed without them identifies
+# the run, whatever its outcome
+result_cols = ['sa_tm', 'sa_1', 'sa_tfb', 'constructed_moat', 'T_1', 'T_fb',
+               'T_ratio', 'gap_ratio', 'max_isol_disp', 'PID', 'PFV', 'PFA',
+               'RID', 'impacted', 'run_status', 
+               'max_drift', 'collapse_prob', 'log_collapse_prob']
+
+def _canonical(value):
+    import numpy as np
+
+    if isinstance(value, dict):
+        return '{'+','.join(str(k)+':'+_canonical(value[k])
+                            for k in sorted(value))+'}'
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return '['+','.join(_canonical(v) for v in np.asarray(value).tolist())+']'
+    if isinstance(value, (float, np.floating)):
+        return repr(float(value))
+    if isinstance(value, (int, np.integer)):
+        return repr(int(value))
+    return repr(value)
+
+# hash of everything that defines the building (loads, bearings, members)
+def design_hash(design):
+    import hashlib
+
+    design_keys = sorted(k for k in design.index if k not in gm_cols)
+    design_str = ';'.join(k+'='+_canonical(design[k]) for k in design_keys)
+    return hashlib.sha1(design_str.encode()).hexdigest()
+
+def run_key(design):
+    return (design_hash(design)+'|'+str(design['gm_selected'])+'|'+
+            '%.8f' % float(design['scale_factor']))
+
+class RunLedger:
+
+    # journal_mode: 'WAL' for a ledger shared by the processes of one node,
+    # 'DELETE' (rollback journal) for a ledger on a network file system
+    def __init__(self, path, timeout=60.0, journal_mode='WAL'):
+        import sqlite3
+        import os
+
+        ledger_dir = os.path.dirname(path)
+        if ledger_dir != '':
+            os.makedirs(ledger_dir, exist_ok=True)
+
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout)
+
+        # either journal: a commit survives the process being killed
+        self.conn.execute('PRAGMA journal_mode='+journal_mode)
+        if journal_mode.upper() == 'WAL':
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        else:
+            self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS runs (
+                                run_key TEXT PRIMARY KEY,
+                                design_hash TEXT,
+                                gm_selected TEXT,
+                                scale_factor REAL,
+                                run_status INTEGER,
+                                wall_time REAL,
+                                finished REAL,
+                                result BLOB)''')
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def __contains__(self, design):
+        row = self.conn.execute('SELECT 1 FROM runs WHERE run_key = ?',
+                                (run_key(design),)).fetchone()
+        return row is not None
+
+    def completed_keys(self):
+        return set(key for (key,) in
+                   self.conn.execute('SELECT run_key FROM runs'))
+
+    def commit(self, design, result, wall_time=None):
+        import pickle
+        import time
+
+        if 'run_status' in result.index:
+            run_status = int(result['run_status'])
+        else:
+            run_status = None
+
+        self.conn.execute('INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,?,?)',
+                          (run_key(design), design_hash(design),
+                           str(design['gm_selected']),
+                           float(design['scale_factor']),
+                           run_status, wall_time, time.time(),
+                           pickle.dumps(result)))
+        self.conn.commit()
+
+    def get(self, design):
+        import pickle
+
+        row = self.conn.execute('SELECT result FROM runs WHERE run_key = ?',
+                                (run_key(design),)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    # all stored results as a DataFrame, in order of completion
+    def results(self):
+        import pickle
+        import pandas as pd
+
+        rows = self.conn.execute('SELECT result FROM runs ORDER BY finished')
+        all_results = [pickle.loads(blob) for (blob,) in rows]
+        if len(all_results) == 0:
+            return None
+        return pd.DataFrame(all_results)
+
+    # run bookkeeping without the pickled results (e.g. for wall times)
+    def run_log(self):
+        import pandas as pd
+        return pd.read_sql_query('''SELECT run_key, design_hash, gm_selected,
+                                    scale_factor, run_status, wall_time, finished
+                                    FROM runs''', self.conn)
+
+    def close(self):
+        self.conn.close()
+
+# designs (with their results) and wall times of the runs in a ledger, to fit
+# runner.RuntimePredictor. opened read-only, so the journal mode of a ledger
+# in use is left alone
+def ledger_timings(ledger_path):
+    import sqlite3
+    import pickle
+    import pandas as pd
+
+    conn = sqlite3.connect('file:'+ledger_path+'?mode=ro', uri=True)
+    rows = conn.execute('''SELECT run_key, result, wall_time FROM runs
+                           WHERE wall_time IS NOT NULL''').fetchall()
+    conn.close()
+
+    designs = []
+    wall_times = []
+    for key, blob, wall_time in rows:
+        design = pickle.loads(blob)
+        design['run_key'] = key
+        designs.append(design)
+        wall_times.append(wall_time)
+    return(pd.DataFrame(designs), wall_times)
+
+# combine the ledgers of separate tasks (e.g. one per IDA row) into one.
+# a run found in several ledgers keeps its latest result
+def merge_ledgers(ledger_paths, merged_path):
+    merged = RunLedger(merged_path, journal_mode='DELETE')
+    for ledger_path in ledger_paths:
+        merged.conn.execute('ATTACH DATABASE ? AS part', (ledger_path,))
+        merged.conn.execute('''INSERT OR REPLACE INTO runs SELECT * FROM part.runs
+                               WHERE run_key NOT IN (SELECT run_key FROM runs
+                                                     WHERE finished >= part.runs.finished)''')
+        merged.conn.commit()
+        merged.conn.execute('DETACH DATABASE part')
+    n_runs = len(merged)
+    merged.close()
+    return(n_runs)
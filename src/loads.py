@@ -222,4 +222,281 @@ def define_lateral_forces(input_df, D_load=None, L_load=None):
 
     Fx      = Cvx*Vs
     
-    return(wx, hx, h_col, hsx, Fx, Vs, T_fb)
\ No newline at end of file
+    return(wx, hx, h_col, hsx, Fx, Vs, T_fb)
+############################################################################
+#              Batch loads for whole design tables
+
+# the functions below do the same calculations as define_gravity_loads,
+# estimate_period and define_lateral_forces for all rows of a table at once.
+# per-level quantities are 2-D arrays (designs x levels), padded with nan past
+# each design's number of levels. gravity arrays hold num_stories+1 levels
+# (ground included); lateral arrays hold num_stories levels
+############################################################################
+
+load_case_names = ['1.4D', '1.2D+1.6L', '1.2D+0.5L+1.0E', '0.9D-1.0E', 
+                   '1.0D+0.5L']
+
+# True where level j exists for design i
+def level_mask(n_levels):
+    import numpy as np
+    n_levels = np.asarray(n_levels, dtype=int)
+    return(np.arange(n_levels.max())[None,:] < n_levels[:,None])
+
+# sum over the existing levels of each design. rows are summed in groups of
+# equal length so the result is bit-identical to np.sum of the unpadded rows
+def level_sum(x, mask):
+    import numpy as np
+    n_levels = mask.sum(axis=1)
+    total = np.zeros(x.shape[0])
+    for n in np.unique(n_levels):
+        rows = n_levels == n
+        total[rows] = np.sum(x[rows,:n], axis=1)
+    return(total)
+
+# element-by-element power with the scalar pow, as used by the row-by-row
+# functions (the vectorized np.power can differ from it in the last bit)
+def scalar_pow(base, exponent):
+    import math
+    import numpy as np
+    base, exponent = np.broadcast_arrays(base, exponent)
+    power = [math.pow(b, e) for b, e in zip(base.ravel(), exponent.ravel())]
+    return(np.array(power).reshape(base.shape))
+
+# default floor loads (kip/ft^2), roof (last existing level) lighter
+def default_floor_loads(mask, floor_load, roof_load):
+    import numpy as np
+    n_levels = mask.sum(axis=1)
+    loads = np.where(mask, floor_load, 0.0)
+    loads[np.arange(len(n_levels)), n_levels-1] = roof_load
+    return(loads)
+
+def gravity_loads_batch(config_df):
+    import numpy as np
+    
+    n_floors = config_df['num_stories'].to_numpy(dtype=int)
+    L_bay = config_df['L_bay'].to_numpy(dtype=float)[:,None]
+    n_bays = config_df['num_bays'].to_numpy(dtype=float)[:,None]
+    S_s = config_df['S_s'].to_numpy(dtype=float)[:,None]
+    n_frames = config_df['num_frames'].to_numpy(dtype=float)[:,None]
+    
+    mask = level_mask(n_floors+1)
+    D_load = default_floor_loads(mask, 100.0/1000, 75.0/1000)
+    L_load = default_floor_loads(mask, 50.0/1000, 20.0/1000)
+    
+    # assuming square building
+    A_bldg = scalar_pow(L_bay*n_bays, 2) # ft^2
+    
+    # seismic weight: ASCE 7-22, Ch. 12.7.2 (kips)
+    W_seis = level_sum(D_load*A_bldg, mask)
+    W_super = level_sum(D_load[:,1:]*A_bldg, mask[:,1:])
+    
+    # assume lateral frames are placed on the edge
+    trib_width_lat = L_bay/2
+    
+    # leaning columns
+    L_bldg = n_bays*L_bay
+    trib_width_LC = (L_bldg/n_frames) - trib_width_lat 
+    trib_area_LC = trib_width_LC * L_bldg
+    
+    def load_cases(D, L):
+        Ev = 0.2*S_s*D
+        cases = [1.4*D,
+                 1.2*D + 1.6*L,
+                 1.2*D + Ev + 0.5*L,
+                 0.9*D - Ev,
+                 1.0*D + 0.5*L]
+        cases = [np.where(mask, case, np.nan) for case in cases]
+        return(dict(zip(load_case_names, cases)))
+    
+    w_cases = load_cases(D_load*trib_width_lat, L_load*trib_width_lat)
+    P_cases = load_cases(D_load*trib_area_LC, L_load*trib_area_LC)
+    
+    w_on_frame = np.maximum.reduce([w_cases[case] for case in load_case_names[:4]])
+    P_on_leaning_column = np.maximum.reduce([P_cases[case] 
+                                             for case in load_case_names[:4]])
+    
+    return({'W': W_seis, 'W_s': W_super, 'w_fl': w_on_frame, 
+            'P_lc': P_on_leaning_column, 'w_cases': w_cases, 'P_cases': P_cases,
+            'mask': mask})
+
+def estimate_period_batch(input_df, use_Cu=True, unit_in_ft=True):
+    import numpy as np
+    
+    struct_type = input_df['superstructure_system']
+    h_n = input_df['h_bldg'].to_numpy(dtype=float)
+    if not unit_in_ft:
+        h_n = h_n/12
+    Ct = struct_type.map(get_Ct).to_numpy(dtype=float)
+    x_Tfb = struct_type.map(get_x_Tfb).to_numpy(dtype=float)
+    T_a = Ct*scalar_pow(h_n, x_Tfb)
+    
+    # C_u = 1.4 for both MF and CBF, see estimate_period
+    if use_Cu:
+        C_u = 1.4
+    else:
+        C_u = 1.0
+    return(C_u*T_a)
+
+def lateral_forces_batch(input_df):
+    import numpy as np
+    
+    D_m = input_df['D_m'].to_numpy(dtype=float)
+    K_e = input_df['k_e'].to_numpy(dtype=float)
+    zeta_e = input_df['zeta_e'].to_numpy(dtype=float)
+    R_y = input_df['RI'].to_numpy(dtype=float)
+    struct_type = input_df['superstructure_system']
+    n_floors = input_df['num_stories'].to_numpy(dtype=int)
+    n_bays = input_df['num_bays'].to_numpy(dtype=float)
+    n_frames = input_df['num_frames'].to_numpy(dtype=float)
+    L_bay = input_df['L_bay'].to_numpy(dtype=float)
+    h_story = input_df['h_story'].to_numpy(dtype=float)
+    W_tot = input_df['W'].to_numpy(dtype=float)
+    W_s = input_df['W_s'].to_numpy(dtype=float)
+    
+    mask = level_mask(n_floors)
+    D_load = default_floor_loads(mask, 100.0/1000, 75.0/1000)
+    
+    # assuming square building
+    A_bldg = scalar_pow(L_bay*n_bays, 2)
+    
+    ft = 12.0
+    n_rows = np.arange(len(n_floors))
+    
+    wx = D_load*A_bldg[:,None]                                  # Floor seismic weights
+    hsx = np.where(mask, (h_story*ft)[:,None], 0.0)             # Column heights
+    hx = np.arange(1, mask.shape[1]+1)[None,:] * hsx            # Floor elevations
+    h_col = hsx.copy()                                          # Column moment arm heights
+    h_col[n_rows, n_floors-1] = h_story/2*ft
+    
+    # unnormalize stiffness
+    K = K_e * W_tot
+    Vb = (D_m * K)/n_frames
+    Vst = (Vb*scalar_pow(W_s/W_tot, 1 - 2.5*zeta_e))
+    Vs = (Vst/R_y)
+    
+    # approximate fixed based fundamental period
+    Ct = struct_type.map(get_Ct).to_numpy(dtype=float)
+    x_Tfb = struct_type.map(get_x_Tfb).to_numpy(dtype=float)
+    h_n = level_sum(hsx, mask)/12.0
+    T_a = Ct*scalar_pow(h_n, x_Tfb)
+    T_fb = 1.4*T_a
+    
+    k       = 14*zeta_e*T_fb
+    
+    # grouped by number of levels, to match the 1-D power of define_lateral_forces
+    hxk     = np.zeros_like(hx)
+    n_levels = mask.sum(axis=1)
+    for n in np.unique(n_levels):
+        rows = n_levels == n
+        hxk[rows,:n] = hx[rows,:n]**k[rows,None]
+    
+    CvNum   = wx*hxk
+    CvDen   = level_sum(CvNum, mask)
+    
+    Cvx     = CvNum/CvDen[:,None]
+    
+    Fx      = Cvx*Vs[:,None]
+    
+    def pad(x):
+        return(np.where(mask, x, np.nan))
+    
+    return({'wx': pad(wx), 'hx': pad(hx), 'h_col': pad(h_col), 
+            'hsx': pad(hsx), 'Fx': pad(Fx), 'Vs': Vs, 'T_fbe': T_fb,
+            'mask': mask})
+
+############################################################################
+#              Per-level columns
+
+# in the design tables, a per-level quantity is stored as one float column per
+# level (name_0, name_1, ...), nan past the levels of each design, i.e. the
+# padded 2-D arrays above. the load cases of all_w_cases and all_Plc_cases are
+# stored the same way, as w_<case> and Plc_<case>. the story mask follows from
+# num_stories (num_stories+1 gravity levels, num_stories lateral levels).
+# level_values and load_case_values rebuild the arrays and case dicts of one
+# design where they are needed. all design paths fill their tables with
+# assign_gravity_loads and assign_lateral_forces; older tables that hold the
+# arrays and dicts of define_gravity_loads and define_lateral_forces are still
+# read the same
+############################################################################
+
+load_case_prefix = {'all_w_cases': 'w_', 'all_Plc_cases': 'Plc_'}
+gravity_level_names = ['w_fl', 'P_lc']
+lateral_level_names = ['wx', 'hx', 'h_col', 'hsx', 'Fx']
+
+def level_columns(name, n_levels):
+    return([name+'_'+str(level) for level in range(n_levels)])
+
+# columns name_0, name_1, ... present in columns
+def _present_level_columns(columns, name):
+    level_cols = []
+    while name+'_'+str(len(level_cols)) in columns:
+        level_cols.append(name+'_'+str(len(level_cols)))
+    return(level_cols)
+
+# table df with the padded arrays of levels ({name: designs x levels}) as the
+# columns of each name, replacing any old ones. the new columns are built as
+# one block and joined once; adding them one by one fragments a wide table
+def with_level_columns(df, levels):
+    import numpy as np
+    import pandas as pd
+    
+    old_cols = []
+    for name in levels:
+        old_cols += _present_level_columns(df.columns, name)
+        if name in df.columns:
+            old_cols.append(name)
+    
+    new_cols = []
+    for name, x in levels.items():
+        new_cols += level_columns(name, x.shape[1])
+    level_df = pd.DataFrame(np.hstack(list(levels.values())), 
+                            index=df.index, columns=new_cols)
+    return(pd.concat([df.drop(columns=old_cols), level_df], axis=1))
+
+# padded array (designs x levels) of name for a whole table
+def padded_levels(df, name):
+    import numpy as np
+    if name in df.columns:
+        rows = [np.asarray(row, dtype=float) for row in df[name]]
+        x = np.full((len(rows), max(len(row) for row in rows)), np.nan)
+        for i, row in enumerate(rows):
+            x[i,:len(row)] = row
+        return(x)
+    return(df[_present_level_columns(df.columns, name)].to_numpy(dtype=float))
+
+# per-level array of name for one design (row of a table)
+def level_values(row, name):
+    import numpy as np
+    if name in row.index:
+        return(row[name])
+    # scalar lookups, much faster than a list selection on an object row
+    values = np.array([row[col] for col in 
+                       _present_level_columns(row.index, name)], dtype=float)
+    return(values[~np.isnan(values)])
+
+# load case dict (all_w_cases or all_Plc_cases) of one design
+def load_case_values(row, cases_name):
+    if cases_name in row.index:
+        return(row[cases_name])
+    prefix = load_case_prefix[cases_name]
+    return({case: level_values(row, prefix+case) for case in load_case_names})
+
+# table df with the loads of define_gravity_loads as per-level columns
+def assign_gravity_loads(df):
+    loads = gravity_loads_batch(df)
+    
+    levels = {'w_fl': loads['w_fl'], 'P_lc': loads['P_lc']}
+    for case in load_case_names:
+        levels['w_'+case] = loads['w_cases'][case]
+        levels['Plc_'+case] = loads['P_cases'][case]
+    
+    df = df.drop(columns=[col for col in load_case_prefix if col in df.columns])
+    df = df.assign(W=loads['W'], W_s=loads['W_s'])
+    return(with_level_columns(df, levels))
+
+# table df with the forces of define_lateral_forces as per-level columns
+def assign_lateral_forces(df):
+    forces = lateral_forces_batch(df)
+    df = with_level_columns(df, {name: forces[name] 
+                                 for name in lateral_level_names})
+    return(df.assign(Vs=forces['Vs'], T_fbe=forces['T_fbe']))
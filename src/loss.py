@@ -19,6 +19,14 @@ collections.Callable = collections.abc.Callable
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+# NQE sheets after unit conversion, per (nqe_dir, sheet name), and the
+# non-structural marginals built from them, per (sheet, L_bldg, usage). these
+# are the same for every building that shares the inputs, so they are built
+# once per process
+_nqe_cache = {}
+_nsc_cache = collections.OrderedDict()
+nsc_cache_size = 512
+
 class Loss_Analysis:
         
     # import attributes as building characteristics from pd.Series
@@ -44,6 +52,14 @@ class Loss_Analysis:
         import numpy as np
         sheet_name = self.get_SDC()
         
+        self.nqe_key = (nqe_dir, sheet_name)
+        if self.nqe_key in _nqe_cache:
+            nqe_meta, nqe_mean, nqe_std = _nqe_cache[self.nqe_key]
+            self.meta_sheet = nqe_meta.copy()
+            self.mean_sheet = nqe_mean.copy()
+            self.std_sheet = nqe_std.copy()
+            return
+        
         nqe_data = pd.read_csv(nqe_dir + sheet_name)
         nqe_data.set_index('cmp', inplace=True)
         nqe_data = nqe_data.replace({'All Zero': 0}, regex=True)
@@ -145,9 +161,11 @@ class Loss_Analysis:
         mask = nqe_meta['PACT_name'].str.contains('Bookcase')
         nqe_meta.loc[mask, 'PACT_block'] = 'EA 10'
         
-        self.meta_sheet = nqe_meta
-        self.mean_sheet = nqe_mean
-        self.std_sheet = nqe_std
+        _nqe_cache[self.nqe_key] = (nqe_meta, nqe_mean, nqe_std)
+        
+        self.meta_sheet = nqe_meta.copy()
+        self.mean_sheet = nqe_mean.copy()
+        self.std_sheet = nqe_std.copy()
     
     # structural components
     def get_structural_cmp_MF(self, metadata):
@@ -390,54 +408,52 @@ class Loss_Analysis:
         return(fl_cmp_by_usage, fl_cmp_qty, fl_std)
 
     # function to remove (cmp, dir, loc) duplicates. assumes that only
-    # theta_0 and theta_1 changes
-    def remove_dupes(self, dupe_df):
+    # theta_0 and theta_1 changes. the first row of each component is kept, with
+    # the sum of Theta_0 and Blocks and the SRSS of Theta_1
+    def combine_cmp_rows(self, cmp_df, cmp_col):
         import pandas as pd
-        dupe_cmps = dupe_df.cmp.unique()
-        
-        clean_df = pd.DataFrame()
         import numpy as np
-        for cmp in dupe_cmps:
-            cmp_df = dupe_df[dupe_df.cmp == cmp]
-            sum_means = cmp_df.Theta_0.sum()
-            sum_blocks = cmp_df.Blocks.sum()
-            srss_std = np.sqrt(np.square(cmp_df.Theta_1).sum())
-            
-            new_row = cmp_df.iloc[[0]].copy()
-            new_row.Theta_0 = sum_means
-            new_row.Blocks = sum_blocks
-            new_row.Theta_1 = srss_std
-            
-            clean_df = pd.concat([clean_df, new_row], axis=0)
+        
+        if cmp_df.shape[0] == 0:
+            return(pd.DataFrame())
+        
+        # group codes in order of first appearance, same as the first rows.
+        # each group is summed with numpy like Series.sum (the compensated sum
+        # of groupby differs in the last bit)
+        codes = pd.factorize(cmp_df[cmp_col])[0]
+        order = np.argsort(codes, kind='stable')
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        
+        def group_sum(values):
+            return([np.nansum(group) for group in np.split(values[order], bounds)])
+        
+        clean_df = cmp_df[~cmp_df[cmp_col].duplicated()].copy()
+        clean_df['Theta_0'] = group_sum(cmp_df['Theta_0'].to_numpy())
+        # blocks may be over-rounded here
+        clean_df['Blocks'] = group_sum(cmp_df['Blocks'].to_numpy())
+        clean_df['Theta_1'] = np.sqrt(group_sum(
+            np.square(cmp_df['Theta_1'].to_numpy())))
         return(clean_df)
+    
+    def remove_dupes(self, dupe_df):
+        return(self.combine_cmp_rows(dupe_df, 'cmp'))
 
     def bldg_wide_cmp(self, roof_df):
         import pandas as pd
         
-        roof_cmps = roof_df.Component.unique()
-        clean_df = pd.DataFrame()
-        import numpy as np
-        for cmp in roof_cmps:
-            cmp_df = roof_df[roof_df.Component == cmp]
-            sum_means = cmp_df.Theta_0.sum()
-            sum_blocks = cmp_df.Blocks.sum()
-            srss_std = np.sqrt(np.square(cmp_df.Theta_1).sum())
-            
-            new_row = cmp_df.iloc[[0]].copy()
-            if (new_row['Comment'].str.contains('Elevator').any()):
-                new_row.Location = 1
-            else:
-                new_row.Location = 'roof'
-            new_row.Theta_0 = sum_means
-            
-            # blocks may be over-rounded here
-            new_row.Blocks = sum_blocks
-            new_row.Theta_1 = srss_std
-            
-            clean_df = pd.concat([clean_df, new_row], axis=0)
+        clean_df = self.combine_cmp_rows(roof_df, 'Component')
+        if clean_df.shape[0] == 0:
+            return(clean_df)
+        
+        is_elevator = clean_df['Comment'].str.contains('Elevator')
+        clean_df['Location'] = pd.Series(
+            [1 if elevator else 'roof' for elevator in is_elevator],
+            index=clean_df.index)
         return(clean_df)
     
-    def normative_quantity_estimation(self, usage, P58_metadata, brace_dir='../resource/'):
+    # non-structural components of all floors, with the replacement components.
+    # depends only on the NQE sheet, the floor area and the usage
+    def nsc_marginals(self, usage):
         floor_area = self.L_bldg**2 # sq ft
         import pandas as pd
         import numpy as np
@@ -458,8 +474,21 @@ class Loss_Analysis:
         pact_units = fema_units.replace({'SF': 'ft2',
                                          'LF': 'ft',
                                          'EA': 'ea'})
-        # perform floor estimation
+        # perform floor estimation. floors of the same usage differ only in
+        # their location, so each usage is estimated once
+        usage_cmp = {}
         for fl, fl_usage in enumerate(usage):
+            usage_key = tuple(fl_usage)
+            if usage_key in usage_cmp:
+                fl_cmp_df, combined_dupe_rows = [
+                    cmp_df.copy() for cmp_df in usage_cmp[usage_key]]
+                for cmp_df in [fl_cmp_df, combined_dupe_rows]:
+                    if 'Location' in cmp_df.columns:
+                        cmp_df['Location'] = fl+1
+                cmp_marginal = pd.concat([cmp_marginal, fl_cmp_df, combined_dupe_rows], 
+                                         axis=0, ignore_index=True)
+                continue
+            
             area_usage = np.array(fl_usage)*floor_area
             
             fl_cmp_by_cat, fl_cmp_total, fl_cmp_std = self.floor_qty_estimate(
@@ -468,7 +497,7 @@ class Loss_Analysis:
             fl_cmp_total.name = 'Theta_0'
             fl_cmp_std.name = 'Theta_1'
             
-            loc_series = pd.Series([fl+1]).repeat(
+            loc_series = pd.Series([fl+1], name='Location').repeat(
                 len(fl_cmp_total)).set_axis(fl_cmp_total.index)
             
             dir_map = {True:'1,2', False:'0'}
@@ -496,6 +525,7 @@ class Loss_Analysis:
                 'cmp', keep=False)].sort_values('cmp')
             combined_dupe_rows = self.remove_dupes(dupes)
             fl_cmp_df = fl_cmp_df[~fl_cmp_df['cmp'].isin(combined_dupe_rows['cmp'])]
+            usage_cmp[usage_key] = (fl_cmp_df, combined_dupe_rows)
             
             cmp_marginal = pd.concat([cmp_marginal, fl_cmp_df, combined_dupe_rows], 
                                      axis=0, ignore_index=True)
@@ -539,6 +569,32 @@ class Loss_Analysis:
         
         nsc_cmp = pd.concat([cmp_marginal, replace_df])
         
+        # dtype conversion
+        from numpy import ceil
+        nsc_cmp[['Theta_0']] = nsc_cmp[['Theta_0']].apply(pd.to_numeric)
+        nsc_cmp[['Theta_0']] = ceil(nsc_cmp[['Theta_0']])
+        nsc_cmp[['Blocks']] = nsc_cmp[['Blocks']].apply(pd.to_numeric)
+        return(nsc_cmp)
+    
+    def normative_quantity_estimation(self, usage, P58_metadata, brace_dir='../resource/'):
+        import pandas as pd
+        
+        # non-structural components, shared by all buildings with the same NQE
+        # sheet, floor area and usage
+        nqe_key = getattr(self, 'nqe_key', None)
+        if nqe_key is None:
+            nsc_cmp = self.nsc_marginals(usage)
+        else:
+            nsc_key = (nqe_key, float(self.L_bldg),
+                       tuple(tuple(float(x) for x in fl) for fl in usage))
+            if nsc_key in _nsc_cache:
+                _nsc_cache.move_to_end(nsc_key)
+            else:
+                _nsc_cache[nsc_key] = self.nsc_marginals(usage)
+                if len(_nsc_cache) > nsc_cache_size:
+                    _nsc_cache.popitem(last=False)
+            nsc_cmp = _nsc_cache[nsc_key].copy()
+        
         # structural components
         superstructure = self.superstructure_system
         if superstructure == 'MF':
@@ -552,11 +608,6 @@ class Loss_Analysis:
         
         structural_cmp['Theta_1'] = 0
         
-        from numpy import ceil
-        nsc_cmp[['Theta_0']] = nsc_cmp[['Theta_0']].apply(pd.to_numeric)
-        nsc_cmp[['Theta_0']] = ceil(nsc_cmp[['Theta_0']])
-        nsc_cmp[['Blocks']] = nsc_cmp[['Blocks']].apply(pd.to_numeric)
-        
         total_cmps = pd.concat([structural_cmp, nsc_cmp], ignore_index=True)
         self.components = total_cmps
         
@@ -636,6 +687,245 @@ class Loss_Analysis:
     
             self.edp = edp_df
     
+    # fragilities loaded in front of the P-58 damage table: the components that
+    # P-58 leaves incomplete, and the replacement triggers (excessiveRID,
+    # irreparable, collapse)
+    def additional_fragilities(self, P58_data, cmp_list, mode='generate',
+                               custom_fragility_db=None):
+        import pandas as pd
+        
+        superstructure_system = self.superstructure_system
+        
+        P58_data_for_this_assessment = P58_data.loc[cmp_list,:].sort_values('Incomplete', ascending=False)
+        
+        # load in some custom definitions for a couple of missing components
+        incomplete_db = P58_data_for_this_assessment.loc[
+            P58_data_for_this_assessment['Incomplete'] == 1].sort_index() 
+        inc_names = incomplete_db.index.tolist()
+        
+        if custom_fragility_db is None:
+            custom_fragility_db = pd.read_csv('../resource/loss/custom_component_fragilities.csv',
+                                              header=[0,1], index_col=0)
+            
+        custom_fragility_db = custom_fragility_db.rename(
+            columns=lambda x: '' if "Unnamed" in x else x, level=1)
+        
+        additional_fragility_db = pd.concat([custom_fragility_db, incomplete_db], axis=0)
+        
+        # if we have all components accounted for, drop the initial duplicate list
+        if set(inc_names).issubset(custom_fragility_db.index.tolist()):
+            additional_fragility_db = additional_fragility_db[additional_fragility_db['Incomplete'] != 1]
+            
+        mask = additional_fragility_db.index.isin(inc_names)
+        additional_fragility_db = additional_fragility_db[mask]
+        
+        
+        # add demand for the replacement criteria
+        # irreparable damage
+        # this is based on the default values in P58
+        additional_fragility_db.loc[
+            'excessiveRID', [('Demand','Directional'),
+                            ('Demand','Offset'),
+                            ('Demand','Type'), 
+                            ('Demand','Unit')]] = [1, 
+                                                    0, 
+                                                    'Residual Interstory Drift Ratio',
+                                                    'rad']
+        # reference for drifts in FEMA 356, Table C1-2, or FEMA P-58 Table C-1
+        if superstructure_system=='MF':
+            irreparable_drift = 0.01
+        else:
+            irreparable_drift = 0.005
+            
+        additional_fragility_db.loc[
+            'excessiveRID', [('LS1','Family'),
+                            ('LS1','Theta_0'),
+                            ('LS1','Theta_1')]] = ['lognormal', irreparable_drift, 0.3]   
+
+        additional_fragility_db.loc[
+            'irreparable', [('Demand','Directional'),
+                            ('Demand','Offset'),
+                            ('Demand','Type'), 
+                            ('Demand','Unit')]] = [1,
+                                                    0,
+                                                    'Peak Spectral Acceleration|Tm',
+                                                    'g']   
+
+
+        # a very high capacity is assigned to avoid damage from demands
+        # this will trigger on excessiveRID instead
+        additional_fragility_db.loc[
+            'irreparable', ('LS1','Theta_0')] = 1e10 
+
+        
+
+        # sa_judg = calculate_collapse_SaT1(run_data)
+
+        # capacity is assigned based on the example in the FEMA P58 background documentation
+        # additional_fragility_db.loc[
+        #     'collapse', [('Demand','Directional'),
+        #                     ('Demand','Offset'),
+        #                     ('Demand','Type'), 
+        #                     ('Demand','Unit')]] = [1, 0, 'Peak Spectral Acceleration|Tm', 'g']   
+
+        # # use judgment method, apply 0.6 variance (FEMA P58 ch. 6)
+        # additional_fragility_db.loc[
+        #     'collapse', [('LS1','Family'),
+        #                   ('LS1','Theta_0'),
+        #                   ('LS1','Theta_1')]] = ['lognormal', sa_judg, 0.6]  
+
+        # collapse capacity is assumed lognormal distributed with 10% interstory drift
+        # being the mean + 1 stdev percentile
+        # Mean provided by Lee and Foutch (2001) for SMRF
+        # Std from Yun and Hamburger (2002)
+        
+        # we can define a lognormal distribution that results in a PID of 10% having
+        # 84% collapse rate (10% is the mean+1std.dev)
+        # Yun and Hamburger has beta (logarithmic stdev) value of 0.3 for 
+        # 3-story global collapse drift, lowered by 0.05 if nonlin dynamic anly
+        from math import log, exp
+        from scipy.stats import norm
+        
+        if superstructure_system == 'MF':
+            # MF: set 84% collapse at 0.10 drift, 0.25 beta
+            drift_mu_plus_std = 0.1
+            inv_norm = norm.ppf(0.84)
+            n_stories = self.num_stories
+            if n_stories < 4:
+                beta_drift = 0.25
+            else:
+                beta_drift = 0.35
+            # 0.9945 is inverse normCDF of 0.84
+            mean_log_drift = exp(log(drift_mu_plus_std) - beta_drift*inv_norm) 
+        else:
+            # CBF: set 90% collapse at 0.05 drift, 0.55 beta
+            inv_norm = norm.ppf(0.90)
+            beta_drift = 0.55
+            mean_log_drift = exp(log(0.05) - beta_drift*inv_norm) 
+            
+        additional_fragility_db.loc[
+            'collapse', [('Demand','Directional'),
+                            ('Demand','Offset'),
+                            ('Demand','Type'), 
+                            ('Demand','Unit')]] = [1, 0, 'Peak Interstory Drift Ratio|all', 'rad']   
+
+        additional_fragility_db.loc[
+            'collapse', [('LS1','Family'),
+                          ('LS1','Theta_0'),
+                          ('LS1','Theta_1')]] = ['lognormal', mean_log_drift, beta_drift]
+
+        # We set the incomplete flag to 0 for the additional components
+        additional_fragility_db['Incomplete'] = 0
+        
+        # if maximizing, drop the three replacement damage states
+        if mode == 'maximize':
+            additional_fragility_db = additional_fragility_db.drop(
+                index=['collapse', 'excessiveRID', 'irreparable'])
+        
+        return(additional_fragility_db)
+    
+    # building replacement cost and time, unless given
+    def replacement_consequences(self, cmp_replacement_cost=None,
+                                 cmp_replacement_time=None):
+        # TODO: find replacement cost estimate
+        # use PACT
+        # assume $250/sf
+        # assume 40% of replacement cost is labor, $680/worker-day for SF Bay Area
+        
+        # assume $600/sf
+        bldg_area = self.L_bldg**2 * (self.num_stories + 1)
+        if cmp_replacement_cost is None:
+            replacement_cost = 600.0*bldg_area
+        else:
+            replacement_cost = cmp_replacement_cost
+        
+        # assume 2 years timeline
+        # assume 1 worker per 1000 sf, but can work in parallel of 2 floors
+        if cmp_replacement_time is None:
+            n_worker_series = bldg_area/1000
+            n_worker_parallel = n_worker_series/2
+            replacement_time = n_worker_parallel*365*2
+        else:
+            replacement_time = cmp_replacement_time
+        
+        return(replacement_cost, replacement_time)
+    
+    # consequences loaded in front of the P-58 repair table: the group E
+    # components that P-58 leaves incomplete, and building replacement
+    def additional_consequences(self, cmp_replacement_cost=None,
+                                cmp_replacement_time=None):
+        import pandas as pd
+        import numpy as np
+        
+        # group E (filing cabinets, bookcases)
+        incomplete_cmp = pd.DataFrame(
+            columns = pd.MultiIndex.from_tuples([('Incomplete',''), 
+                                                  ('Quantity','Unit'), 
+                                                  ('DV', 'Unit'), 
+                                                  ('DS1','Theta_0'),
+                                                  ('DS1','Theta_1'),
+                                                  ('DS1','Family'),]),
+            index=pd.MultiIndex.from_tuples([('E.20.22.102a','Cost'), 
+                                              ('E.20.22.102a','Time'),
+                                              ('E.20.22.112a','Cost'), 
+                                              ('E.20.22.112a','Time'),
+                                              ('E.20.22.114b','Cost'), 
+                                              ('E.20.22.114b','Time'),
+                                              ('E.20.22.106b','Cost'), 
+                                              ('E.20.22.106b','Time'),])
+        )
+        
+        # bookcases (unanchored vs anchored)
+        incomplete_cmp.loc[('E.20.22.102a', 'Cost')] = [0, '1 EA', 'USD_2011',
+                                                      '190.0,150.0|1,5', 0.35, 'lognormal']
+        incomplete_cmp.loc[('E.20.22.102a', 'Time')] = [0, '1 EA', 'worker_day',
+                                                      0.02, 0.5, 'lognormal']
+        
+        incomplete_cmp.loc[('E.20.22.106b', 'Cost')] = [0, '1 EA', 'USD_2011',
+                                                      '250.0,150.0|1,5', 0.35, 'lognormal']
+        incomplete_cmp.loc[('E.20.22.106b', 'Time')] = [0, '1 EA', 'worker_day',
+                                                      0.03, 0.5, 'lognormal']
+
+        # filing cabinets (unanchored vs anchored)
+        incomplete_cmp.loc[('E.20.22.112a', 'Cost')] = [0, '1 EA', 'USD_2011',
+                                                      '110.0,70.0|1,5', 0.35, 'lognormal']
+        incomplete_cmp.loc[('E.20.22.112a', 'Time')] = [0, '1 EA', 'worker_day',
+                                                      0.02, 0.5, 'lognormal']
+        
+        incomplete_cmp.loc[('E.20.22.114b', 'Cost')] = [0, '1 EA', 'USD_2011',
+                                                      '170.0,70.0|1,5', 0.35, 'lognormal']
+        incomplete_cmp.loc[('E.20.22.114b', 'Time')] = [0, '1 EA', 'worker_day',
+                                                      0.03, 0.5, 'lognormal']
+        
+        # initialize the dataframe
+        additional_consequences = pd.DataFrame(
+            columns = pd.MultiIndex.from_tuples([('Incomplete',''), 
+                                                  ('Quantity','Unit'), 
+                                                  ('DV', 'Unit'), 
+                                                  ('DS1', 'Theta_0'),
+                                                  ('DS1', 'Theta_1'),
+                                                  ('DS1', 'Family')]),
+            index=pd.MultiIndex.from_tuples([('replacement','Cost'), 
+                                              ('replacement','Time')])
+        )
+        
+        # add the data about replacement cost and time
+        replacement_cost, replacement_time = self.replacement_consequences(
+            cmp_replacement_cost, cmp_replacement_time)
+        additional_consequences.loc[('replacement', 'Cost')] = [0, '1 EA',
+                                                                'USD_2011',
+                                                                replacement_cost,
+                                                                0,
+                                                                np.nan]
+        additional_consequences.loc[('replacement', 'Time')] = [0, '1 EA',
+                                                                'worker_day',
+                                                                replacement_time,
+                                                                0,
+                                                                np.nan]
+        
+        return(additional_consequences, incomplete_cmp, 
+               replacement_cost, replacement_time)
+    
     def estimate_damage(self, mode='generate', custom_fragility_db=None,
                         cmp_replacement_cost=None, cmp_replacement_time=None):
         
@@ -678,6 +968,10 @@ class Loss_Analysis:
             "DemandOffset": {"PFA": 0, "PFV": 0}
         })
         
+        # pelicun 3.3 keeps the Seed option but does not reseed its generator
+        # with it; the seed setter does
+        PAL.options.seed = 985
+        
         ###########################################################################
         # DEMANDS
         ###########################################################################
@@ -780,14 +1074,12 @@ class Loss_Analysis:
         
         
         # review the damage model - in this example: fragility functions
-        P58_data = PAL.get_default_data('damage_DB_FEMA_P58_2nd')
+        P58_data = get_p58_data('damage_DB_FEMA_P58_2nd')
 
         # note that we drop the last three components here (excessiveRID, irreparable, and collapse) 
         # because they are not part of P58
         cmp_list = cmp_marginals.index.unique().values[:-3]
 
-        P58_data_for_this_assessment = P58_data.loc[cmp_list,:].sort_values('Incomplete', ascending=False)
-        
         # to make the convenience keywords work in the model, 
         # we need to specify the number of stories
         PAL.stories = len(PID_all)
@@ -801,134 +1093,13 @@ class Loss_Analysis:
         # get the component quantity sample - again, use the save function to convert units
         cmp_sample = PAL.asset.save_cmp_sample()
 
-        # load in some custom definitions for a couple of missing components
-        incomplete_db = P58_data_for_this_assessment.loc[
-            P58_data_for_this_assessment['Incomplete'] == 1].sort_index() 
-        inc_names = incomplete_db.index.tolist()
-        
-        if custom_fragility_db is None:
-            custom_fragility_db = pd.read_csv('../resource/loss/custom_component_fragilities.csv',
-                                              header=[0,1], index_col=0)
-            
-        custom_fragility_db = custom_fragility_db.rename(
-            columns=lambda x: '' if "Unnamed" in x else x, level=1)
-        
-        additional_fragility_db = pd.concat([custom_fragility_db, incomplete_db], axis=0)
-        
-        # if we have all components accounted for, drop the initial duplicate list
-        if set(inc_names).issubset(custom_fragility_db.index.tolist()):
-            additional_fragility_db = additional_fragility_db[additional_fragility_db['Incomplete'] != 1]
-            
-        mask = additional_fragility_db.index.isin(inc_names)
-        additional_fragility_db = additional_fragility_db[mask]
-        
-        
-        # add demand for the replacement criteria
-        # irreparable damage
-        # this is based on the default values in P58
-        additional_fragility_db.loc[
-            'excessiveRID', [('Demand','Directional'),
-                            ('Demand','Offset'),
-                            ('Demand','Type'), 
-                            ('Demand','Unit')]] = [1, 
-                                                    0, 
-                                                    'Residual Interstory Drift Ratio',
-                                                    'rad']
-        # reference for drifts in FEMA 356, Table C1-2, or FEMA P-58 Table C-1
-        if superstructure_system=='MF':
-            irreparable_drift = 0.01
-        else:
-            irreparable_drift = 0.005
-            
-        additional_fragility_db.loc[
-            'excessiveRID', [('LS1','Family'),
-                            ('LS1','Theta_0'),
-                            ('LS1','Theta_1')]] = ['lognormal', irreparable_drift, 0.3]   
-
-        additional_fragility_db.loc[
-            'irreparable', [('Demand','Directional'),
-                            ('Demand','Offset'),
-                            ('Demand','Type'), 
-                            ('Demand','Unit')]] = [1,
-                                                    0,
-                                                    'Peak Spectral Acceleration|Tm',
-                                                    'g']   
-
-
-        # a very high capacity is assigned to avoid damage from demands
-        # this will trigger on excessiveRID instead
-        additional_fragility_db.loc[
-            'irreparable', ('LS1','Theta_0')] = 1e10 
-
-        
-
-        # sa_judg = calculate_collapse_SaT1(run_data)
-
-        # capacity is assigned based on the example in the FEMA P58 background documentation
-        # additional_fragility_db.loc[
-        #     'collapse', [('Demand','Directional'),
-        #                     ('Demand','Offset'),
-        #                     ('Demand','Type'), 
-        #                     ('Demand','Unit')]] = [1, 0, 'Peak Spectral Acceleration|Tm', 'g']   
-
-        # # use judgment method, apply 0.6 variance (FEMA P58 ch. 6)
-        # additional_fragility_db.loc[
-        #     'collapse', [('LS1','Family'),
-        #                   ('LS1','Theta_0'),
-        #                   ('LS1','Theta_1')]] = ['lognormal', sa_judg, 0.6]  
-
-        # collapse capacity is assumed lognormal distributed with 10% interstory drift
-        # being the mean + 1 stdev percentile
-        # Mean provided by Lee and Foutch (2001) for SMRF
-        # Std from Yun and Hamburger (2002)
-        
-        # we can define a lognormal distribution that results in a PID of 10% having
-        # 84% collapse rate (10% is the mean+1std.dev)
-        # Yun and Hamburger has beta (logarithmic stdev) value of 0.3 for 
-        # 3-story global collapse drift, lowered by 0.05 if nonlin dynamic anly
-        from math import log, exp
-        from scipy.stats import norm
-        
-        if superstructure_system == 'MF':
-            # MF: set 84% collapse at 0.10 drift, 0.25 beta
-            drift_mu_plus_std = 0.1
-            inv_norm = norm.ppf(0.84)
-            n_stories = self.num_stories
-            if n_stories < 4:
-                beta_drift = 0.25
-            else:
-                beta_drift = 0.35
-            # 0.9945 is inverse normCDF of 0.84
-            mean_log_drift = exp(log(drift_mu_plus_std) - beta_drift*inv_norm) 
-        else:
-            # CBF: set 90% collapse at 0.05 drift, 0.55 beta
-            inv_norm = norm.ppf(0.90)
-            beta_drift = 0.55
-            mean_log_drift = exp(log(0.05) - beta_drift*inv_norm) 
-            
-        additional_fragility_db.loc[
-            'collapse', [('Demand','Directional'),
-                            ('Demand','Offset'),
-                            ('Demand','Type'), 
-                            ('Demand','Unit')]] = [1, 0, 'Peak Interstory Drift Ratio|all', 'rad']   
-
-        additional_fragility_db.loc[
-            'collapse', [('LS1','Family'),
-                          ('LS1','Theta_0'),
-                          ('LS1','Theta_1')]] = ['lognormal', mean_log_drift, beta_drift]
-
-        # We set the incomplete flag to 0 for the additional components
-        additional_fragility_db['Incomplete'] = 0
-        
-        # if maximizing, drop the three replacement damage states
-        if mode == 'maximize':
-            additional_fragility_db = additional_fragility_db.drop(
-                index=['collapse', 'excessiveRID', 'irreparable'])
+        additional_fragility_db = self.additional_fragilities(
+            P58_data, cmp_list, mode=mode, custom_fragility_db=custom_fragility_db)
         
         # load fragility data
         PAL.damage.load_damage_model([
             additional_fragility_db,  # This is the extra fragility data we've just created
-            'PelicunDefault/damage_DB_FEMA_P58_2nd.csv' # and this is a table with the default P58 data    
+            P58_data # and this is a table with the default P58 data    
         ])
         
         ### 3.3.5 Damage Process
@@ -994,48 +1165,8 @@ class Loss_Analysis:
         loss_map = pd.DataFrame(loss_models, columns=['Repair'], index=drivers)
         
         # load the consequence models
-        P58_data = PAL.get_default_data('loss_repair_DB_FEMA_P58_2nd')
-
-        # group E (filing cabinets, bookcases)
-        incomplete_cmp = pd.DataFrame(
-            columns = pd.MultiIndex.from_tuples([('Incomplete',''), 
-                                                  ('Quantity','Unit'), 
-                                                  ('DV', 'Unit'), 
-                                                  ('DS1','Theta_0'),
-                                                  ('DS1','Theta_1'),
-                                                  ('DS1','Family'),]),
-            index=pd.MultiIndex.from_tuples([('E.20.22.102a','Cost'), 
-                                              ('E.20.22.102a','Time'),
-                                              ('E.20.22.112a','Cost'), 
-                                              ('E.20.22.112a','Time'),
-                                              ('E.20.22.114b','Cost'), 
-                                              ('E.20.22.114b','Time'),
-                                              ('E.20.22.106b','Cost'), 
-                                              ('E.20.22.106b','Time'),])
-        )
-        
-        # bookcases (unanchored vs anchored)
-        incomplete_cmp.loc[('E.20.22.102a', 'Cost')] = [0, '1 EA', 'USD_2011',
-                                                      '190.0,150.0|1,5', 0.35, 'lognormal']
-        incomplete_cmp.loc[('E.20.22.102a', 'Time')] = [0, '1 EA', 'worker_day',
-                                                      0.02, 0.5, 'lognormal']
-        
-        incomplete_cmp.loc[('E.20.22.106b', 'Cost')] = [0, '1 EA', 'USD_2011',
-                                                      '250.0,150.0|1,5', 0.35, 'lognormal']
-        incomplete_cmp.loc[('E.20.22.106b', 'Time')] = [0, '1 EA', 'worker_day',
-                                                      0.03, 0.5, 'lognormal']
+        P58_data = get_p58_data('loss_repair_DB_FEMA_P58_2nd')
 
-        # filing cabinets (unanchored vs anchored)
-        incomplete_cmp.loc[('E.20.22.112a', 'Cost')] = [0, '1 EA', 'USD_2011',
-                                                      '110.0,70.0|1,5', 0.35, 'lognormal']
-        incomplete_cmp.loc[('E.20.22.112a', 'Time')] = [0, '1 EA', 'worker_day',
-                                                      0.02, 0.5, 'lognormal']
-        
-        incomplete_cmp.loc[('E.20.22.114b', 'Cost')] = [0, '1 EA', 'USD_2011',
-                                                      '170.0,70.0|1,5', 0.35, 'lognormal']
-        incomplete_cmp.loc[('E.20.22.114b', 'Time')] = [0, '1 EA', 'worker_day',
-                                                      0.03, 0.5, 'lognormal']
-        
         # if maximizing, drop the three replacement damage states
         if mode == 'maximize':
             loss_map = loss_map.drop(
@@ -1050,57 +1181,14 @@ class Loss_Analysis:
         # this should be taken care of from incomplete_cmp
         P58_missing = set(loss_map['Repair'].values[:-2]) - set(P58_available)
 
-        # initialize the dataframe
-        additional_consequences = pd.DataFrame(
-            columns = pd.MultiIndex.from_tuples([('Incomplete',''), 
-                                                  ('Quantity','Unit'), 
-                                                  ('DV', 'Unit'), 
-                                                  ('DS1', 'Theta_0'),
-                                                  ('DS1', 'Theta_1'),
-                                                  ('DS1', 'Family')]),
-            index=pd.MultiIndex.from_tuples([('replacement','Cost'), 
-                                              ('replacement','Time')])
-        )
-        
-        # add the data about replacement cost and time
-
-        # TODO: find replacement cost estimate
-        # use PACT
-        # assume $250/sf
-        # assume 40% of replacement cost is labor, $680/worker-day for SF Bay Area
-        
-        # assume $600/sf
-        if cmp_replacement_cost is None:
-            bldg_area = self.L_bldg**2 * (self.num_stories + 1)
-            replacement_cost = 600.0*bldg_area
-        else:
-            replacement_cost = cmp_replacement_cost
-        
-        # assume 2 years timeline
-        # assume 1 worker per 1000 sf, but can work in parallel of 2 floors
-        if cmp_replacement_time is None:
-            n_worker_series = bldg_area/1000
-            n_worker_parallel = n_worker_series/2
-            replacement_time = n_worker_parallel*365*2
-        else:
-            replacement_time = cmp_replacement_time
-        additional_consequences.loc[('replacement', 'Cost')] = [0, '1 EA',
-                                                                'USD_2011',
-                                                                replacement_cost,
-                                                                0,
-                                                                np.nan]
-        additional_consequences.loc[('replacement', 'Time')] = [0, '1 EA',
-                                                                'worker_day',
-                                                                replacement_time,
-                                                                0,
-                                                                np.nan]
+        additional_consequences, incomplete_cmp, replacement_cost, replacement_time = \
+            self.additional_consequences(cmp_replacement_cost, cmp_replacement_time)
         
         
     
         # Load the loss model to pelicun
         PAL.repair.load_model(
-            [additional_consequences, incomplete_cmp,
-              "PelicunDefault/loss_repair_DB_FEMA_P58_2nd.csv"], 
+            [additional_consequences, incomplete_cmp, P58_data], 
             loss_map, decision_variables=['Cost', 'Time'])
         
         # and run the calculations
@@ -1130,6 +1218,9 @@ class Loss_Analysis:
             loss_groups['E'] = loss_by_cmp[[
                 col for col in loss_by_cmp.columns if col.startswith('E')]].sum(axis=1)
             
+            # per-realization group losses, kept for the batched engine
+            self.loss_group_sample = loss_groups
+            
             # this returns NaN if collapse/irreparable is 100%
             loss_groups = loss_groups.describe()
             
@@ -1174,6 +1265,9 @@ class Loss_Analysis:
         collapse_freq = replacement_instances['collapse'].sum(axis=0)/n_sample
         irreparable_freq = replacement_instances['irreparable'].sum(axis=0)/n_sample
         
+        # per-realization group losses, kept for the batched engine
+        self.loss_group_sample = loss_groups
+        
         # this returns NaN if collapse/irreparable is 100%
         loss_groups = loss_groups.describe()
         
@@ -1183,6 +1277,937 @@ class Loss_Analysis:
         return(cmp_sample, damage_sample, loss_sample, loss_groups, agg_DF,
                 collapse_freq, irreparable_freq)
     
+    # fragility and consequence parameters of this building's components, for
+    # estimate_loss_analytic. components are merged as Pelicun does: the first
+    # definition of a component wins, and incomplete ones are dropped
+    # frag_params: component -> demand and limit states (family, theta_0,
+    # theta_1, DS weights)
+    # loss_params: (component, 'Cost'/'Time') -> quantity unit and, per DS,
+    # None or (constant median or (medians, quantities), family, theta_0, theta_1)
+    def analytic_params(self, mode='generate', custom_fragility_db=None):
+        import numpy as np
+        import pandas as pd
+        from pelicun.base import EDP_to_demand_type
+        
+        cmp_names = self.components['Component'].unique()
+        cmp_list = cmp_names[:-3]
+        
+        P58_data = get_p58_data('damage_DB_FEMA_P58_2nd')
+        additional_fragility_db = self.additional_fragilities(
+            P58_data, cmp_list, mode=mode, custom_fragility_db=custom_fragility_db)
+        frag_db = pd.concat([additional_fragility_db,
+                             P58_data.loc[P58_data.index.isin(cmp_names)]], axis=0)
+        frag_db = frag_db.groupby(frag_db.index).first()
+        frag_db = frag_db.loc[frag_db[('Incomplete', '')] != 1]
+        
+        frag_params = {}
+        for cmp, frg in frag_db.to_dict('index').items():
+            demand_type = frg[('Demand', 'Type')]
+            if '|' in demand_type:
+                demand_type, subtype = demand_type.split('|')
+                edp_type = EDP_to_demand_type.get(demand_type, demand_type)+'_'+subtype
+            else:
+                edp_type = EDP_to_demand_type.get(demand_type, demand_type)
+            
+            limit_states = []
+            for ls in sorted(set(col[0] for col in frg if col[0].startswith('LS'))):
+                theta_0 = frg.get((ls, 'Theta_0'), np.nan)
+                if pd.isna(theta_0):
+                    continue
+                family = frg.get((ls, 'Family'), np.nan)
+                if not (pd.isna(family) or family == 'lognormal'):
+                    raise ValueError('Fragility family %s of %s is not supported '
+                                     'by the analytic loss engine' % (family, cmp))
+                ds_weights = frg.get((ls, 'DamageStateWeights'), np.nan)
+                if pd.isna(ds_weights):
+                    ds_weights = np.ones(1)
+                else:
+                    ds_weights = np.array(
+                        ds_weights.replace(' ', '').split('|'), dtype=float)
+                limit_states.append((family, float(theta_0), 
+                                     frg.get((ls, 'Theta_1'), np.nan), ds_weights))
+            
+            frag_params[cmp] = {'edp_type': edp_type,
+                                'offset': int(frg[('Demand', 'Offset')]),
+                                'directional': bool(frg[('Demand', 'Directional')]),
+                                'unit': frg[('Demand', 'Unit')],
+                                'limit_states': limit_states}
+        
+        # replacement is handled by estimate_loss_analytic itself
+        additional_consequences, incomplete_cmp, _, _ = self.additional_consequences()
+        P58_data = get_p58_data('loss_repair_DB_FEMA_P58_2nd')
+        loss_db = pd.concat([incomplete_cmp, 
+                             P58_data.loc[P58_data.index.get_level_values(0).isin(
+                                 cmp_list)]], axis=0)
+        loss_db = loss_db.groupby(level=[0, 1]).first()
+        loss_db = loss_db.loc[loss_db[('Incomplete', '')] != 1]
+        
+        loss_params = {}
+        for (cmp, dv), conseq in loss_db.to_dict('index').items():
+            if dv not in ['Cost', 'Time']:
+                continue
+            ds_params = []
+            n_ds = max([int(col[0][2:]) for col in conseq if col[0].startswith('DS')])
+            for ds in range(1, n_ds+1):
+                theta_0 = conseq.get(('DS%d' % ds, 'Theta_0'), np.nan)
+                if pd.isna(theta_0):
+                    ds_params.append(None)
+                    continue
+                family = conseq.get(('DS%d' % ds, 'Family'), np.nan)
+                theta_1 = conseq.get(('DS%d' % ds, 'Theta_1'), np.nan)
+                if not (pd.isna(family) or family in ['lognormal', 'normal']):
+                    raise ValueError('Consequence family %s of %s is not supported '
+                                     'by the analytic loss engine' % (family, cmp))
+                
+                # the median is either the constant (deterministic) or carried by
+                # the deviation; multilinear medians give deviations around 1
+                try:
+                    theta_0 = float(theta_0)
+                    if pd.isna(family):
+                        median = theta_0
+                    else:
+                        median = 1.0
+                except ValueError:
+                    median = tuple(np.array(vals.split(','), dtype=float)
+                                   for vals in theta_0.split('|'))
+                    theta_0 = 1.0
+                ds_params.append((median, family, theta_0, theta_1))
+            
+            loss_params[(cmp, dv)] = {'unit': conseq[('Quantity', 'Unit')],
+                                      'ds': ds_params}
+        
+        return(frag_params, loss_params)
+    
+    # Analytic fast path of estimate_damage, for the deterministic demands of
+    # 'generate' and 'maximize'. With fixed EDPs, the damage state probabilities
+    # of a performance group follow in closed form from the fragility CDFs (the
+    # limit states of a block are perfectly correlated), so no capacities are
+    # sampled: the damage states of the blocks are drawn as multinomial counts,
+    # and only RID, component quantities and repair consequences are sampled.
+    # The damage process, economies of scale and replacement are the same as in
+    # the Pelicun assessment. Returns the same tail as estimate_damage, but with
+    # the per-realization group losses instead of their describe()
+    # param_cache: dict to keep the parsed parameters and the performance group
+    # arrays between buildings
+    def estimate_loss_analytic(self, mode='generate', custom_fragility_db=None,
+                               cmp_replacement_cost=None, cmp_replacement_time=None,
+                               n_sample=1000, seed=985, param_cache=None):
+        import numpy as np
+        import pandas as pd
+        from scipy.special import ndtr, ndtri
+        
+        if mode not in ['generate', 'maximize']:
+            raise ValueError('The analytic loss engine needs deterministic '
+                             'demands (generate or maximize), not '+str(mode))
+        
+        rng = np.random.default_rng(seed)
+        n_stories = len(self.PID)
+        
+        # Pelicun default for non-directional components
+        nondir_multi = 1.2
+        
+        ###########################################################################
+        # DEMANDS
+        ###########################################################################
+        
+        # same EDPs and units as process_EDP/estimate_damage
+        PID = np.array(self.PID, dtype=float)
+        PFA = np.array(self.PFA, dtype=float)
+        PFV = np.array(self.PFV, dtype=float)
+        sa_tm = self.sa_tm
+        if mode == 'maximize':
+            PID = np.full(len(PID), 1e2)
+            PFA = np.full(len(PFA), 1e4)
+            PFV = np.full(len(PFV), 1e6)
+            sa_tm = 1e4
+        
+        demand_units = {'PFA': 'g', 'PFV': 'inps', 'PID': 'rad', 'RID': 'rad',
+                        'SA_Tm': 'g', 'PID_all': 'rad'}
+        demands = {}
+        for edp_type, edp_values in [('PFA', PFA), ('PFV', PFV), ('PID', PID)]:
+            for fl, edp in enumerate(edp_values):
+                demands[(edp_type, str(fl+1), '1')] = edp
+                demands[(edp_type, str(fl+1), '2')] = edp
+        demands[('SA_Tm', '0', '1')] = sa_tm
+        demands[('PID_all', '0', '1')] = PID.max()
+        
+        # residual drift from PID (FEMA P-58), with the lognormal noise of
+        # estimate_RID: one realization per sample
+        if self.superstructure_system == 'MF':
+            delta_y = 0.0075
+        else:
+            delta_y = 0.005
+        RID = np.where(PID < delta_y, 0.0,
+                       np.where(PID < 4*delta_y, 0.3*(PID - delta_y),
+                                PID - 3*delta_y))
+        eps = rng.normal(scale=0.2, size=(n_sample, n_stories, 2))
+        RID = np.minimum(PID[:, None], RID[:, None]*np.exp(eps))
+        for fl in range(n_stories):
+            demands[('RID', str(fl+1), '1')] = RID[:, fl, 0]
+            demands[('RID', str(fl+1), '2')] = RID[:, fl, 1]
+        
+        # non-directional demands are the max over directions, amplified
+        for (edp_type, loc, direction) in list(demands):
+            if (edp_type, loc, '0') in demands:
+                continue
+            dir_demands = [demands[key] for key in demands 
+                           if key[:2] == (edp_type, loc) and key[2] != '0']
+            demands[(edp_type, loc, '0')] = nondir_multi*np.max(dir_demands, axis=0)
+        
+        ###########################################################################
+        # DAMAGE
+        ###########################################################################
+        
+        cmp_marginals = self.components
+        param_key = (tuple(cmp_marginals['Component'].unique()), 
+                     self.superstructure_system, self.num_stories, mode)
+        if (param_cache is not None) and (param_key in param_cache):
+            frag_params, loss_params = param_cache[param_key]
+        else:
+            frag_params, loss_params = self.analytic_params(
+                mode=mode, custom_fragility_db=custom_fragility_db)
+            if param_cache is not None:
+                param_cache[param_key] = (frag_params, loss_params)
+        
+        def get_locations(loc):
+            loc = str(loc)
+            if loc == 'all':
+                return([str(fl+1) for fl in range(n_stories)])
+            if loc == 'roof':
+                return([str(n_stories+1)])
+            if loc == 'top':
+                return([str(n_stories)])
+            return([str(int(loc))])
+        
+        def get_directions(direction):
+            if pd.isnull(direction):
+                return(['1'])
+            return([str(int(d)) for d in str(direction).split(',')])
+        
+        # performance groups (component rows expanded over locations and
+        # directions) that have a fragility and a demand, as arrays: component
+        # row, demand, demand unit scale, and limit states padded to the most
+        # of any group (never exceeded). ds_weights maps the limit states to
+        # DS1, DS2, ... These only depend on the parameters and the component
+        # layout, so they are built once per layout
+        def performance_groups():
+            pg_row = []
+            pg_loc = []
+            pg_edp = []
+            pg_scale = []
+            pg_ls = []
+            for i_row, (cmp, location, direction_list) in enumerate(cmp_layout):
+                frag = frag_params.get(cmp)
+                if (frag is None) or (len(frag['limit_states']) == 0):
+                    continue
+                for loc in get_locations(location):
+                    for direction in get_directions(direction_list):
+                        if not frag['directional']:
+                            direction = '0'
+                        edp = (frag['edp_type'], str(int(loc)+frag['offset']), direction)
+                        if edp not in demands:
+                            continue
+                        pg_row.append(i_row)
+                        pg_loc.append(loc)
+                        pg_edp.append(edp)
+                        pg_scale.append(
+                            unit_scale_factor(demand_units.get(edp[0], 'unitless')) /
+                            unit_scale_factor(frag['unit']))
+                        pg_ls.append(frag['limit_states'])
+            
+            n_pg = len(pg_row)
+            n_ls = max([len(limit_states) for limit_states in pg_ls] + [1])
+            pg_n_ds = np.array([sum(len(ls[3]) for ls in limit_states) 
+                                for limit_states in pg_ls], dtype=int)
+            n_ds = max(pg_n_ds.tolist() + [1])
+            theta_0 = np.full((n_pg, n_ls), np.inf)
+            theta_1 = np.ones((n_pg, n_ls))
+            fixed = np.ones((n_pg, n_ls), dtype=bool)
+            ds_weights = np.zeros((n_pg, n_ls, n_ds))
+            for pg, limit_states in enumerate(pg_ls):
+                ds = 0
+                for ls_i, (family, ls_theta_0, ls_theta_1, weights) in enumerate(limit_states):
+                    theta_0[pg, ls_i] = ls_theta_0
+                    theta_1[pg, ls_i] = ls_theta_1
+                    fixed[pg, ls_i] = pd.isna(family)
+                    ds_weights[pg, ls_i, ds:ds+len(weights)] = weights
+                    ds += len(weights)
+            
+            # consequences of DS1, DS2, ... of each group, per decision
+            # variable: a constant median, or the index of a multilinear median
+            # curve (these depend on the damaged quantity of the component and
+            # DS), and the family (0: none, 1: lognormal, 2: normal) of the
+            # deviation
+            pg_row = np.array(pg_row, dtype=int)
+            pg_cmp = cmp_layout[pg_row, 0]
+            conseq = {}
+            for dv in ['Cost', 'Time']:
+                dv_conseq = {'has': np.zeros((n_pg, n_ds), dtype=bool),
+                             'median': np.ones((n_pg, n_ds)),
+                             'multilinear': np.full((n_pg, n_ds), -1),
+                             'curves': [],
+                             'family': np.zeros((n_pg, n_ds), dtype=int),
+                             'dev_0': np.ones((n_pg, n_ds)),
+                             'dev_1': np.zeros((n_pg, n_ds)),
+                             'unit': np.ones(n_pg)}
+                for cmp in np.unique(pg_cmp):
+                    if (cmp, dv) not in loss_params:
+                        continue
+                    cmp_conseq = loss_params[(cmp, dv)]
+                    cmp_pgs = np.flatnonzero(pg_cmp == cmp)
+                    dv_conseq['unit'][cmp_pgs] = unit_scale_factor(cmp_conseq['unit'])
+                    for ds, ds_params in enumerate(cmp_conseq['ds'][:n_ds]):
+                        if ds_params is None:
+                            continue
+                        median, family, dev_0, dev_1 = ds_params
+                        dv_conseq['has'][cmp_pgs, ds] = True
+                        if isinstance(median, tuple):
+                            dv_conseq['multilinear'][cmp_pgs, ds] = len(dv_conseq['curves'])
+                            dv_conseq['curves'].append(median)
+                        else:
+                            dv_conseq['median'][cmp_pgs, ds] = median
+                        if pd.isna(family):
+                            continue
+                        dv_conseq['family'][cmp_pgs, ds] = 1 if family == 'lognormal' else 2
+                        dv_conseq['dev_0'][cmp_pgs, ds] = dev_0
+                        dv_conseq['dev_1'][cmp_pgs, ds] = dev_1
+                conseq[dv] = dv_conseq
+            
+            edps = list(dict.fromkeys(pg_edp))
+            return({'row': pg_row,
+                    'cmp': pg_cmp,
+                    'loc': np.array(pg_loc, dtype=object),
+                    'rid': np.array([edp[0] == 'RID' for edp in pg_edp], dtype=bool),
+                    'edps': edps,
+                    'edp': np.array([edps.index(edp) for edp in pg_edp], dtype=int),
+                    'scale': np.array(pg_scale, dtype=float),
+                    'n_ds': pg_n_ds,
+                    'theta_0': theta_0, 'theta_1': theta_1, 'fixed': fixed,
+                    'ds_weights': ds_weights, 'conseq': conseq})
+        
+        cmp_layout = cmp_marginals[['Component', 'Location', 
+                                    'Direction']].to_numpy(dtype=object)
+        groups_key = ('groups', param_key, 
+                      tuple(map(tuple, cmp_layout.astype(str))))
+        if (param_cache is not None) and (groups_key in param_cache):
+            groups = param_cache[groups_key]
+        else:
+            groups = performance_groups()
+            if param_cache is not None:
+                param_cache[groups_key] = groups
+        
+        # probabilities of DS1, DS2, ... of one block of each group at its
+        # demand (one per group, or one per group and realization). a block
+        # ends in the highest limit state exceeded, with the DS of that limit
+        # state picked by the DS weights
+        def ds_probabilities(pgs, demand):
+            shape = (len(pgs),) + (1,)*(demand.ndim-1) + groups['theta_0'].shape[1:]
+            theta_0 = groups['theta_0'][pgs].reshape(shape)
+            theta_1 = groups['theta_1'][pgs].reshape(shape)
+            demand = demand[..., None]
+            with np.errstate(divide='ignore'):
+                p_ls = np.where(groups['fixed'][pgs].reshape(shape), 
+                                theta_0 < demand,
+                                ndtr(np.log(demand/theta_0)/theta_1))
+            # capacities without a dispersion are NaN in Pelicun, and never
+            # exceeded
+            p_ls = np.nan_to_num(p_ls)
+            
+            p_higher = np.maximum.accumulate(p_ls[..., ::-1], axis=-1)[..., ::-1]
+            p_higher = np.concatenate([p_higher[..., 1:],
+                                       np.zeros(p_ls.shape[:-1]+(1,))], axis=-1)
+            p_final = np.clip(p_ls - p_higher, 0.0, 1.0)
+            ds_weights = groups['ds_weights'][pgs].reshape(
+                shape[:-1] + groups['ds_weights'].shape[1:])
+            return((p_final[..., None]*ds_weights).sum(axis=-2))
+        
+        edp_demands = [demands[edp] for edp in groups['edps']]
+        const_pg = np.flatnonzero(~groups['rid'])
+        rid_pg = np.flatnonzero(groups['rid'])
+        const_demand = np.array([edp_demands[edp] for edp in groups['edp'][const_pg]],
+                                dtype=float)
+        rid_demand = np.array([edp_demands[edp] for edp in groups['edp'][rid_pg]],
+                              dtype=float).reshape(len(rid_pg), n_sample)
+        all_pvals = np.zeros(groups['ds_weights'].shape[::2])
+        all_pvals[const_pg] = ds_probabilities(
+            const_pg, const_demand*groups['scale'][const_pg])
+        rid_pvals = ds_probabilities(
+            rid_pg, rid_demand*groups['scale'][rid_pg][:, None])
+        
+        # groups that can be damaged at these demands, in component row order
+        damaged = all_pvals.any(axis=1)
+        damaged[rid_pg] = rid_pvals.any(axis=(1, 2))
+        rid_pvals = rid_pvals[damaged[rid_pg]]
+        pgs = np.flatnonzero(damaged)
+        
+        # DS that the damaged groups can reach
+        pg_possible = all_pvals[pgs] > 0
+        pg_possible[groups['rid'][pgs]] = rid_pvals.any(axis=1)
+        
+        n_pg = len(pgs)
+        pg_cmp = groups['cmp'][pgs]
+        pg_loc = groups['loc'][pgs]
+        pg_row = groups['row'][pgs]
+        pg_n_ds = groups['n_ds'][pgs]
+        pg_pvals = all_pvals[pgs]
+        const_pg = ~groups['rid'][pgs]
+        n_ds = max(pg_n_ds.tolist() + [1])
+        
+        blocks = cmp_marginals['Blocks'].to_numpy(dtype=float)
+        pg_blocks = np.where(np.isnan(blocks), 1, blocks).astype(int)[pg_row]
+        
+        # number of blocks in DS1, DS2, ... of each group: multinomial with the
+        # block count, drawn together for groups with the same number of DS.
+        # groups with RID demands vary by realization. kept as one
+        # (realizations x groups) array per DS
+        counts = np.zeros((n_ds, n_sample, n_pg))
+        for k in np.unique(pg_n_ds[const_pg]):
+            group = np.flatnonzero(const_pg & (pg_n_ds == k))
+            pvals = np.zeros((len(group), k+1))
+            pvals[:, :k] = pg_pvals[group, :k]
+            pvals[:, k] = np.clip(1.0 - pvals[:, :k].sum(axis=1), 0.0, 1.0)
+            counts[:k, :, group] = np.moveaxis(rng.multinomial(
+                pg_blocks[group], pvals, size=(n_sample, len(group)))[:, :, :k], 2, 0)
+        for pg, pg_rid_pvals in zip(np.flatnonzero(~const_pg), rid_pvals):
+            k = pg_n_ds[pg]
+            pvals = np.zeros((n_sample, k+1))
+            pvals[:, :k] = pg_rid_pvals[:, :k]
+            pvals[:, k] = np.clip(1.0 - pvals[:, :k].sum(axis=1), 0.0, 1.0)
+            counts[:k, :, pg] = rng.multinomial(pg_blocks[pg], pvals)[:, :k].T
+        
+        # damage process: collapse clears all other damage, and excessive
+        # residual drift on any floor makes the building irreparable
+        collapsed = counts[0][:, pg_cmp == 'collapse'].sum(axis=1) > 0
+        irreparable = (counts[0][:, (pg_cmp == 'excessiveRID') | 
+                                 (pg_cmp == 'irreparable')].sum(axis=1) > 0)
+        irreparable = irreparable & ~collapsed
+        replaced = collapsed | irreparable
+        counts[:, collapsed, :] = 0.0
+        
+        # quantity of one block of each group
+        theta_0 = cmp_marginals['Theta_0'].to_numpy(dtype=float)[pg_row]
+        theta_1 = cmp_marginals['Theta_1'].to_numpy(dtype=float)[pg_row]
+        lognormal = (cmp_marginals['Family'] == 'lognormal').to_numpy()[pg_row]
+        units, unit_idx = np.unique(cmp_marginals['Units'].to_numpy(
+            dtype=str)[pg_row], return_inverse=True)
+        qty_unit = np.array([unit_scale_factor(unit) for unit in units],
+                            dtype=float)[unit_idx]
+        z = rng.standard_normal((n_sample, n_pg))
+        block_qty = np.where(lognormal > 0, theta_0*np.exp(theta_1*z), theta_0)/pg_blocks
+        
+        ###########################################################################
+        # LOSS
+        ###########################################################################
+        
+        # consequence of every damaged quantity: median (constant, or multilinear
+        # in the building-wide damaged quantity of the component and DS) times a
+        # deviation (with the constant median, if random). worked out for all
+        # damaged (DS, realization, group) entries at once
+        pair_pgs, pair_ds = np.nonzero(pg_possible)
+        pair_counts = counts[pair_ds, :, pair_pgs].T
+        hit_rows, hit_pairs = np.nonzero(pair_counts)
+        hit_qty = (pair_counts[hit_rows, hit_pairs]*
+                   block_qty[hit_rows, pair_pgs[hit_pairs]])
+        pair_groups = pgs[pair_pgs]
+        dv_samples = {}
+        for dv in ['Cost', 'Time']:
+            # consequence parameters of each (group, DS) pair
+            conseq = groups['conseq'][dv]
+            pair_conseq = {name: conseq[name][pair_groups, pair_ds] for name in 
+                           ['has', 'median', 'multilinear', 'family', 'dev_0', 'dev_1']}
+            pair_scale = qty_unit[pair_pgs]/conseq['unit'][pair_groups]
+            
+            entries = np.flatnonzero(pair_conseq['has'][hit_pairs])
+            rows = hit_rows[entries]
+            pairs = hit_pairs[entries]
+            qty = hit_qty[entries]*pair_scale[pairs]
+            
+            median = pair_conseq['median'][pairs]
+            curve = pair_conseq['multilinear'][pairs]
+            on_curve = np.flatnonzero(curve >= 0)
+            if len(on_curve) > 0:
+                n_curves = len(conseq['curves'])
+                curve_idx = rows[on_curve]*n_curves + curve[on_curve]
+                curve_qty = np.bincount(curve_idx, weights=qty[on_curve],
+                                        minlength=n_sample*n_curves).reshape(
+                                            n_sample, n_curves)
+                curve_median = np.zeros((n_sample, n_curves))
+                for i_curve in np.unique(curve[on_curve]):
+                    cmp_median, cmp_qty = conseq['curves'][i_curve]
+                    curve_median[:, i_curve] = np.interp(curve_qty[:, i_curve],
+                                                         cmp_qty, cmp_median)
+                median[on_curve] = curve_median.ravel()[curve_idx]
+            
+            dev = np.ones(len(qty))
+            family = pair_conseq['family'][pairs]
+            for code in [1, 2]:
+                random = np.flatnonzero(family == code)
+                z = rng.standard_normal(len(random))
+                dev_0 = pair_conseq['dev_0'][pairs[random]]
+                dev_1 = pair_conseq['dev_1'][pairs[random]]
+                if code == 1:
+                    dev[random] = dev_0*np.exp(dev_1*z)
+                else:
+                    # dev_1 is the c.o.v., truncated at zero
+                    sig = np.abs(dev_0)*dev_1
+                    p_zero = ndtr(-dev_0/sig)
+                    dev[random] = dev_0 + sig*ndtri(p_zero + ndtr(z)*(1.0 - p_zero))
+            
+            dv_samples[dv] = np.bincount(rows*n_pg + pair_pgs[pairs], 
+                                         weights=qty*median*dev,
+                                         minlength=n_sample*n_pg).reshape(n_sample, n_pg)
+        
+        # repair time: parallel is the slowest floor, sequential the sum
+        repair_cost = dv_samples['Cost'].sum(axis=1)
+        time_sequential = dv_samples['Time'].sum(axis=1)
+        time_parallel = np.zeros(n_sample)
+        for loc in set(pg_loc):
+            loc_pgs = np.flatnonzero(pg_loc == loc)
+            time_parallel = np.maximum(time_parallel, 
+                                       dv_samples['Time'][:, loc_pgs].sum(axis=1))
+        
+        # replaced buildings cost and take the replacement values
+        replacement_cost, replacement_time = self.replacement_consequences(
+            cmp_replacement_cost, cmp_replacement_time)
+        repair_cost[replaced] = replacement_cost
+        time_parallel[replaced] = replacement_time
+        time_sequential[replaced] = replacement_time
+        
+        agg_DF = pd.DataFrame(
+            np.column_stack([repair_cost, time_parallel, time_sequential]),
+            columns=pd.MultiIndex.from_tuples([('repair_cost', ''),
+                                               ('repair_time', 'parallel'),
+                                               ('repair_time', 'sequential')]))
+        
+        # summarize by groups, only repair cost from non-replacement cases
+        loss_groups = pd.DataFrame()
+        for group in ['B', 'C', 'D', 'E']:
+            group_pgs = [pg for pg in range(n_pg) if pg_cmp[pg].startswith(group)]
+            loss_groups[group] = dv_samples['Cost'][:, group_pgs].sum(axis=1)
+        
+        if mode == 'maximize':
+            collapse_freq = 0.0
+            irreparable_freq = 0.0
+        else:
+            loss_groups = loss_groups.loc[~replaced]
+            collapse_freq = collapsed.sum()/n_sample
+            irreparable_freq = irreparable.sum()/n_sample
+        
+        # per-realization group losses, kept for the batched engine
+        self.loss_group_sample = loss_groups
+        
+        return(loss_groups, agg_DF, collapse_freq, irreparable_freq)
+    
+#%% batched loss engine
+
+# Loss estimation for a whole set of designs. Everything that does not depend
+# on the design (P-58 metadata and tables, custom fragilities) is loaded once
+# per process, and designs can be split over a pool of worker processes. Each
+# assessment reseeds its generator (estimate_damage, estimate_loss_analytic),
+# so results do not depend on the worker that ran it.
+
+# default P-58 tables, read once per process
+_p58_data = {}
+
+def get_p58_data(data_name):
+    if data_name not in _p58_data:
+        from pelicun.assessment import Assessment
+        PAL = Assessment({"PrintLog": False, "Verbose": False})
+        _p58_data[data_name] = PAL.get_default_data(data_name)
+    return(_p58_data[data_name])
+
+# Pelicun unit conversion factors to SI, read once per process
+_unit_factors = {}
+
+# unit: e.g. 'ft2' or '100 SF'
+def unit_scale_factor(unit):
+    if len(_unit_factors) == 0:
+        from pelicun.base import parse_units
+        _unit_factors.update(parse_units())
+
+    unit_lst = unit.strip().split(' ')
+    if len(unit_lst) > 1:
+        return(float(unit_lst[0])*_unit_factors[unit_lst[1]])
+    return(_unit_factors[unit_lst[0]])
+
+def load_loss_data(cmp_dir='../resource/loss/'):
+    import pandas as pd
+    from pelicun.assessment import Assessment
+    
+    PAL = Assessment({
+        "PrintLog": False, 
+        "Seed": 985,
+        "Verbose": False,
+        "DemandOffset": {"PFA": 0, "PFV": 0}
+    })
+    
+    P58_metadata = PAL.get_default_metadata('loss_repair_DB_FEMA_P58_2nd')
+    custom_fragility_db = pd.read_csv(cmp_dir+'custom_component_fragilities.csv',
+                                      header=[0,1], index_col=0)
+    
+    get_p58_data('damage_DB_FEMA_P58_2nd')
+    get_p58_data('loss_repair_DB_FEMA_P58_2nd')
+    
+    return({'P58_metadata': P58_metadata,
+            'custom_fragility_db': custom_fragility_db})
+
+# lab, health, ed, res, office, retail, warehouse, hotel
+office_usage = [0., 0., 0., 0., 1.0, 0., 0., 0.]
+
+# loss of one design. returns the per-realization aggregate losses (cost,
+# lower and upper bound time) and component group losses (B, C, D, E, only the
+# realizations without replacement), and the collapse and irreparable frequencies
+# engine: 'pelicun' (full assessment) or 'analytic' (estimate_loss_analytic,
+# deterministic demands only)
+def assess_loss(run_data, loss_data, mode='generate', max_cost=None,
+                max_time=None, fl_usage=office_usage, engine='pelicun'):
+    import numpy as np
+    
+    floors = run_data.num_stories
+    bldg_usage = [fl_usage]*floors
+    
+    loss = Loss_Analysis(run_data)
+    loss.nqe_sheets()
+    loss.normative_quantity_estimation(bldg_usage, loss_data['P58_metadata'])
+    
+    if engine == 'analytic':
+        # parsed fragility and consequence parameters are kept with the loss
+        # data, so they are shared by all designs of the process
+        [loss_cmp, agg, 
+         collapse_rate, irr_rate] = loss.estimate_loss_analytic(
+             custom_fragility_db=loss_data['custom_fragility_db'], mode=mode,
+             cmp_replacement_cost=max_cost, cmp_replacement_time=max_time,
+             param_cache=loss_data.setdefault('analytic_params', {}))
+    elif engine == 'pelicun':
+        loss.process_EDP()
+        
+        [cmp, dmg, loss_sample, loss_cmp, agg, 
+         collapse_rate, irr_rate] = loss.estimate_damage(
+             custom_fragility_db=loss_data['custom_fragility_db'], mode=mode,
+             cmp_replacement_cost=max_cost, cmp_replacement_time=max_time)
+    else:
+        raise ValueError('Unknown loss engine: '+str(engine))
+    
+    agg_sample = agg.iloc[:, :len(agg_names)].to_numpy(dtype=float)
+    group_sample = loss.loss_group_sample[group_names].to_numpy(dtype=float)
+    return(agg_sample, group_sample, collapse_rate, irr_rate)
+
+def print_loss(agg_sample, collapse_rate, irr_rate):
+    import numpy as np
+    cost, time_l, time_u = np.median(agg_sample, axis=0)
+    
+    print('Median repair cost: ', 
+          f'${cost:,.2f}')
+    print('Median lower bound repair time: ', 
+          f'{time_l:,.2f}', 'worker-days')
+    print('Median upper bound repair time: ', 
+          f'{time_u:,.2f}', 'worker-days')
+    print('Collapse frequency: ', 
+          f'{collapse_rate:.2%}')
+    print('Irreparable RID frequency: ', 
+          f'{irr_rate:.2%}')
+    print('Replacement frequency: ', 
+          f'{collapse_rate+irr_rate:.2%}')
+
+_worker_loss_data = None
+
+def _init_loss_worker(cmp_dir):
+    global _worker_loss_data
+    _worker_loss_data = load_loss_data(cmp_dir)
+
+def _loss_worker(run_data, mode, max_cost, max_time, engine):
+    return(assess_loss(run_data, _worker_loss_data, mode=mode,
+                       max_cost=max_cost, max_time=max_time, engine=engine))
+
+# append the statistics of one finished run (loss_data_table columns) to the
+# checkpoint table, so finished runs survive a crash of the set
+def checkpoint_loss_run(checkpoint_file, run_idx, run):
+    import os
+    
+    row = loss_data_table(stack_loss_samples([run]))
+    row.insert(0, 'run_idx', run_idx)
+    row.to_csv(checkpoint_file, mode='a', index=False,
+               header=not os.path.exists(checkpoint_file))
+
+# df: designs with their EDPs, indexed 0..n-1. max_costs, max_times: per-row
+# replacement consequences (None to use the defaults of estimate_damage)
+# engine: 'pelicun' or 'analytic', see assess_loss
+# returns one (agg_sample, group_sample, collapse_rate, irr_rate) per row, in
+# row order regardless of the order in which the workers finish. a run that
+# raises is logged and returned as None (NaN rows in stack_loss_samples), and
+# the set goes on. every finished run is appended to loss_save_<tag>.csv under
+# checkpoint_path as it completes, and the designs of failed runs are written
+# to failed_loss_runs_<tag>.csv, as in experiment.run_nlth_parallel
+def run_loss_set(df, mode='generate', max_costs=None, max_times=None,
+                 n_workers=1, cmp_dir='../resource/loss/', engine='pelicun',
+                 checkpoint_path='./checkpoints/'):
+    import os
+    import time
+    
+    n_runs = df.shape[0]
+    if max_costs is None:
+        max_costs = [None]*n_runs
+    if max_times is None:
+        max_times = [None]*n_runs
+    
+    os.makedirs(checkpoint_path, exist_ok=True)
+    run_tag = time.strftime('%Y%m%d_%H%M%S')
+    checkpoint_file = checkpoint_path+'loss_save_'+run_tag+'.csv'
+    
+    results = {}
+    failed = {}
+    
+    def finish_run(i_run, run):
+        results[i_run] = run
+        checkpoint_loss_run(checkpoint_file, df.index[i_run], run)
+        agg_sample, group_sample, collapse_rate, irr_rate = run
+        print_loss(agg_sample, collapse_rate, irr_rate)
+    
+    def fail_run(i_run, err):
+        print('Loss for run index %d failed with %s: %s' %
+              (df.index[i_run]+1, type(err).__name__, err))
+        failed[i_run] = type(err).__name__+': '+str(err)
+    
+    if n_workers <= 1:
+        loss_data = load_loss_data(cmp_dir)
+        for i_run, run_idx in enumerate(df.index):
+            print('========================================')
+            print('Estimating loss for run index', run_idx+1)
+            
+            try:
+                run = assess_loss(df.loc[run_idx], loss_data, mode=mode,
+                                  max_cost=max_costs[i_run],
+                                  max_time=max_times[i_run], engine=engine)
+            except Exception as err:
+                fail_run(i_run, err)
+                continue
+            finish_run(i_run, run)
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_loss_worker,
+                                 initargs=(cmp_dir,)) as pool:
+            futures = {pool.submit(_loss_worker, df.loc[run_idx], mode,
+                                   max_costs[i_run], max_times[i_run], 
+                                   engine): i_run
+                       for i_run, run_idx in enumerate(df.index)}
+            
+            for future in as_completed(futures):
+                i_run = futures[future]
+                try:
+                    run = future.result()
+                except Exception as err:
+                    fail_run(i_run, err)
+                    continue
+                
+                print('========================================')
+                print('Finished loss for run index %d (%d of %d done)' %
+                      (df.index[i_run]+1, len(results)+len(failed)+1, n_runs))
+                finish_run(i_run, run)
+    
+    # designs of the failed runs, with their errors, so they can be rerun
+    if len(failed) > 0:
+        failed_designs = df.iloc[sorted(failed)].copy()
+        failed_designs['error'] = [failed[i_run] for i_run in sorted(failed)]
+        failed_path = checkpoint_path+'failed_loss_runs_'+run_tag+'.csv'
+        failed_designs.to_csv(failed_path)
+        print('%d of %d loss runs failed, designs written to %s' %
+              (len(failed), n_runs, failed_path))
+    
+    return([results.get(i_run) for i_run in range(n_runs)])
+    
+# summary tables
+
+# the aggregate losses are described with the 10/50/90% quantiles and the
+# component groups with the 25/50/75% quantiles, same as DataFrame.describe
+# without the count
+agg_names = ['cost', 'time_l', 'time_u']
+group_names = ['B', 'C', 'D', 'E']
+agg_quantiles = [0.1, 0.5, 0.9]
+group_quantiles = [0.25, 0.5, 0.75]
+
+def quantile_name(q):
+    return('%g%%' % (100*q))
+
+# stack the per-run samples of run_loss_set into one (n_runs, n_sample) array
+# per quantity. runs with fewer realizations (group losses with replacement
+# realizations dropped) are padded with NaN, failed runs (None) are all NaN
+def stack_loss_samples(all_runs):
+    import numpy as np
+    
+    n_runs = len(all_runs)
+    n_sample = max([max(run[0].shape[0], run[1].shape[0]) 
+                    for run in all_runs if run is not None], default=1)
+    
+    samples = {}
+    for i_name, name in enumerate(agg_names + group_names):
+        if name in agg_names:
+            pos, col = 0, i_name
+        else:
+            pos, col = 1, i_name - len(agg_names)
+        
+        values = np.full((n_runs, n_sample), np.nan)
+        for i_run, run in enumerate(all_runs):
+            if run is None:
+                continue
+            run_sample = run[pos][:, col]
+            values[i_run, :len(run_sample)] = run_sample
+        samples[name] = values
+    
+    samples['collapse_freq'] = np.array([np.nan if run is None else run[2] 
+                                         for run in all_runs], dtype=float)
+    samples['irreparable_freq'] = np.array([np.nan if run is None else run[3] 
+                                            for run in all_runs], dtype=float)
+    return(samples)
+
+# mean, std, min, quantiles and max of each row, ignoring the NaN padding
+# (all NaN if a run has no realizations, as describe gives)
+def describe_samples(values, quantiles):
+    import numpy as np
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        stats = ([np.nanmean(values, axis=1),
+                  np.nanstd(values, axis=1, ddof=1),
+                  np.nanmin(values, axis=1)] +
+                 list(np.nanquantile(values, quantiles, axis=1)) +
+                 [np.nanmax(values, axis=1)])
+    return(np.column_stack(stats))
+
+# one row per run, columns <name>_<stat>
+def loss_summary_table(samples, names, quantiles):
+    import numpy as np
+    import pandas as pd
+    
+    stat_names = (['mean', 'std', 'min'] + 
+                  [quantile_name(q) for q in quantiles] + ['max'])
+    
+    header = [name+'_'+stat for name in names for stat in stat_names]
+    table = np.hstack([describe_samples(samples[name], quantiles) 
+                       for name in names])
+    return(pd.DataFrame(table, columns=header))
+
+# the loss table of run_pelicun/calc_cmp_max: aggregate loss statistics,
+# collapse/irreparable/replacement frequencies, (IDA levels) and component
+# group statistics
+def loss_data_table(samples, ida_levels=None):
+    import pandas as pd
+    
+    loss_df_data = loss_summary_table(samples, agg_names, agg_quantiles)
+    
+    loss_df_data['collapse_freq'] = samples['collapse_freq']
+    loss_df_data['irreparable_freq'] = samples['irreparable_freq']
+    loss_df_data['replacement_freq'] = (samples['collapse_freq'] + 
+                                        samples['irreparable_freq'])
+    
+    if ida_levels is not None:
+        loss_df_data['ida_level'] = ida_levels
+    
+    group_df_data = loss_summary_table(samples, group_names, group_quantiles)
+    return(pd.concat([loss_df_data, group_df_data], axis=1))
+
+# other quantiles of the stored samples, e.g. loss_quantiles(db.loss_samples, [0.95])
+def loss_quantiles(samples, quantiles, names=agg_names+group_names):
+    import numpy as np
+    import pandas as pd
+    
+    columns = {}
+    for name in names:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            values = np.nanquantile(samples[name], quantiles, axis=1)
+        for q, q_values in zip(quantiles, values):
+            columns[name+'_'+quantile_name(q)] = q_values
+    return(pd.DataFrame(columns))
+
+# engine comparison
+
+# runs both loss engines (see assess_loss) on the same designs, e.g. a few MF
+# and CBF rows of ops_analysis. one row per design and engine: wall time, then
+# the loss_data_table columns (aggregate quantiles, collapse and irreparable
+# frequencies, component group quantiles). the engines draw different
+# realizations, and the group losses are heavy-tailed (roof component
+# quantities), so their means move from run to run; compare the quantiles
+# and frequencies
+def compare_loss_engines(df, mode='generate', cmp_dir='../resource/loss/',
+                         engines=('pelicun', 'analytic')):
+    import time
+    import pandas as pd
+    
+    loss_data = load_loss_data(cmp_dir)
+    
+    all_rows = []
+    for run_idx in df.index:
+        run_data = df.loc[run_idx]
+        for engine in engines:
+            # the first analytic run also parses the fragility parameters
+            t0 = time.time()
+            run = assess_loss(run_data, loss_data, mode=mode, engine=engine)
+            wall_time = time.time() - t0
+            
+            row = {'run_idx': run_idx,
+                   'superstructure_system': run_data.superstructure_system,
+                   'num_stories': run_data.num_stories,
+                   'engine': engine, 'wall_time': wall_time}
+            row.update(loss_data_table(stack_loss_samples([run])).iloc[0].to_dict())
+            all_rows.append(row)
+    return(pd.DataFrame(all_rows))
+
+# acceptance check on a compare_loss_engines table: the analytic engine passes
+# a design if, against Pelicun,
+#   collapse and irreparable frequencies differ by at most freq_tol (absolute;
+#   one standard error of a difference of two 1000-realization frequencies
+#   is up to 0.022)
+#   aggregate cost and repair time 10/50/90% quantiles differ by at most
+#   agg_tol (relative). a p-quantile is skipped if either replacement
+#   frequency is within freq_tol of 1-p, where it jumps to the replacement
+#   value
+#   component group quartiles differ by at most group_tol (relative). only
+#   checked where at least min_repairable realizations are repairable, and
+#   skipped for group values below 1% of the median cost (e.g. group E),
+#   whose relative sampling noise is large
+# returns one row per failed check, empty if the engine is accepted
+def check_loss_engines(comparison, freq_tol=0.05, agg_tol=0.10,
+                       group_tol=0.25, min_repairable=100, n_sample=1000):
+    import numpy as np
+    import pandas as pd
+    
+    freq_cols = ['collapse_freq', 'irreparable_freq']
+    agg_quantiles = {'10%': 0.1, '50%': 0.5, '90%': 0.9}
+    group_cols = [grp+'_'+q for grp in ['B', 'C', 'D', 'E']
+                  for q in ['25%', '50%', '75%']]
+    
+    failed = []
+    for run_idx, runs in comparison.groupby('run_idx', sort=False):
+        ref = runs[runs['engine'] == 'pelicun'].iloc[0]
+        new = runs[runs['engine'] == 'analytic'].iloc[0]
+        
+        checks = [(col, abs(new[col] - ref[col]), freq_tol)
+                  for col in freq_cols]
+        agg_cols = [dv+'_'+q for q, p in agg_quantiles.items()
+                    for dv in ['cost', 'time_l', 'time_u']
+                    if (abs(1 - p - ref['replacement_freq']) > freq_tol and
+                        abs(1 - p - new['replacement_freq']) > freq_tol)]
+        checks += [(col, abs(new[col] - ref[col])/abs(ref[col]), agg_tol)
+                   for col in agg_cols if ref[col] != 0]
+        
+        n_repairable = (1 - max(ref['replacement_freq'],
+                                new['replacement_freq']))*n_sample
+        if n_repairable >= min_repairable:
+            floor = 0.01*ref['cost_50%']
+            checks += [(col, abs(new[col] - ref[col])/abs(ref[col]), group_tol)
+                       for col in group_cols
+                       if not np.isnan(ref[col]) and abs(ref[col]) >= floor]
+            
+        failed += [{'run_idx': run_idx, 'column': col, 'pelicun': ref[col],
+                    'analytic': new[col], 'difference': diff,
+                    'tolerance': tol}
+                   for col, diff, tol in checks if not diff <= tol]
+    return(pd.DataFrame(failed, columns=['run_idx', 'column', 'pelicun',
+                                         'analytic', 'difference',
+                                         'tolerance']))
+    
 #%% test
 
 # # run info
@@ -42,7 +42,7 @@
 # dt = 0.005
 # ok = bldg.run_ground_motion(run.gm_selected, 
 #                         run.scale_factor*1.0, 
-#                         dt, T_end=60.0)
+#                         dt, T_end=60.0, debug=True)
 
 # from plot_structure import plot_dynamic
 # plot_dynamic(run)
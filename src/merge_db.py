@@ -0,0 +1,35 @@
+############################################################################
+#               Merge sharded results
+
+# Date created: October 2026
+
+# Description:  command line tool to compact the per-seed or per-row result
+#               files of the HPC runs into one columnar dataset (store.py)
+
+# Example:      python merge_db.py ../data/validation/mf_tfp_case/ 
+#                   ../data/validation/mf_tfp_case_merged/ --pattern 'row_*'
+
+############################################################################
+
+import argparse
+parser = argparse.ArgumentParser(
+    description='Merge result shards into one deduplicated Parquet dataset.')
+parser.add_argument('shard_dir', type=str,
+                    help='folder holding the shards')
+parser.add_argument('out_path', type=str,
+                    help='folder of the merged dataset')
+parser.add_argument('--pattern', type=str, default='*',
+                    help='file name pattern of the shards, e.g. row_*')
+parser.add_argument('--table', type=str, default='ops_analysis',
+                    help='table to take from pickled Database shards')
+parser.add_argument('--chunk_rows', type=int, default=20000,
+                    help='rows held in memory per written part')
+parser.add_argument('--skip_invalid', action='store_true',
+                    help='skip shards with mismatched columns instead of failing')
+
+args = parser.parse_args()
+
+from store import merge_shards
+merge_shards(args.shard_dir, args.out_path, pattern=args.pattern,
+             table=args.table, chunk_rows=args.chunk_rows, 
+             skip_invalid=args.skip_invalid)
@@ -0,0 +1,99 @@
+############################################################################
+#               Run profiling
+
+# Date created: October 2026
+
+# Description:  Per-run wall time of each phase of an NLTH (model build,
+#               gravity, eigen, damping, transient, convergence fallbacks,
+#               results) and counters (steps, algorithm switches, dt cuts,
+#               outcome). Each run is appended as one JSON line to a log, and
+#               the logs of a campaign are read back into one DataFrame.
+
+# Open issues:  (1) phases may nest (e.g. warm_restart inside fallback), so
+#               phase times do not add up to the run time
+
+############################################################################
+
+class RunProfile:
+
+    def __init__(self, **info):
+        import time
+
+        self.info = dict(info)
+        self.times = {}
+        self.counters = {}
+        self.t_start = time.time()
+
+    # with profile.phase('gravity'): ...
+    def phase(self, name):
+        import time
+        from contextlib import contextmanager
+
+        @contextmanager
+        def timer():
+            t0 = time.time()
+            try:
+                yield
+            finally:
+                self.add_time(name, time.time() - t0)
+        return(timer())
+
+    def add_time(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        self.info[name] = value
+
+    def summary(self):
+        import time
+
+        record = dict(self.info)
+        record['wall_time'] = time.time() - self.t_start
+        for name, seconds in self.times.items():
+            record['time_'+name] = seconds
+        for name, n in self.counters.items():
+            record['n_'+name] = n
+        return(record)
+
+    # append the run to a JSON lines log
+    def log(self, log_path):
+        import json
+        import os
+
+        log_dir = os.path.dirname(log_path)
+        if log_dir != '':
+            os.makedirs(log_dir, exist_ok=True)
+
+        # numpy scalars are written as plain numbers
+        def to_json(value):
+            if hasattr(value, 'item'):
+                return value.item()
+            return str(value)
+
+        with open(log_path, 'a') as f:
+            f.write(json.dumps(self.summary(), default=to_json)+'\n')
+
+# all runs in the logs matching log_glob (e.g. '../data/profiles/**/*.jsonl')
+def load_profiles(log_glob):
+    import glob
+    import json
+    import pandas as pd
+
+    records = []
+    for log_path in sorted(glob.glob(log_glob, recursive=True)):
+        with open(log_path, 'r') as f:
+            for line in f:
+                if line.strip() != '':
+                    records.append(json.loads(line))
+    return(pd.DataFrame(records))
+
+# campaign summary: totals and quantiles of the phase times and counters
+def summarize_profiles(profiles, by='superstructure_system'):
+    cols = [col for col in profiles.columns
+            if col.startswith('time_') or col.startswith('n_') or col == 'wall_time']
+    profiles = profiles.copy()
+    profiles[cols] = profiles[cols].fillna(0)
+    return(profiles.groupby(by)[cols].describe(percentiles=[0.5, 0.95]))
@@ -0,0 +1,594 @@
+############################################################################
+#               Task runner
+
+# Date created: October 2026
+
+# Description:  Work queue for the NLTH runs of a database or an IDA case.
+#               The job table is computed once and stored in a task broker
+#               (SQLite). Each runner keeps n_workers processes busy, handing
+#               them the next pending task as soon as they are free. Runs
+#               that crash or exceed the timeout are retried a bounded number
+#               of times. More runners on the same node can join the broker
+#               file; for several nodes, split the pending tasks into one
+#               broker file per node.
+#               Tasks are handed out longest-expected-first, using a runtime
+#               model fit to the wall times of earlier campaigns.
+
+# Open issues:  (1) a runner killed mid-run leaves its tasks 'running';
+#               requeue_stale puts them back once they are older than the
+#               timeout
+#               (2) the broker runs SQLite in WAL mode by default, which
+#               needs shared memory on one host: never open the same broker
+#               file from two nodes, even on a shared file system
+#               (NFS/Lustre). Use --journal_mode DELETE for a shard that
+#               sits on a network file system
+
+############################################################################
+
+gm_path_default = '../resource/ground_motions/PEERNGARecords_Unscaled/'
+
+class TaskBroker:
+
+    # journal_mode: 'WAL' for runners on one node, 'DELETE' (rollback
+    # journal) for a broker file on a network file system
+    def __init__(self, path, timeout=60.0, journal_mode='WAL'):
+        import sqlite3
+        import os
+
+        broker_dir = os.path.dirname(path)
+        if broker_dir != '':
+            os.makedirs(broker_dir, exist_ok=True)
+
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout,
+                                    isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode='+journal_mode)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tasks (
+                                task_id INTEGER PRIMARY KEY,
+                                design BLOB,
+                                status TEXT,
+                                attempts INTEGER,
+                                worker TEXT,
+                                started REAL,
+                                finished REAL,
+                                wall_time REAL,
+                                error TEXT,
+                                result BLOB,
+                                expected REAL)''')
+        
+        # task files from before expected run times were kept
+        task_cols = [row[1] for row in 
+                     self.conn.execute('PRAGMA table_info(tasks)')]
+        if 'expected' not in task_cols:
+            self.conn.execute('ALTER TABLE tasks ADD COLUMN expected REAL')
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    # queue every row of all_designs, unless the job table is already there.
+    # expected_time (s, one per row) sets the dispatch order, longest first
+    def add_tasks(self, all_designs, expected_time=None):
+        import pickle
+
+        if len(self) > 0:
+            return(0)
+        if expected_time is None:
+            expected_time = [None]*len(all_designs)
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany(
+            '''INSERT INTO tasks (task_id, design, status, attempts, expected)
+               VALUES (?,?,'pending',0,?)''',
+            [(i_task, pickle.dumps(design), 
+              None if t_exp is None else float(t_exp)) 
+             for i_task, ((index, design), t_exp)
+             in enumerate(zip(all_designs.iterrows(), expected_time))])
+        self.conn.execute('COMMIT')
+        return(len(all_designs))
+
+    # next pending task, marked as running by worker; None if there is none
+    def claim(self, worker):
+        import pickle
+        import time
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        row = self.conn.execute('''SELECT task_id, design FROM tasks
+                                   WHERE status = 'pending'
+                                   ORDER BY expected IS NULL, expected DESC,
+                                            task_id LIMIT 1''').fetchone()
+        if row is None:
+            self.conn.execute('COMMIT')
+            return(None)
+        self.conn.execute('''UPDATE tasks SET status = 'running', worker = ?,
+                             started = ?, attempts = attempts + 1
+                             WHERE task_id = ?''', (worker, time.time(), row[0]))
+        self.conn.execute('COMMIT')
+        return(row[0], pickle.loads(row[1]))
+
+    def complete(self, task_id, result, wall_time=None):
+        import pickle
+        import time
+
+        self.conn.execute('''UPDATE tasks SET status = 'done', finished = ?,
+                             wall_time = ?, result = ? WHERE task_id = ?''',
+                          (time.time(), wall_time, pickle.dumps(result), task_id))
+
+    # failed attempt: back to pending while attempts remain, else failed.
+    # returns True if the task was requeued
+    def release(self, task_id, error, max_retries=1):
+        attempts = self.conn.execute('SELECT attempts FROM tasks WHERE task_id = ?',
+                                     (task_id,)).fetchone()[0]
+        requeue = attempts <= max_retries
+        if requeue:
+            status = 'pending'
+        else:
+            status = 'failed'
+        self.conn.execute('UPDATE tasks SET status = ?, error = ? WHERE task_id = ?',
+                          (status, error, task_id))
+        return(requeue)
+
+    # tasks left running by a runner that died
+    def requeue_stale(self, max_age):
+        import time
+        cur = self.conn.execute('''UPDATE tasks SET status = 'pending'
+                                   WHERE status = 'running' AND started < ?''',
+                                (time.time() - max_age,))
+        return(cur.rowcount)
+
+    def counts(self):
+        counts = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        for status, n in self.conn.execute(
+                'SELECT status, COUNT(*) FROM tasks GROUP BY status'):
+            counts[status] = n
+        return(counts)
+
+    def mean_wall_time(self):
+        return self.conn.execute('''SELECT AVG(wall_time) FROM tasks
+                                    WHERE status = 'done' ''').fetchone()[0]
+
+    # finished results as a DataFrame, in task order
+    def results(self):
+        import pickle
+        import pandas as pd
+
+        rows = self.conn.execute('''SELECT result FROM tasks WHERE status = 'done'
+                                    ORDER BY task_id''')
+        all_results = [pickle.loads(blob) for (blob,) in rows]
+        if len(all_results) == 0:
+            return None
+        return pd.DataFrame(all_results)
+
+    def close(self):
+        self.conn.close()
+
+############################################################################
+#               Run time model
+
+# log(wall time) is fit by least squares on the system, story and bay counts
+# and the record duration and dt. without training data, the expected time is
+# proportional to the model size times the record duration, which is enough
+# to order the tasks
+############################################################################
+
+class RuntimePredictor:
+
+    def __init__(self, gm_path=gm_path_default, ridge=1e-3):
+        self.gm_path = gm_path
+        self.ridge = ridge
+        self.coef = None
+        self.records = {}
+
+    # (dt, duration) of a record, read once
+    def record_info(self, gm_name):
+        if gm_name not in self.records:
+            from gms import load_record
+            try:
+                dt, values = load_record(gm_name, gm_dir=self.gm_path)
+                self.records[gm_name] = (dt, dt*len(values))
+            except (OSError, KeyError):
+                self.records[gm_name] = (0.005, 40.0)
+        return(self.records[gm_name])
+
+    def features(self, designs):
+        import numpy as np
+
+        n_stories = designs['num_stories'].to_numpy(dtype=float)
+        n_bays = designs['num_bays'].to_numpy(dtype=float)
+        is_cbf = (designs['superstructure_system'] == 'CBF').to_numpy(dtype=float)
+        is_lrb = (designs['isolator_system'] == 'LRB').to_numpy(dtype=float)
+        if 'gm_selected' in designs.columns:
+            dt, duration = np.array([self.record_info(gm_name) 
+                                     for gm_name in designs['gm_selected']]).T
+        else:
+            dt = np.full(len(designs), 0.005)
+            duration = np.full(len(designs), 40.0)
+
+        # CBF braces are subdivided, so their cost grows faster with stories
+        return(np.column_stack([np.ones(len(designs)),
+                                is_cbf, is_lrb,
+                                np.log(n_stories), np.log(n_bays),
+                                is_cbf*np.log(n_stories),
+                                np.log(duration), np.log(dt)]))
+
+    def fit(self, designs, wall_times):
+        import numpy as np
+
+        X = self.features(designs)
+        y = np.log(np.maximum(np.asarray(wall_times, dtype=float), 1e-3))
+        A = X.T @ X + self.ridge*np.eye(X.shape[1])
+        self.coef = np.linalg.solve(A, X.T @ y)
+        return(self)
+
+    # expected wall time (s); relative cost if the model is not fit
+    def predict(self, designs):
+        import numpy as np
+
+        X = self.features(designs)
+        if self.coef is None:
+            return(np.exp(X[:,3] + X[:,4] + X[:,6]))
+        return(np.exp(X @ self.coef))
+
+# designs and wall times of the finished tasks of a task file, read-only
+def task_timings(broker_path):
+    import sqlite3
+    import pickle
+    import pandas as pd
+
+    conn = sqlite3.connect('file:'+broker_path+'?mode=ro', uri=True)
+    rows = conn.execute('''SELECT design, wall_time FROM tasks
+                           WHERE status = 'done' AND wall_time IS NOT NULL''').fetchall()
+    conn.close()
+    designs = pd.DataFrame([pickle.loads(blob) for blob, wall_time in rows])
+    return(designs, [wall_time for blob, wall_time in rows])
+
+# predictor fit to the wall times of earlier runs, from run ledgers, profile
+# logs (globs, see profiling.py) and task files. a run found in both a ledger
+# and a profile log counts once. untrained if there are fewer than min_runs
+def fit_runtime_predictor(ledger_paths=(), profile_logs=(), broker_paths=(),
+                          gm_path=gm_path_default, min_runs=20):
+    import pandas as pd
+    from ledger import ledger_timings
+    from profiling import load_profiles
+
+    design_cols = ['superstructure_system', 'isolator_system',
+                   'num_stories', 'num_bays', 'gm_selected']
+    all_runs = []
+    for ledger_path in ledger_paths:
+        designs, wall_times = ledger_timings(ledger_path)
+        all_runs.append(designs.assign(wall_time=wall_times))
+    for log_glob in profile_logs:
+        all_runs.append(load_profiles(log_glob))
+    for broker_path in broker_paths:
+        designs, wall_times = task_timings(broker_path)
+        all_runs.append(designs.assign(wall_time=wall_times))
+
+    predictor = RuntimePredictor(gm_path=gm_path)
+    all_runs = [runs for runs in all_runs if set(design_cols) <= set(runs.columns)]
+    if len(all_runs) == 0:
+        return(predictor)
+
+    all_runs = pd.concat([runs[design_cols+['wall_time']+
+                               (['run_key'] if 'run_key' in runs.columns else [])]
+                          for runs in all_runs], axis=0, ignore_index=True)
+    all_runs = all_runs.dropna(subset=design_cols+['wall_time'])
+    if 'run_key' in all_runs.columns:
+        repeated = all_runs['run_key'].notna() & all_runs.duplicated('run_key')
+        all_runs = all_runs[~repeated]
+    if len(all_runs) >= min_runs:
+        predictor.fit(all_runs, all_runs['wall_time'])
+    return(predictor)
+
+# longest processing time first: each task goes to the shard with the least
+# expected work so far. returns the shard of every task
+def balance_shards(expected_time, n_shards):
+    import heapq
+    import numpy as np
+
+    expected_time = np.asarray(expected_time, dtype=float)
+    shard_of = np.zeros(len(expected_time), dtype=int)
+    loads = [(0.0, i_shard) for i_shard in range(n_shards)]
+    for i_task in np.argsort(-expected_time, kind='stable'):
+        load, i_shard = heapq.heappop(loads)
+        shard_of[i_task] = i_shard
+        heapq.heappush(loads, (load + expected_time[i_task], i_shard))
+    return(shard_of)
+
+# for several nodes: split the pending tasks of a broker into n_shards task
+# files of about equal expected work
+def split_broker(broker_path, n_shards):
+    import pickle
+    import pandas as pd
+
+    broker = TaskBroker(broker_path)
+    rows = broker.conn.execute('''SELECT design, expected FROM tasks
+                                  WHERE status = 'pending' ORDER BY task_id''').fetchall()
+    broker.close()
+
+    designs = pd.DataFrame([pickle.loads(blob) for blob, expected in rows])
+    expected_time = [1.0 if expected is None else expected 
+                     for blob, expected in rows]
+    shard_of = balance_shards(expected_time, n_shards)
+
+    shard_paths = []
+    for i_shard in range(n_shards):
+        shard_path = broker_path.replace('.db', '_shard_'+str(i_shard)+'.db')
+        shard = TaskBroker(shard_path)
+        in_shard = shard_of == i_shard
+        shard.add_tasks(designs[in_shard],
+                        expected_time=[t for t, keep in zip(expected_time, in_shard)
+                                       if keep])
+        shard.close()
+        shard_paths.append(shard_path)
+    return(shard_paths)
+
+# worker process: runs the designs sent through conn until it gets None
+def _runner_worker(conn, gm_path, output_path, profile_path):
+    import os
+    import time
+    import socket
+    import traceback
+    from experiment import run_nlth
+
+    worker_name = 'worker_'+socket.gethostname()+'_'+str(os.getpid())
+    worker_path = output_path+worker_name+'/'
+    os.makedirs(worker_path, exist_ok=True)
+    profile_log = profile_path+worker_name+'.jsonl'
+
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        task_id, design = task
+        t0 = time.time()
+        try:
+            bldg_result = run_nlth(design, gm_path=gm_path, output_path=worker_path,
+                                   profile_log=profile_log)
+            conn.send((task_id, bldg_result, time.time() - t0, None))
+        except Exception:
+            conn.send((task_id, None, time.time() - t0, traceback.format_exc()))
+
+def _start_worker(gm_path, output_path, profile_path):
+    import multiprocessing as mp
+
+    parent_conn, child_conn = mp.Pipe()
+    process = mp.Process(target=_runner_worker,
+                         args=(child_conn, gm_path, output_path, profile_path),
+                         daemon=True)
+    process.start()
+    return({'process': process, 'conn': parent_conn, 'task': None, 'started': None,
+            'exited': False})
+
+def _dashboard(broker, t_start, n_workers):
+    import time
+
+    counts = broker.counts()
+    n_total = sum(counts.values())
+    elapsed = time.time() - t_start
+    mean_time = broker.mean_wall_time()
+    if mean_time is None:
+        eta_str = '--'
+    else:
+        eta = mean_time*(counts['pending'] + counts['running']/2)/n_workers
+        eta_str = '%.0f min' % (eta/60)
+    print('[%6.0f min] %d/%d done | %d failed | %d running | %d pending | ETA %s' %
+          (elapsed/60, counts['done'], n_total, counts['failed'],
+           counts['running'], counts['pending'], eta_str))
+
+# keeps n_workers busy with the pending tasks of broker until none are left.
+# timeout: seconds before a run is killed and retried. finished runs are also
+# committed to ledger, if given. the run profiles of each worker go to
+# profile_path, by default <broker file>_profiles/ next to the broker
+def run_tasks(broker, n_workers, gm_path=gm_path_default, output_path='./outputs/',
+              timeout=None, max_retries=1, ledger=None, report_interval=60.0,
+              profile_path=None):
+    import os
+    import time
+    import socket
+    from multiprocessing.connection import wait
+
+    os.makedirs(output_path, exist_ok=True)
+    if profile_path is None:
+        profile_path = os.path.splitext(broker.path)[0]+'_profiles/'
+    runner_name = socket.gethostname()+':'+str(os.getpid())
+
+    if timeout is not None:
+        broker.requeue_stale(2*timeout)
+
+    workers = [_start_worker(gm_path, output_path, profile_path)
+               for i in range(n_workers)]
+    t_start = time.time()
+    t_report = t_start
+    out_of_tasks = False
+
+    def fail(worker, error):
+        task_id = worker['task'][0]
+        if broker.release(task_id, error, max_retries=max_retries):
+            print('Task %d failed, requeued: %s' % (task_id, error.splitlines()[-1]))
+        else:
+            print('Task %d failed, giving up: %s' % (task_id, error.splitlines()[-1]))
+        worker['task'] = None
+
+    while True:
+        # hand out tasks to free workers
+        for worker in workers:
+            if (worker['task'] is None) and not out_of_tasks:
+                task = broker.claim(runner_name)
+                if task is None:
+                    out_of_tasks = True
+                    continue
+                worker['task'] = task
+                worker['started'] = time.time()
+                worker['conn'].send(task)
+
+        busy = [worker for worker in workers if worker['task'] is not None]
+        if len(busy) == 0:
+            # requeued tasks may have come back after we ran out
+            if broker.counts()['pending'] == 0:
+                break
+            out_of_tasks = False
+            continue
+
+        ready = wait([worker['conn'] for worker in busy], timeout=1.0)
+        for worker in busy:
+            if worker['conn'] in ready:
+                try:
+                    task_id, bldg_result, wall_time, error = worker['conn'].recv()
+                except EOFError:
+                    worker['exited'] = True
+                    error = 'worker exited'
+                    bldg_result = None
+                if bldg_result is None:
+                    fail(worker, error)
+                    out_of_tasks = False
+                else:
+                    broker.complete(task_id, bldg_result, wall_time=wall_time)
+                    if ledger is not None:
+                        ledger.commit(worker['task'][1], bldg_result,
+                                      wall_time=wall_time)
+                    worker['task'] = None
+                    out_of_tasks = False
+
+        # kill runs over the timeout and replace crashed workers
+        for i_worker, worker in enumerate(workers):
+            overdue = ((worker['task'] is not None) and (timeout is not None) and
+                       (time.time() - worker['started'] > timeout))
+            exited = worker['exited'] or not worker['process'].is_alive()
+            if overdue or exited:
+                if worker['task'] is not None:
+                    if overdue:
+                        fail(worker, 'timed out after %.0f s' % timeout)
+                    else:
+                        fail(worker, 'worker exited')
+                worker['process'].terminate()
+                worker['process'].join()
+                workers[i_worker] = _start_worker(gm_path, output_path, profile_path)
+                out_of_tasks = False
+
+        if time.time() - t_report > report_interval:
+            _dashboard(broker, t_start, n_workers)
+            t_report = time.time()
+
+    for worker in workers:
+        worker['conn'].send(None)
+        worker['process'].join()
+
+    _dashboard(broker, t_start, n_workers)
+    return(broker.results())
+
+############################################################################
+#               Command line
+
+# python runner.py gen <size> <seed> --n_workers 48
+# python runner.py ida <run_case> --n_workers 48
+# python runner.py join <broker_path> --n_workers 48   (same node, or a shard)
+# python runner.py split <broker_path> <n_shards>      (one shard per node)
+############################################################################
+
+# queue the designs, longest expected run first (untrained predictor if None)
+def queue_designs(broker, all_designs, predictor=None):
+    if predictor is None:
+        predictor = RuntimePredictor()
+    broker.add_tasks(all_designs, expected_time=predictor.predict(all_designs))
+
+def run_gen(size, seed, n_workers, timeout=None, max_retries=1, predictor=None):
+    from db import Database
+    from store import save_database_if_available
+    import os
+    import pickle
+
+    prep_path = '../data/structural_db_seed_'+str(seed)+'_prepared.pickle'
+    broker = TaskBroker('../data/structural_db_seed_'+str(seed)+'_tasks.db')
+
+    if os.path.exists(prep_path):
+        with open(prep_path, 'rb') as f:
+            main_obj = pickle.load(f)
+    else:
+        main_obj = Database(n_points=size, seed=seed)
+        main_obj.design_bearings(filter_designs=True)
+        main_obj.design_structure(filter_designs=True)
+        main_obj.scale_gms()
+        with open(prep_path, 'wb') as f:
+            pickle.dump(main_obj, f)
+
+    if len(broker) == 0:
+        queue_designs(broker, main_obj.retained_designs.reset_index(),
+                      predictor=predictor)
+    db_results = run_tasks(broker, n_workers, timeout=timeout,
+                           max_retries=max_retries,
+                           output_path='./outputs/seed_'+str(seed)+'_output/')
+    broker.close()
+
+    if (db_results is None) or (len(db_results) == 0):
+        raise RuntimeError('No NLTH run finished for seed '+str(seed)+
+                           '; see the task file for the errors.')
+    db_results.to_csv('../data/structural_db_seed_'+str(seed)+'.csv', index=False)
+    main_obj.ops_analysis = db_results
+    
+    # same outputs as gen_db_thread.py
+    with open('../data/structural_db_seed_'+str(seed)+'.pickle', 'wb') as f:
+        pickle.dump(main_obj, f)
+    save_database_if_available(main_obj, '../data/structural_db_seed_'+str(seed))
+
+def run_ida(run_case_str, n_workers, timeout=None, max_retries=1, predictor=None):
+    import json
+
+    data_path = '../data/validation/'+run_case_str+'/'
+    broker = TaskBroker(data_path+'tasks.db')
+
+    # the IDA table is built once, by the first runner of the case
+    if len(broker) == 0:
+        from db import prepare_ida_util
+        with open('./inputs/'+run_case_str+'.in') as f:
+            design_dict = json.loads(f.read())
+        queue_designs(broker, prepare_ida_util(design_dict), predictor=predictor)
+
+    db_results = run_tasks(broker, n_workers, timeout=timeout,
+                           max_retries=max_retries,
+                           output_path='./outputs/'+run_case_str+'/')
+    broker.close()
+    
+    if (db_results is None) or (len(db_results) == 0):
+        raise RuntimeError('No IDA run finished for '+run_case_str+
+                           '; see the task file for the errors.')
+    db_results.to_csv(data_path+'ida_results.csv', index=False)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Run the NLTHs of a database or IDA case on a work queue.')
+    parser.add_argument('mode', type=str, choices=['gen', 'ida', 'join', 'split'])
+    parser.add_argument('args', type=str, nargs='+',
+                        help='gen: size seed | ida: run_case | join: broker_path | '+
+                        'split: broker_path n_shards')
+    parser.add_argument('--n_workers', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='seconds before a run is killed and retried')
+    parser.add_argument('--max_retries', type=int, default=1)
+    parser.add_argument('--journal_mode', type=str, default='WAL',
+                        help='join: DELETE for a task file on a network file system')
+    parser.add_argument('--train_ledgers', type=str, nargs='*', default=[],
+                        help='run ledgers of earlier runs, to fit the run time model')
+    parser.add_argument('--train_profiles', type=str, nargs='*', default=[],
+                        help='profile logs (globs) of earlier runs')
+    parser.add_argument('--train_tasks', type=str, nargs='*', default=[],
+                        help='task files of earlier runs')
+    args = parser.parse_args()
+
+    predictor = fit_runtime_predictor(ledger_paths=args.train_ledgers,
+                                      profile_logs=args.train_profiles,
+                                      broker_paths=args.train_tasks)
+    if args.mode == 'gen':
+        run_gen(int(args.args[0]), int(args.args[1]), args.n_workers,
+                timeout=args.timeout, max_retries=args.max_retries,
+                predictor=predictor)
+    elif args.mode == 'ida':
+        run_ida(args.args[0], args.n_workers, timeout=args.timeout,
+                max_retries=args.max_retries, predictor=predictor)
+    elif args.mode == 'split':
+        for shard_path in split_broker(args.args[0], int(args.args[1])):
+            print(shard_path)
+    else:
+        broker = TaskBroker(args.args[0], journal_mode=args.journal_mode)
+        run_tasks(broker, args.n_workers, timeout=args.timeout,
+                  max_retries=args.max_retries)
+        broker.close()
@@ -0,0 +1,406 @@
+############################################################################
+#               Columnar database store
+
+# Date created: October 2026
+
+# Description:  Saves the tables of a Database object as Parquet files in a
+#               versioned folder, instead of pickling the whole object.
+#               Per-story results (PID, ...) and member lists are kept as
+#               typed list columns and dicts of arrays (all_w_cases of tables
+#               made row by row) as one list column per key. Tables can be read back with column
+#               projection and row filters, so only the needed part of a
+#               dataset is loaded.
+
+# Open issues:  (1) attributes that are neither DataFrames nor plain values
+#               (e.g. the LHS sampler) are not stored
+#               (2) requires pyarrow
+
+############################################################################
+
+store_version = 1
+manifest_name = 'manifest.json'
+
+# rows are sorted by these (when present) before writing, so that filters on
+# the systems can skip whole row groups
+sort_cols = ['superstructure_system', 'isolator_system']
+row_col = '_row'
+key_sep = '/'
+
+def _is_missing(value):
+    import numpy as np
+    return (value is None) or (isinstance(value, float) and np.isnan(value))
+
+def _as_list(value):
+    import numpy as np
+    if _is_missing(value):
+        return None
+    return np.asarray(value).tolist()
+
+# split object columns into storable columns; returns the new frame and the
+# layout needed to put them back
+def _flatten(df):
+    import numpy as np
+    import pandas as pd
+
+    layout = {'columns': list(df.columns), 'list': [], 'array': [], 'dict': {}}
+    flat = {}
+    for col in df.columns:
+        series = df[col]
+        if series.dtype != object:
+            flat[col] = series.to_numpy()
+            continue
+
+        present = [v for v in series if not _is_missing(v)]
+        if len(present) == 0:
+            flat[col] = series.to_numpy()
+        elif all(isinstance(v, dict) for v in present):
+            keys = list(present[0].keys())
+            layout['dict'][col] = keys
+            for key in keys:
+                flat[col+key_sep+key] = [None if _is_missing(v) else
+                                         _as_list(v[key]) for v in series]
+        elif all(isinstance(v, (list, tuple, np.ndarray)) for v in present):
+            if all(isinstance(v, np.ndarray) for v in present):
+                layout['array'].append(col)
+            else:
+                layout['list'].append(col)
+            flat[col] = [_as_list(v) for v in series]
+        else:
+            # numbers held in object columns (e.g. from apply) become numeric
+            converted = pd.to_numeric(series, errors='coerce')
+            if converted.notna().sum() == len(present):
+                flat[col] = converted.to_numpy()
+            else:
+                flat[col] = series.to_numpy()
+
+    return(pd.DataFrame(flat, index=df.index), layout)
+
+def _unflatten(df, layout):
+    import numpy as np
+
+    for col, keys in layout['dict'].items():
+        key_cols = [col+key_sep+key for key in keys]
+        if not all(key_col in df.columns for key_col in key_cols):
+            continue
+        values = []
+        for row in zip(*[df[key_col] for key_col in key_cols]):
+            if all(v is None for v in row):
+                values.append(np.nan)
+            else:
+                values.append({key: np.asarray(v) for key, v in zip(keys, row)})
+        df = df.drop(columns=key_cols)
+        df[col] = values
+
+    for col in layout['list']:
+        if col in df.columns:
+            df[col] = [np.nan if v is None else list(v) for v in df[col]]
+
+    for col in layout['array']:
+        if col in df.columns:
+            df[col] = [np.nan if v is None else np.asarray(v) for v in df[col]]
+
+    return(df[[col for col in layout['columns'] if col in df.columns]])
+
+def save_table(df, path, row_group_size=1000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import json
+
+    flat, layout = _flatten(df)
+    flat[row_col] = range(len(flat))
+
+    present_sort = [col for col in sort_cols if col in flat.columns]
+    if len(present_sort) > 0:
+        flat = flat.sort_values(present_sort + [row_col], kind='stable')
+
+    table = pa.Table.from_pandas(flat, preserve_index=True)
+    meta = dict(table.schema.metadata or {})
+    meta[b'store_layout'] = json.dumps(layout).encode()
+    meta[b'store_version'] = str(store_version).encode()
+    table = table.replace_schema_metadata(meta)
+    pq.write_table(table, path, row_group_size=row_group_size)
+
+# columns: list of columns to read (None for all); columns the table does not
+# have are skipped. a dict column such as all_w_cases is read whole by naming it
+# filters: pyarrow filters, e.g. [('superstructure_system', '=', 'MF')]
+def load_table(path, columns=None, filters=None):
+    import pyarrow.parquet as pq
+    import json
+
+    schema = pq.read_schema(path)
+    layout = json.loads(schema.metadata[b'store_layout'])
+    version = int(schema.metadata[b'store_version'])
+    if version > store_version:
+        raise ValueError('%s was written by store version %d (this is %d)' %
+                         (path, version, store_version))
+
+    read_cols = None
+    if columns is not None:
+        # the index is stored as column(s) and must be read along
+        index_cols = [col for col in schema.pandas_metadata['index_columns']
+                      if isinstance(col, str)]
+        read_cols = index_cols + [row_col]
+        for col in columns:
+            if col in layout['dict']:
+                read_cols += [col+key_sep+key for key in layout['dict'][col]]
+            else:
+                read_cols.append(col)
+        read_cols = [col for col in read_cols if col in schema.names]
+
+    table = pq.read_table(path, columns=read_cols, filters=filters)
+    df = table.to_pandas()
+    df = df.sort_values(row_col, kind='stable').drop(columns=[row_col])
+    return(_unflatten(df, layout))
+
+# saves every DataFrame attribute of the database (and plain attributes into
+# the manifest)
+def save_database(db_obj, path, row_group_size=1000):
+    import os
+    import json
+    import pandas as pd
+
+    os.makedirs(path, exist_ok=True)
+
+    manifest = {'store_version': store_version, 'tables': [], 'attributes': {}}
+    for name, value in vars(db_obj).items():
+        if isinstance(value, pd.DataFrame):
+            save_table(value, os.path.join(path, name+'.parquet'),
+                       row_group_size=row_group_size)
+            manifest['tables'].append(name)
+        elif isinstance(value, (int, float, str, bool, list, dict)):
+            try:
+                json.dumps(value)
+            except TypeError:
+                continue
+            manifest['attributes'][name] = value
+
+    with open(os.path.join(path, manifest_name), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+# save_database for batch jobs, which keep their pickle as the primary output:
+# the store is skipped (returns False) if pyarrow is missing or cannot be
+# imported, instead of failing the job after its analyses
+def save_database_if_available(db_obj, path, row_group_size=1000):
+    try:
+        import pyarrow
+    except ImportError as err:
+        print('Columnar store skipped, pyarrow not usable: %s' % err)
+        return(False)
+    save_database(db_obj, path, row_group_size=row_group_size)
+    return(True)
+
+# tables: names of the tables to load (None for all). columns and filters
+# apply to every loaded table. returns a Database, without resampling
+def load_database(path, tables=None, columns=None, filters=None):
+    import os
+    import json
+    from db import Database
+
+    with open(os.path.join(path, manifest_name), 'r') as f:
+        manifest = json.load(f)
+
+    db_obj = Database.__new__(Database)
+    for name, value in manifest['attributes'].items():
+        setattr(db_obj, name, value)
+
+    if tables is None:
+        tables = manifest['tables']
+    for name in tables:
+        setattr(db_obj, name, load_table(os.path.join(path, name+'.parquet'),
+                                         columns=columns, filters=filters))
+    return(db_obj)
+
+# convert a pickled Database (or DataFrame) to the columnar store
+def convert_pickle(pickle_path, path):
+    import os
+    import pandas as pd
+
+    obj = pd.read_pickle(pickle_path)
+    if isinstance(obj, pd.DataFrame):
+        os.makedirs(path, exist_ok=True)
+        save_table(obj, os.path.join(path, 'table.parquet'))
+    else:
+        save_database(obj, path)
+
+############################################################################
+#              Merging sharded results
+
+# HPC runs write one result file per seed or per IDA row. merge_shards
+# streams over them and writes a compacted folder of a few large Parquet
+# parts, keeping only the first result of each run (ledger.run_key of the
+# design columns)
+############################################################################
+
+part_name = 'part-%05d.parquet'
+
+# shards in a folder matching pattern; for shards saved in several formats,
+# the pickle is preferred over the parquet, then the csv
+def list_shards(shard_dir, pattern='*'):
+    import os
+    import fnmatch
+
+    preference = {'.pickle': 0, '.parquet': 1, '.csv': 2}
+    chosen = {}
+    with os.scandir(shard_dir) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if (ext not in preference) or not entry.is_file():
+                continue
+            if not fnmatch.fnmatch(entry.name, pattern):
+                continue
+            if (stem not in chosen) or (preference[ext] <
+                                        preference[chosen[stem][0]]):
+                chosen[stem] = (ext, entry.path)
+
+    # row_2 before row_10
+    def natural_key(stem):
+        import re
+        return([int(part) if part.isdigit() else part 
+                for part in re.split(r'(\d+)', stem)])
+
+    return([chosen[stem][1] for stem in sorted(chosen, key=natural_key)])
+
+# a shard as a DataFrame. pickled Databases give their table attribute
+def read_shard(shard_path, table='ops_analysis'):
+    import os
+    import pandas as pd
+
+    ext = os.path.splitext(shard_path)[1]
+    if ext == '.csv':
+        return(pd.read_csv(shard_path))
+    if ext == '.parquet':
+        return(load_table(shard_path))
+
+    obj = pd.read_pickle(shard_path)
+    if isinstance(obj, pd.Series):
+        obj = obj.to_frame().T
+    elif not isinstance(obj, pd.DataFrame):
+        obj = getattr(obj, table)
+    return(obj)
+
+# runs are keyed on their design and ground motion only, so that a rerun
+# with a different outcome is still a duplicate
+def _shard_keys(df):
+    from ledger import run_key, _canonical, result_cols
+
+    design_df = df.drop(columns=[col for col in result_cols if col in df.columns])
+    if ('gm_selected' in design_df.columns) and ('scale_factor' in design_df.columns):
+        return([run_key(row) for _, row in design_df.iterrows()])
+    return([';'.join(k+'='+_canonical(row[k]) for k in sorted(row.index))
+            for _, row in design_df.iterrows()])
+
+# dtype class of a column for the schema check: numbers of any width (and
+# bools) are compatible, and a column with no values matches anything
+def _column_kind(series):
+    if series.isna().all():
+        return(None)
+    if series.dtype.kind in 'biuf':
+        return('number')
+    return(series.dtype.kind)
+
+# shard_dir: folder of the shards, pattern: e.g. 'row_*' or
+# 'structural_db_seed_*'. only chunk_rows rows are held at a time. shards
+# whose columns or column dtypes differ from the first one raise, or are
+# skipped with skip_invalid=True
+def merge_shards(shard_dir, out_path, pattern='*', table='ops_analysis',
+                 chunk_rows=20000, skip_invalid=False):
+    import os
+    import json
+    import pandas as pd
+
+    os.makedirs(out_path, exist_ok=True)
+    shard_paths = list_shards(shard_dir, pattern)
+
+    columns = None
+    kinds = {}
+    seen = set()
+    chunk = []
+    n_chunk = 0
+    parts = []
+    n_dupes = 0
+    skipped = []
+
+    def write_chunk():
+        part_path = os.path.join(out_path, part_name % len(parts))
+        save_table(pd.concat(chunk, axis=0, ignore_index=True), part_path)
+        parts.append(os.path.basename(part_path))
+
+    for shard_path in shard_paths:
+        df = read_shard(shard_path, table=table)
+
+        msg = None
+        if columns is None:
+            columns = list(df.columns)
+        elif set(df.columns) != set(columns):
+            msg = ('%s: columns differ from the first shard (missing %s, extra %s)' %
+                   (shard_path, sorted(set(columns) - set(df.columns)),
+                    sorted(set(df.columns) - set(columns))))
+        
+        if msg is None:
+            shard_kinds = {col: _column_kind(df[col]) for col in columns}
+            mismatched = [col for col in columns
+                          if (kinds.get(col) is not None) and 
+                          (shard_kinds[col] is not None) and
+                          (shard_kinds[col] != kinds[col])]
+            if len(mismatched) > 0:
+                msg = ('%s: column dtypes differ from the earlier shards (%s)' %
+                       (shard_path, ', '.join('%s: %s, not %s' % 
+                                              (col, df[col].dtype, kinds[col])
+                                              for col in mismatched)))
+        
+        if msg is not None:
+            if not skip_invalid:
+                raise ValueError(msg)
+            print(msg)
+            skipped.append(shard_path)
+            continue
+        
+        for col, kind in shard_kinds.items():
+            if kinds.get(col) is None:
+                kinds[col] = kind
+
+        # drop runs that are already merged
+        keys = _shard_keys(df)
+        keep = []
+        for key in keys:
+            keep.append(key not in seen)
+            seen.add(key)
+        n_dupes += len(keep) - sum(keep)
+        df = df.loc[keep, columns]
+        if df.shape[0] == 0:
+            continue
+
+        chunk.append(df)
+        n_chunk += df.shape[0]
+        if n_chunk >= chunk_rows:
+            write_chunk()
+            chunk = []
+            n_chunk = 0
+
+    if n_chunk > 0:
+        write_chunk()
+
+    manifest = {'store_version': store_version, 'parts': parts,
+                'shards': len(shard_paths), 'skipped': skipped,
+                'rows': len(seen), 'duplicates': n_dupes}
+    with open(os.path.join(out_path, manifest_name), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print('Merged %d shards into %d parts: %d runs, %d duplicates dropped, %d shards skipped.' %
+          (len(shard_paths), len(parts), len(seen), n_dupes, len(skipped)))
+    return(manifest)
+
+# all parts of a merged dataset as one DataFrame
+def load_merged(path, columns=None, filters=None):
+    import os
+    import json
+    import pandas as pd
+
+    with open(os.path.join(path, manifest_name), 'r') as f:
+        manifest = json.load(f)
+
+    frames = [load_table(os.path.join(path, part), columns=columns,
+                         filters=filters) for part in manifest['parts']]
+    if len(frames) == 0:
+        return(pd.DataFrame())
+    return(pd.concat(frames, axis=0, ignore_index=True))
@@ -36,15 +36,6 @@ def ida_run_row(row_num, run_case_str):
         shutil.rmtree(output_path)
     os.makedirs(output_path)
     
-    # run one single run
-    thread_row = ida_df.iloc[row_num]
-    gm_path='../resource/ground_motions/PEERNGARecords_Unscaled/'
-    from experiment import run_nlth
-    print('========= Run %d of %d ==========' % 
-          (row_num+1, len(ida_df)))
-    bldg_result = run_nlth(thread_row, gm_path, output_path)
-    db_results = pd.DataFrame(bldg_result).T
-    
     # store the csv results
     data_path = '../data/validation/'+run_case_str+'/'
     
@@ -53,6 +44,32 @@ def ida_run_row(row_num, run_case_str):
     else:
         os.makedirs(data_path)
     
+    # one ledger per row: the rows run as concurrent tasks on a shared file
+    # system, where a common SQLite file (and WAL) is not safe. a row already
+    # in its ledger is not rerun. the ledgers of a case are combined with
+    # ledger.merge_ledgers
+    from ledger import RunLedger
+    ledger = RunLedger(data_path+'ledgers/row_'+str(row_num)+'.db',
+                       journal_mode='DELETE')
+    
+    # run one single run
+    thread_row = ida_df.iloc[row_num]
+    gm_path='../resource/ground_motions/PEERNGARecords_Unscaled/'
+    from experiment import run_nlth
+    print('========= Run %d of %d ==========' % 
+          (row_num+1, len(ida_df)))
+    if thread_row in ledger:
+        print('Run found in ledger, skipping analysis.')
+        bldg_result = ledger.get(thread_row)
+    else:
+        import time
+        t0 = time.time()
+        bldg_result = run_nlth(thread_row, gm_path, output_path,
+                               profile_log=data_path+'profiles/row_'+str(row_num)+'.jsonl')
+        ledger.commit(thread_row, bldg_result, wall_time=time.time()-t0)
+    ledger.close()
+    db_results = pd.DataFrame(bldg_result).T
+    
     output_str = 'row_'+str(row_num)
     db_results.to_csv(data_path+output_str+'.csv', index=False)
     
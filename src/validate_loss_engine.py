@@ -0,0 +1,78 @@
+############################################################################
+#               Loss engine validation
+
+# Date created: October 2026
+
+# Description:  Compares the analytic loss engine with the full Pelicun
+#               assessment (loss.compare_loss_engines) on a few MF and CBF
+#               designs of an analyzed database: aggregate loss quantiles,
+#               collapse and irreparable frequencies, component group
+#               quantiles and the wall time of each engine.
+
+#               The analytic engine is accepted if every design passes
+#               loss.check_loss_engines (frequencies within 0.05, aggregate
+#               quantiles within 10%, group quartiles within 25%); the
+#               script exits with status 1 otherwise.
+
+# Open issues:  (1) the engines draw different realizations, so differences
+#               within sampling noise are expected
+
+############################################################################
+
+def validate_loss_engine(db_path, n_designs=3, seed=0,
+                         output_path='../data/loss_engine_comparison.csv'):
+    import pandas as pd
+    from loss import compare_loss_engines, check_loss_engines
+    
+    main_obj = pd.read_pickle(db_path)
+    df = main_obj.ops_analysis.reset_index(drop=True)
+    
+    # a few designs of each superstructure
+    picked = [df[df['superstructure_system'] == struct_sys].sample(
+                  n=min(n_designs, (df['superstructure_system'] == struct_sys).sum()),
+                  random_state=seed)
+              for struct_sys in ['MF', 'CBF']]
+    df = pd.concat(picked, axis=0)
+    
+    comparison = compare_loss_engines(df)
+    comparison.to_csv(output_path, index=False)
+    
+    shown = ['wall_time', 'collapse_freq', 'irreparable_freq',
+             'cost_10%', 'cost_50%', 'cost_90%',
+             'time_l_10%', 'time_l_50%', 'time_l_90%',
+             'B_50%', 'C_50%', 'D_50%', 'E_50%']
+    for run_idx, runs in comparison.groupby('run_idx', sort=False):
+        print('========= Design %d (%s, %d stories) ==========' %
+              (run_idx, runs['superstructure_system'].iloc[0],
+               runs['num_stories'].iloc[0]))
+        print(runs.set_index('engine')[shown].T.to_string(float_format='%.3g'))
+        
+    failed = check_loss_engines(comparison)
+    if failed.empty:
+        print('Analytic engine accepted on all %d designs.' %
+              comparison['run_idx'].nunique())
+    else:
+        print('Analytic engine outside tolerance:')
+        print(failed.to_string(index=False, float_format='%.3g'))
+    return(comparison, failed)
+
+import argparse
+
+parser = argparse.ArgumentParser(
+    description='Compare the analytic and Pelicun loss engines.')
+parser.add_argument('db_path', type=str,
+                    help='pickled Database with ops_analysis')
+parser.add_argument('--n_designs', type=int, default=3,
+                    help='designs per superstructure system')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--output_path', type=str,
+                    default='../data/loss_engine_comparison.csv')
+
+args = parser.parse_args()
+comparison, failed = validate_loss_engine(args.db_path,
+                                          n_designs=args.n_designs,
+                                          seed=args.seed,
+                                          output_path=args.output_path)
+if not failed.empty:
+    import sys
+    sys.exit(1)
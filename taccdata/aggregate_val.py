@@ -52,5 +52,12 @@ def agg_data(run_case):
     with open(final_path+run_case+'.pickle', 'wb') as f:
         pickle.dump(dummy_obj, f)
         
+    # the rows kept one ledger each (val_ida_thread), combine them
+    import glob
+    from ledger import merge_ledgers
+    ledger_paths = sorted(glob.glob(final_path+'ledgers/row_*.db'))
+    if len(ledger_paths) > 0:
+        merge_ledgers(ledger_paths, final_path+'ledger.db')
+        
 
 agg_data(run_case)
\ No newline at end of file